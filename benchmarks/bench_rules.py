@@ -0,0 +1,335 @@
+"""规则引擎基准测试
+
+生成模拟 Warp 客户端流量的 URL 语料和不同规模的规则集，测量：
+    - 单条 Rule.match 的开销
+    - RuleMatcher 的构建耗时、吞吐量和单次匹配延迟分布
+    - WarpHandler.request 端到端耗时（使用 mitmproxy.test.tflow 构造的离线 flow）
+
+结果写入 JSON 文件，可用 --compare 与之前的结果对比；同时指定 --max-regression
+时，有基准退化超过该百分比则以非零状态退出，便于在 CI 中使用。
+
+用法:
+    python -m benchmarks.bench_rules
+    python -m benchmarks.bench_rules --sizes 10 1000 --output bench.json
+    python -m benchmarks.bench_rules --compare old.json
+    python -m benchmarks.bench_rules --compare old.json --max-regression 10
+"""
+
+import argparse
+import json
+import logging
+import platform
+import random
+import re
+import string
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import yaml
+
+from src.core.config import Config
+from src.utils.histogram import LogHistogram
+from src.utils.rules import Rule, RuleMatcher, RuleType
+
+DEFAULT_SIZES = (10, 1000, 10000, 100000)
+RULE_TYPES = (RuleType.EXACT, RuleType.CONTAINS, RuleType.REGEX, RuleType.WILDCARD, RuleType.HOST)
+
+# Warp 客户端常见的请求目标
+WARP_HOSTS = (
+    "app.warp.dev",
+    "api.warp.dev",
+    "releases.warp.dev",
+    "securetoken.googleapis.com",
+    "o540343.ingest.sentry.io",
+    "dataplane.rudderstack.com",
+)
+WARP_PATHS = (
+    "/graphql/v2?op=GetUpdatedCloudObjects",
+    "/graphql/v2?op=GetUser",
+    "/graphql/v2?op=GetWorkspacesMetadataForUser",
+    "/ai/multi-agent",
+    "/ai/generate_am_query_suggestions",
+    "/analytics/block",
+    "/proxy/sentry/api/1/envelope/",
+    "/v1/token?key=AIzaSy",
+    "/v1/batch",
+    "/api/1/envelope/?sentry_key=abc&sentry_version=7",
+    "/channel_versions.json",
+)
+
+
+def _word(rng: random.Random, n: int = 8) -> str:
+    return "".join(rng.choice(string.ascii_lowercase) for _ in range(n))
+
+
+def make_corpus(size: int, seed: int = 1) -> List[Tuple[str, str]]:
+    """生成 (url, host) 语料，约八成是 Warp 常见请求，其余为随机站点"""
+    rng = random.Random(seed)
+    corpus = []
+    for _ in range(size):
+        if rng.random() < 0.8:
+            host = rng.choice(WARP_HOSTS)
+            path = rng.choice(WARP_PATHS)
+        else:
+            host = f"{_word(rng, 6)}.{rng.choice(('com', 'net', 'io', 'dev'))}"
+            path = f"/{_word(rng, 5)}/{_word(rng, 7)}?id={rng.randint(1, 10 ** 6)}"
+        corpus.append((f"https://{host}{path}", host))
+    return corpus
+
+
+def make_patterns(rule_type: RuleType, size: int, seed: int = 2) -> List[str]:
+    """生成指定类型和数量的规则模式，其中少量会命中语料"""
+    rng = random.Random(seed)
+    hitting = {
+        RuleType.EXACT: ["https://app.warp.dev/analytics/block"],
+        RuleType.CONTAINS: ["app.warp.dev/analytics/block", "/proxy/sentry"],
+        RuleType.REGEX: [r"^https://o\d+\.ingest\.sentry\.io/", r"dataplane\.rudderstack\.com/v1/"],
+        RuleType.WILDCARD: ["*.ingest.sentry.io/*", "https://app.warp.dev/proxy/*"],
+        RuleType.HOST: ["o540343.ingest.sentry.io", "*.rudderstack.com"],
+    }[rule_type]
+
+    patterns = list(hitting[:size])
+    while len(patterns) < size:
+        domain = f"{_word(rng)}.{rng.choice(('com', 'net', 'io'))}"
+        segment = _word(rng, 6)
+        if rule_type == RuleType.EXACT:
+            patterns.append(f"https://{domain}/{segment}")
+        elif rule_type == RuleType.CONTAINS:
+            patterns.append(f"{domain}/{segment}")
+        elif rule_type == RuleType.REGEX:
+            patterns.append(
+                rng.choice(
+                    (
+                        rf"^https://{re.escape(domain)}/",
+                        rf"/{segment}/\d+",
+                        rf"{segment}[a-z]*\.(js|css)$",
+                        rf"[?&]{segment}=",
+                    )
+                )
+            )
+        elif rule_type == RuleType.WILDCARD:
+            patterns.append(rng.choice((f"*.{domain}/*", f"*/{segment}/*", f"https://{domain}/*")))
+        else:
+            patterns.append(rng.choice((domain, f"*.{domain}")))
+    return patterns
+
+
+def _timed_loop(func, inputs, repeat: int) -> Tuple[float, LogHistogram]:
+    """逐次计时执行 func(*args)，返回 (总耗时秒数, 纳秒直方图)"""
+    hist = LogHistogram()
+    clock = time.perf_counter_ns
+    total = 0
+    for _ in range(repeat):
+        for args in inputs:
+            start = clock()
+            func(*args)
+            elapsed = clock() - start
+            total += elapsed
+            hist.record(elapsed)
+    return total / 1e9, hist
+
+
+def _result(bench: str, rule_type: str, size: int, seconds: float, hist: LogHistogram, **extra):
+    summary = hist.summary()
+    return {
+        "bench": bench,
+        "rule_type": rule_type,
+        "size": size,
+        "ops": hist.count,
+        "ops_per_sec": round(hist.count / seconds, 1) if seconds else 0,
+        "p50_ns": round(summary["p50"]),
+        "p99_ns": round(summary["p99"]),
+        "max_ns": summary["max"],
+        **extra,
+    }
+
+
+def bench_rule(corpus, repeat: int) -> List[Dict]:
+    """单条 Rule.match"""
+    results = []
+    for rule_type in RULE_TYPES:
+        rule = Rule(make_patterns(rule_type, 1)[0], rule_type)
+        inputs = [(host if rule_type == RuleType.HOST else url,) for url, host in corpus]
+        seconds, hist = _timed_loop(rule.match, inputs, repeat)
+        results.append(_result("rule.match", rule_type.value, 1, seconds, hist))
+    return results
+
+
+def bench_matcher(corpus, sizes, repeat: int) -> List[Dict]:
+    """RuleMatcher 构建与匹配"""
+    results = []
+    for rule_type in RULE_TYPES:
+        for size in sizes:
+            patterns = make_patterns(rule_type, size)
+            start = time.perf_counter()
+            matcher = RuleMatcher()
+            matcher.add_rules(patterns, rule_type)
+            matcher.compile()
+            build_ms = (time.perf_counter() - start) * 1000
+
+            inputs = [(url, host) for url, host in corpus]
+            hits = sum(1 for url, host in corpus if matcher.match(url, host))
+            seconds, hist = _timed_loop(matcher.match, inputs, repeat)
+            results.append(
+                _result(
+                    "matcher.match", rule_type.value, size, seconds, hist,
+                    build_ms=round(build_ms, 2), hit_rate=round(hits / len(corpus), 4),
+                )
+            )
+            print(f"  matcher {rule_type.value:<8} {size:>7}: build {build_ms:9.1f}ms, "
+                  f"p99 {results[-1]['p99_ns'] / 1000:8.1f}us", flush=True)
+    return results
+
+
+def bench_handler(corpus, sizes, repeat: int) -> List[Dict]:
+    """WarpHandler.request 端到端（含判定缓存与不含缓存两种情况）"""
+    from mitmproxy.test import tflow, tutils
+    from src.handlers.warp import WarpHandler
+
+    flows = []
+    for url, _ in corpus:
+        flow = tflow.tflow(req=tutils.treq())
+        flow.request.url = url
+        flows.append(flow)
+
+    def run(handler, flow):
+        handler.request(flow)
+        flow.response = None
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for size in sizes:
+            # 按类型平均分配规则，模拟混合规则集
+            per_type = max(1, size // len(RULE_TYPES))
+            block = [
+                f"{rule_type.value}:{pattern}"
+                for rule_type in RULE_TYPES
+                for pattern in make_patterns(rule_type, per_type)
+            ]
+            for cache_size in (4096, 0):
+                path = Path(tmp) / f"config_{size}_{cache_size}.yaml"
+                path.write_text(
+                    yaml.safe_dump(
+                        {
+                            "rules": {"block": block, "cache_size": cache_size, "snapshot_dir": ""},
+                            "streaming": {"paths": ["/ai/multi-agent"]},
+                        }
+                    ),
+                    encoding="utf-8",
+                )
+                start = time.perf_counter()
+                handler = WarpHandler(Config(str(path)))
+                build_ms = (time.perf_counter() - start) * 1000
+
+                inputs = [(handler, flow) for flow in flows]
+                seconds, hist = _timed_loop(run, inputs, repeat)
+                results.append(
+                    _result(
+                        "warp_handler.request", "mixed", len(block), seconds, hist,
+                        build_ms=round(build_ms, 2), cache_size=cache_size,
+                    )
+                )
+    return results
+
+
+def _git_revision() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except Exception:
+        return ""
+
+
+def compare(current: Dict, baseline_path: str, max_regression: Optional[float] = None) -> List[Dict]:
+    """与之前的结果文件对比吞吐量和 p99
+
+    max_regression 为允许的退化百分比：吞吐量下降或 p99 上升超过该比例的
+    基准被标记并返回，未指定时只打印对比。
+    """
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+
+    def key(r):
+        return (r["bench"], r["rule_type"], r["size"], r.get("cache_size"))
+
+    old = {key(r): r for r in baseline["results"]}
+    regressions = []
+    print(f"\nCompared with {baseline_path} ({baseline['meta'].get('git_revision', '?')}):")
+    print(f"{'bench':<22}{'type':<10}{'size':>8}{'ops/s':>14}{'p99':>14}")
+    for r in current["results"]:
+        prev = old.get(key(r))
+        if not prev:
+            continue
+        ops = r["ops_per_sec"] / prev["ops_per_sec"] if prev["ops_per_sec"] else 0
+        p99 = r["p99_ns"] / prev["p99_ns"] if prev["p99_ns"] else 0
+        flag = ""
+        if max_regression is not None:
+            limit = max_regression / 100
+            if (prev["ops_per_sec"] and ops < 1 - limit) or (prev["p99_ns"] and p99 > 1 + limit):
+                regressions.append({**r, "ops_ratio": round(ops, 3), "p99_ratio": round(p99, 3)})
+                flag = "  ❌"
+        print(f"{r['bench']:<22}{r['rule_type']:<10}{r['size']:>8}{ops:>13.2f}x{p99:>13.2f}x{flag}")
+    if max_regression is not None:
+        if regressions:
+            print(f"\n❌ {len(regressions)} benchmark(s) regressed by more than {max_regression:g}%")
+        else:
+            print(f"\n✅ No benchmark regressed by more than {max_regression:g}%")
+    return regressions
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="WarpGateway 规则引擎基准测试")
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(DEFAULT_SIZES), help="规则集规模")
+    parser.add_argument("--corpus", type=int, default=2000, help="URL 语料条数")
+    parser.add_argument("--repeat", type=int, default=3, help="每组语料重复次数")
+    parser.add_argument("--output", "-o", default="bench_results.json", help="结果文件")
+    parser.add_argument("--compare", help="与之前的结果文件对比")
+    parser.add_argument(
+        "--max-regression", type=float, metavar="PERCENT",
+        help="与 --compare 一起使用：吞吐量下降或 p99 上升超过该百分比时以非零状态退出",
+    )
+    parser.add_argument("--skip-handler", action="store_true", help="跳过 WarpHandler 基准")
+    args = parser.parse_args(argv)
+    if args.max_regression is not None and not args.compare:
+        parser.error("--max-regression requires --compare")
+
+    # 基准期间屏蔽请求日志
+    logging.disable(logging.CRITICAL)
+
+    corpus = make_corpus(args.corpus)
+    results = []
+    print("Rule.match ...", flush=True)
+    results += bench_rule(corpus, args.repeat)
+    print("RuleMatcher.match ...", flush=True)
+    results += bench_matcher(corpus, args.sizes, args.repeat)
+    if not args.skip_handler:
+        print("WarpHandler.request ...", flush=True)
+        results += bench_handler(corpus, args.sizes, args.repeat)
+
+    report = {
+        "meta": {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "git_revision": _git_revision(),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "corpus": args.corpus,
+            "repeat": args.repeat,
+        },
+        "results": results,
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+    print(f"\n📄 Results written to {args.output}")
+
+    if args.compare and compare(report, args.compare, args.max_regression):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
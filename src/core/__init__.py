@@ -1,6 +1,6 @@
 """核心功能模块"""
 
-from .config import Config
+from .config import Config, ConfigError
 from .interceptor import BaseInterceptor
 
-__all__ = ["Config", "BaseInterceptor"]
+__all__ = ["Config", "ConfigError", "BaseInterceptor"]
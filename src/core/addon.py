@@ -0,0 +1,47 @@
+"""mitmdump 脚本入口
+
+GUI 以 ``mitmdump -s src/core/addon.py`` 启动代理，由这里创建与命令行
+模式（proxy.py）相同的 ProxyServer：规则拦截、上游路由、请求日志、统计
+和配置热重载。配置文件路径取自环境变量 WARPGATEWAY_CONFIG，默认为当前
+目录下的 config.yaml。
+
+mitmdump 按文件路径加载脚本而不是作为包导入，所以先把项目根目录加入
+sys.path，再用绝对路径导入。
+"""
+
+import os
+import sys
+from pathlib import Path
+
+_ROOT = Path(__file__).resolve().parents[2]
+if str(_ROOT) not in sys.path:
+    sys.path.insert(0, str(_ROOT))
+
+from src.core.config import Config  # noqa: E402
+from src.core.proxy import ProxyServer, install_reload_signal, setup_logging  # noqa: E402
+
+CONFIG_ENV = "WARPGATEWAY_CONFIG"
+
+
+class GatewayAddon(ProxyServer):
+    """mitmdump 关闭（GUI 停止代理）时输出一次统计"""
+
+    def done(self):
+        if not self._closed and self.stats_handler is not None:
+            self.stats_handler.print_stats()
+        super().done()
+
+
+def create_addon(config_path: str) -> GatewayAddon:
+    """加载配置并启动处理器和热重载"""
+    config = Config(config_path)
+    # mitmdump 自己会把日志输出到控制台，这里只加文件输出
+    setup_logging(config, console=False)
+    addon = GatewayAddon(config)
+    addon.setup_handlers()
+    addon.start_reloader()
+    install_reload_signal(addon)
+    return addon
+
+
+addons = [create_addon(os.environ.get(CONFIG_ENV, "config.yaml"))]
@@ -1,16 +1,247 @@
 """配置管理模块"""
 
+import re
 import yaml
 from pathlib import Path
-from typing import Dict, List, Any
+from types import MappingProxyType
+from typing import Any, Dict, Mapping, Optional, Tuple
+from ..utils.routing import UpstreamRouter
+from ..utils.rule_sources import SOURCE_FORMATS
+from ..utils.rules import RuleType, parse_rule_spec
+from ..utils.log_format import LOG_FORMATS
+from ..utils.log_rotation import RotationPolicy
+from ..utils.log_sampling import DETAIL_MODES
+from ..utils.log_writer import BACKPRESSURE_MODES
+from ..utils.metrics_store import DEFAULT_RETENTION
+from ..utils.ruleset import ACTIONS
+from ..utils.upstream_pool import parse_upstream
 
+try:
+    from yaml import CSafeLoader as _YamlLoader
+except ImportError:  # 未编译 libyaml 时退回纯 Python 实现
+    from yaml import SafeLoader as _YamlLoader
 
-class Config:
-    """配置管理类"""
+_LOG_LEVELS = ("DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL")
+
+
+class ConfigError(ValueError):
+    """配置文件内容不合法"""
+
+
+class _Section:
+    """带路径信息的配置段读取器，类型不符时抛出 ConfigError"""
+
+    def __init__(self, raw: Any, path: str = ""):
+        if raw is None:
+            raw = {}
+        if not isinstance(raw, dict):
+            raise ConfigError(f"{path or 'config'}: expected a mapping, got {type(raw).__name__}")
+        self.raw = raw
+        self.path = path
+
+    def key(self, name: str) -> str:
+        return f"{self.path}.{name}" if self.path else name
+
+    def section(self, name: str) -> "_Section":
+        return _Section(self.raw.get(name), self.key(name))
+
+    def get(self, name: str, types, default):
+        """读取一个值，缺失或为 null 时返回默认值"""
+        value = self.raw.get(name)
+        if value is None:
+            return default
+        # bool 是 int 的子类，数值项不接受 true/false
+        if not isinstance(value, types) or (isinstance(value, bool) and bool not in _as_tuple(types)):
+            expected = "/".join(t.__name__ for t in _as_tuple(types))
+            raise ConfigError(f"{self.key(name)}: expected {expected}, got {type(value).__name__}")
+        return value
+
+    def number(self, name: str, default: float, minimum: float = 0.0) -> float:
+        value = self.get(name, (int, float), default)
+        if value < minimum:
+            raise ConfigError(f"{self.key(name)}: must be >= {minimum}, got {value}")
+        return value
+
+    def strings(self, name: str) -> Tuple[str, ...]:
+        """字符串列表，转换为元组"""
+        values = self.get(name, list, [])
+        for i, value in enumerate(values):
+            if not isinstance(value, str):
+                raise ConfigError(f"{self.key(name)}[{i}]: expected str, got {type(value).__name__}")
+        return tuple(values)
+
+
+def _as_tuple(types) -> tuple:
+    return types if isinstance(types, tuple) else (types,)
+
+
+def _check_rules(section: _Section, name: str) -> Tuple[str, ...]:
+    """读取规则列表，正则规则在此预编译以便尽早报错"""
+    specs = section.strings(name)
+    for i, spec in enumerate(specs):
+        pattern, rule_type = parse_rule_spec(spec)
+        if rule_type == RuleType.REGEX:
+            try:
+                re.compile(pattern)
+            except re.error as e:
+                raise ConfigError(f"{section.key(name)}[{i}]: invalid regex {pattern!r}: {e}")
+    return specs
+
+
+def _check_upstreams(value: Any, path: str) -> Tuple[str, ...]:
+    """上游地址（单个或列表），逐个校验格式"""
+    upstreams = [value] if isinstance(value, str) else value
+    if not isinstance(upstreams, list):
+        raise ConfigError(f"{path}: expected str or list, got {type(value).__name__}")
+    for i, upstream in enumerate(upstreams):
+        if not isinstance(upstream, str):
+            raise ConfigError(f"{path}[{i}]: expected str, got {type(upstream).__name__}")
+        if upstream:
+            try:
+                parse_upstream(upstream)
+            except ValueError as e:
+                raise ConfigError(f"{path}: {e}")
+    return tuple(u for u in upstreams if u)
+
+
+def _rotation(section: _Section, **defaults) -> RotationPolicy:
+    """读取轮转策略，未配置的项使用 defaults"""
+    base = RotationPolicy(**defaults)
+    return RotationPolicy(
+        max_bytes=int(section.number("max_bytes", base.max_bytes)),
+        interval=section.number("interval", base.interval),
+        backup_count=int(section.number("backup_count", base.backup_count)),
+        max_total_bytes=int(section.number("max_total_bytes", base.max_total_bytes)),
+        compress=section.get("compress", bool, base.compress),
+    )
+
+
+def _rate(section: _Section, name: str, value: Any) -> float:
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or not 0 <= value <= 1:
+        raise ConfigError(f"{section.key(name)}: sampling rate must be a number in [0, 1], got {value!r}")
+    return float(value)
+
+
+def _sampling(section: _Section) -> Mapping[str, Any]:
+    """读取请求日志采样配置"""
+    detail = section.get("detail", str, DETAIL_MODES[0])
+    if detail not in DETAIL_MODES:
+        raise ConfigError(f"{section.key('detail')}: must be one of {', '.join(DETAIL_MODES)}")
+    rates = {}
+    for name in ("hosts", "rules"):
+        table = section.section(name)
+        entries = {}
+        for key, value in table.raw.items():
+            key = str(key)
+            entries[key.lower() if name == "hosts" else key] = _rate(table, key, value)
+        rates[name] = MappingProxyType(entries)
+    auto = section.section("auto")
+    return MappingProxyType(
+        {
+            "rate": _rate(section, "rate", section.raw.get("rate", 1.0)),
+            "hosts": rates["hosts"],
+            "rules": rates["rules"],
+            "detail": detail,
+            "auto": MappingProxyType(
+                {
+                    "queue_names": auto.number("queue_names", 0.5),
+                    "queue_none": auto.number("queue_none", 0.8),
+                    "rate_names": auto.number("rate_names", 200),
+                    "rate_none": auto.number("rate_none", 1000),
+                }
+            ),
+        }
+    )
+
+
+class _Frozen:
+    """属性只能在构造时设置"""
+
+    __slots__ = ()
+
+    def _set(self, **values):
+        for name, value in values.items():
+            object.__setattr__(self, name, value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{type(self).__name__} is immutable")
+
+    def __delattr__(self, name):
+        raise AttributeError(f"{type(self).__name__} is immutable")
+
+
+class ProxySettings(_Frozen):
+    """proxy 配置段"""
+
+    __slots__ = ("host", "port", "ssl_insecure", "cert_dir", "upstream", "upstream_routes", "health_check")
+
+    def __init__(self, section: _Section):
+        port = section.get("port", int, 8080)
+        if not 0 < port < 65536:
+            raise ConfigError(f"{section.key('port')}: invalid port {port}")
+
+        routes = []
+        for i, route in enumerate(section.get("upstream_routes", list, [])):
+            route = _Section(route, f"{section.key('upstream_routes')}[{i}]")
+            pattern = route.get("pattern", str, "")
+            if not pattern:
+                raise ConfigError(f"{route.key('pattern')}: required")
+            name = "upstreams" if "upstreams" in route.raw else "upstream"
+            upstreams = _check_upstreams(route.raw.get(name) or "", route.key(name))
+            routes.append(MappingProxyType({"pattern": pattern, "upstreams": upstreams}))
+
+        health = section.section("health_check")
+        alpha = health.number("alpha", 0.3)
+        if not 0 < alpha <= 1:
+            raise ConfigError(f"{health.key('alpha')}: must be in (0, 1], got {alpha}")
+
+        self._set(
+            host=section.get("host", str, "0.0.0.0"),
+            port=port,
+            ssl_insecure=section.get("ssl_insecure", bool, False),
+            cert_dir=section.get("cert_dir", str, "~/.mitmproxy"),
+            upstream=_check_upstreams(section.raw.get("upstream") or "", section.key("upstream")),
+            upstream_routes=tuple(routes),
+            health_check=MappingProxyType(
+                {
+                    "interval": health.number("interval", 10),
+                    "timeout": health.number("timeout", 2),
+                    "probe_target": health.get("probe_target", str, ""),
+                    "alpha": alpha,
+                }
+            ),
+        )
+
+    def __repr__(self):
+        return f"ProxySettings(host={self.host!r}, port={self.port}, routes={len(self.upstream_routes)})"
+
+
+class Config(_Frozen):
+    """配置管理类
+
+    YAML 在构造时一次性解析、校验并展开为只读属性：列表转为元组，
+    映射转为 MappingProxyType，上游路由表预先编译。热路径上读取配置
+    只是一次属性访问，配置错误在启动时以 ConfigError 报出。
+    需要应用新配置时构造新的 Config 对象（见 reload()）。
+    """
+
+    __slots__ = (
+        "config_path", "config_dir", "proxy",
+        "block_rules", "allow_rules", "log_only_rules", "rule_sources",
+        "rule_snapshot_dir", "verdict_cache_size", "streaming_paths",
+        "log_level", "log_file", "log_console", "log_rotation", "request_log", "log_sampling",
+        "reload_watch", "reload_interval", "stats",
+        "upstream_router",
+    )
 
     def __init__(self, config_path: str = "config.yaml"):
-        self.config_path = Path(config_path)
-        self.config = self._load_config()
+        path = Path(config_path)
+        self._set(config_path=path, config_dir=path.absolute().parent)
+        self._compile(_Section(self._load_config()))
+
+    def reload(self) -> "Config":
+        """重新读取配置文件，返回新的 Config（当前对象不变）"""
+        return Config(str(self.config_path))
 
     def _load_config(self) -> Dict[str, Any]:
         """加载配置文件"""
@@ -18,7 +249,10 @@ class Config:
             return self._default_config()
 
         with open(self.config_path, "r", encoding="utf-8") as f:
-            return yaml.safe_load(f)
+            try:
+                return yaml.load(f, Loader=_YamlLoader)
+            except yaml.YAMLError as e:
+                raise ConfigError(f"{self.config_path}: {e}")
 
     def _default_config(self) -> Dict[str, Any]:
         """默认配置"""
@@ -28,62 +262,137 @@ class Config:
             "logging": {"level": "INFO", "file": "warp_gateway.log", "console": True},
         }
 
+    def _compile(self, raw: _Section):
+        """校验配置并生成只读属性"""
+        proxy = ProxySettings(raw.section("proxy"))
+
+        rules = raw.section("rules")
+        sources = []
+        for i, source in enumerate(rules.get("sources", list, [])):
+            source = _Section(source, f"{rules.key('sources')}[{i}]")
+            if not source.get("path", str, ""):
+                raise ConfigError(f"{source.key('path')}: required")
+            if source.get("format", str, "hosts") not in SOURCE_FORMATS:
+                raise ConfigError(f"{source.key('format')}: must be one of {', '.join(SOURCE_FORMATS)}")
+            if source.get("action", str, ACTIONS[0]) not in ACTIONS:
+                raise ConfigError(f"{source.key('action')}: must be one of {', '.join(ACTIONS)}")
+            sources.append(MappingProxyType(dict(source.raw)))
+
+        logging_section = raw.section("logging")
+        log_level = logging_section.get("level", str, "INFO").upper()
+        if log_level not in _LOG_LEVELS:
+            raise ConfigError(f"{logging_section.key('level')}: must be one of {', '.join(_LOG_LEVELS)}")
+
+        requests = logging_section.section("requests")
+        backpressure = requests.get("backpressure", str, "drop")
+        if backpressure not in BACKPRESSURE_MODES:
+            raise ConfigError(f"{requests.key('backpressure')}: must be one of {', '.join(BACKPRESSURE_MODES)}")
+        log_format = requests.get("format", str, LOG_FORMATS[0])
+        if log_format not in LOG_FORMATS:
+            raise ConfigError(f"{requests.key('format')}: must be one of {', '.join(LOG_FORMATS)}")
+        request_log = MappingProxyType(
+            {
+                "dir": requests.get("dir", str, "logs"),
+                "log_format": log_format,
+                "max_pending": int(requests.number("max_pending", 10000, 1)),
+                "index": requests.get("index", bool, True),
+                "index_interval": requests.number("index_interval", 30.0),
+                "queue_size": int(requests.number("queue_size", 10000, 1)),
+                "batch_size": int(requests.number("batch_size", 256, 1)),
+                "flush_interval": requests.number("flush_interval", 1.0),
+                "flush_bytes": int(requests.number("flush_bytes", 64 * 1024)),
+                "backpressure": backpressure,
+                "rotation": _rotation(
+                    requests.section("rotation"),
+                    max_bytes=64 * 1024 * 1024,
+                    interval=86400,
+                    backup_count=30,
+                    max_total_bytes=1024 * 1024 * 1024,
+                ),
+            }
+        )
+
+        stats = raw.section("stats")
+        metrics = stats.section("metrics")
+        retention = metrics.section("retention")
+        reload_section = raw.section("reload")
+        self._set(
+            proxy=proxy,
+            block_rules=_check_rules(rules, "block"),
+            allow_rules=_check_rules(rules, "allow"),
+            log_only_rules=_check_rules(rules, "log_only"),
+            rule_sources=tuple(sources),
+            rule_snapshot_dir=rules.get("snapshot_dir", str, ".cache/rules"),
+            verdict_cache_size=int(rules.number("cache_size", 4096)),
+            streaming_paths=raw.section("streaming").strings("paths"),
+            log_level=log_level,
+            log_file=logging_section.get("file", str, "warp_gateway.log"),
+            log_console=logging_section.get("console", bool, True),
+            log_rotation=_rotation(
+                logging_section.section("rotation"), max_bytes=10 * 1024 * 1024, backup_count=10
+            ),
+            request_log=request_log,
+            log_sampling=_sampling(requests.section("sampling")),
+            reload_watch=reload_section.get("watch", bool, True),
+            reload_interval=reload_section.number("interval", 2.0),
+            stats=MappingProxyType(
+                {
+                    "save_interval": stats.number("save_interval", 300.0),
+                    "output_file": stats.get("output_file", str, "logs/stats.json"),
+                    "restore": stats.get("restore", bool, True),
+                    "max_latency_keys": int(stats.number("max_latency_keys", 256, 1)),
+                    "top_capacity": int(stats.number("top_capacity", 1000, 1)),
+                    "metrics": MappingProxyType(
+                        {
+                            "enabled": metrics.get("enabled", bool, True),
+                            "db": metrics.get("db", str, "logs/metrics.db"),
+                            "max_hosts": int(metrics.number("max_hosts", 200, 1)),
+                            "rollup_interval": metrics.number("rollup_interval", 300.0, 1),
+                            "retention": MappingProxyType(
+                                {
+                                    name: retention.number(name, days)
+                                    for name, days in DEFAULT_RETENTION.items()
+                                }
+                            ),
+                        }
+                    ),
+                }
+            ),
+            upstream_router=UpstreamRouter(
+                proxy.upstream_routes, proxy.upstream, alpha=proxy.health_check["alpha"]
+            ).compile(),
+        )
+
     @property
     def proxy_host(self) -> str:
-        return self.config.get("proxy", {}).get("host", "0.0.0.0")
+        return self.proxy.host
 
     @property
     def proxy_port(self) -> int:
-        return self.config.get("proxy", {}).get("port", 8080)
+        return self.proxy.port
 
     @property
     def ssl_insecure(self) -> bool:
-        return self.config.get("proxy", {}).get("ssl_insecure", False)
-
-    @property
-    def block_rules(self) -> List[str]:
-        return self.config.get("rules", {}).get("block", [])
-
-    @property
-    def allow_rules(self) -> List[str]:
-        return self.config.get("rules", {}).get("allow", [])
+        return self.proxy.ssl_insecure
 
     @property
-    def log_only_rules(self) -> List[str]:
-        return self.config.get("rules", {}).get("log_only", [])
+    def upstream(self) -> Tuple[str, ...]:
+        """默认上游代理，空元组表示直连"""
+        return self.proxy.upstream
 
     @property
-    def log_level(self) -> str:
-        return self.config.get("logging", {}).get("level", "INFO")
+    def upstream_routes(self) -> Tuple[Mapping[str, Any], ...]:
+        """条件上游代理路由"""
+        return self.proxy.upstream_routes
 
     @property
-    def log_file(self) -> str:
-        return self.config.get("logging", {}).get("file", "warp_gateway.log")
+    def upstream_health(self) -> Mapping[str, Any]:
+        """上游代理健康检查参数"""
+        return self.proxy.health_check
 
-    @property
-    def log_console(self) -> bool:
-        return self.config.get("logging", {}).get("console", True)
+    def get_upstream_for_url(self, url: str, host: Optional[str] = None) -> str:
+        """根据 URL 获取对应的上游代理，host 缺省时从 URL 中解析"""
+        return self.upstream_router.route(url, host)
 
-    @property
-    def streaming_paths(self) -> List[str]:
-        return self.config.get("streaming", {}).get("paths", [])
-    
-    @property
-    def upstream(self) -> str:
-        """默认上游代理"""
-        return self.config.get("proxy", {}).get("upstream", "")
-    
-    @property
-    def upstream_routes(self) -> List[Dict[str, str]]:
-        """条件上游代理路由"""
-        return self.config.get("proxy", {}).get("upstream_routes", [])
-    
-    def get_upstream_for_url(self, url: str) -> str:
-        """根据 URL 获取对应的上游代理"""
-        # 先检查条件路由
-        for route in self.upstream_routes:
-            pattern = route.get("pattern", "")
-            if pattern and pattern in url:
-                return route.get("upstream", "")
-        # 返回默认上游代理
-        return self.upstream
+    def __repr__(self):
+        return f"Config({str(self.config_path)!r})"
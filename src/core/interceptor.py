@@ -37,6 +37,14 @@ class BaseInterceptor(ABC):
         """
         pass
 
+    def error(self, flow: http.HTTPFlow) -> None:
+        """处理连接错误（flow.error 已设置），默认忽略"""
+        return None
+
+    def done(self) -> None:
+        """代理关闭时调用，用于释放资源，默认忽略"""
+        return None
+
     def enable(self):
         """启用拦截器"""
         self.enabled = True
@@ -84,3 +92,19 @@ class InterceptorChain:
             result = interceptor.response(flow)
             if result:  # 如果返回了修改后的 flow，停止链
                 break
+
+    def error(self, flow: http.HTTPFlow) -> None:
+        """处理错误，所有拦截器都会收到"""
+        for interceptor in self.interceptors:
+            if not interceptor.enabled:
+                continue
+
+            interceptor.error(flow)
+
+    def done(self) -> None:
+        """代理关闭，通知所有拦截器（包括已禁用的）"""
+        for interceptor in self.interceptors:
+            try:
+                interceptor.done()
+            except Exception as e:
+                logger.error(f"❌ {interceptor.name} failed to shut down: {e}")
@@ -5,14 +5,20 @@ import logging
 import argparse
 import signal
 from pathlib import Path
+from typing import Optional
 from mitmproxy.tools.main import mitmdump
-from .config import Config
+from .config import Config, ConfigError
 from .interceptor import InterceptorChain
-from ..handlers import WarpHandler, LoggerHandler, StatsHandler, AIMonitorHandler
+from .reloader import ConfigReloader, GatewaySnapshot
+from ..utils.log_rotation import RotatingLogFileHandler
+from ..utils.log_sampling import LogSampler
+from ..handlers import WarpHandler, LoggerHandler, StatsHandler, UpstreamHandler
 
+logger = logging.getLogger(__name__)
 
-def setup_logging(config: Config):
-    """设置日志"""
+
+def setup_logging(config: Config, console: bool = True):
+    """设置日志；作为 mitmdump 脚本加载时 mitmdump 已经输出日志到控制台，console 传 False"""
     log_level = getattr(logging, config.log_level.upper(), logging.INFO)
     
     # 创建日志格式
@@ -26,18 +32,30 @@ def setup_logging(config: Config):
     root_logger.setLevel(log_level)
 
     # 控制台输出
-    if config.log_console:
+    if console and config.log_console:
         console_handler = logging.StreamHandler(sys.stdout)
         console_handler.setFormatter(formatter)
         root_logger.addHandler(console_handler)
 
     # 文件输出
     if config.log_file:
-        file_handler = logging.FileHandler(config.log_file, encoding="utf-8")
+        if config.log_rotation.enabled:
+            file_handler = RotatingLogFileHandler(config.log_file, config.log_rotation)
+        else:
+            file_handler = logging.FileHandler(config.log_file, encoding="utf-8")
         file_handler.setFormatter(formatter)
         root_logger.addHandler(file_handler)
 
 
+def install_reload_signal(proxy: "ProxyServer"):
+    """收到 SIGHUP 时触发后台重载（Windows 没有 SIGHUP，依赖文件监视）
+
+    必须在主线程中调用；不处理 SIGHUP 时它的默认动作会终止进程。
+    """
+    if hasattr(signal, "SIGHUP"):
+        signal.signal(signal.SIGHUP, lambda sig, frame: proxy.reload("SIGHUP"))
+
+
 class ProxyServer:
     """代理服务器"""
     
@@ -45,33 +63,113 @@ class ProxyServer:
         self.config = config
         self.chain = InterceptorChain()
         self.stats_handler = None
+        self.warp_handler = None
+        self.upstream_handler = None
+        self.sampler = LogSampler.from_config(config)
+        self.reloader = None
+        self.generation = 0
+        # 后台构建好、等待换上的快照
+        self._pending: Optional[GatewaySnapshot] = None
+        self._closed = False
         
     def setup_handlers(self):
         """设置处理器"""
         # 添加 Warp 处理器
-        warp_handler = WarpHandler(self.config)
+        warp_handler = self.warp_handler = WarpHandler(self.config, sampler=self.sampler)
         self.chain.add(warp_handler)
         
-        # 添加 AI 状态监控处理器
-        ai_monitor = AIMonitorHandler()
-        self.chain.add(ai_monitor)
+        # 添加上游路由处理器（被拦截的请求不会到达这里）
+        upstream_handler = self.upstream_handler = UpstreamHandler(self.config)
+        self.chain.add(upstream_handler)
         
         # 添加日志处理器
-        logger_handler = LoggerHandler("logs")
+        logger_handler = LoggerHandler.from_config(self.config, sampler=self.sampler)
         self.chain.add(logger_handler)
         
         # 添加统计处理器
-        self.stats_handler = StatsHandler()
+        self.stats_handler = StatsHandler.from_config(self.config)
+        self.stats_handler.add_source("rules", warp_handler.rule_stats)
+        self.stats_handler.add_source("upstream", upstream_handler.route_stats)
+        self.stats_handler.add_source("request_log", logger_handler.writer_stats)
+        self.stats_handler.add_source("log_sampling", self.sampler.stats)
         self.chain.add(self.stats_handler)
         
+    def start_reloader(self):
+        """启动配置热重载"""
+        self.reloader = ConfigReloader(
+            self.config,
+            self.warp_handler.ruleset,
+            self._on_reload_ready,
+            watch=self.config.reload_watch,
+            interval=self.config.reload_interval,
+        )
+        self.reloader.start()
+
+    def reload(self, reason: str = "manual"):
+        """触发一次后台重载"""
+        if self.reloader is not None:
+            self.reloader.trigger(reason)
+
+    def _on_reload_ready(self, snapshot: GatewaySnapshot):
+        # 在重载线程中调用，只登记快照，真正的替换在处理下一个请求前进行
+        self._pending = snapshot
+
+    def _apply_pending(self):
+        """在请求之间换上新快照，同一个请求不会看到新旧混合的状态
+
+        各组件依次切换，任何一步失败都把已切换的组件退回旧配置并丢弃
+        这份快照；generation 和 config 只在全部成功后更新。
+        """
+        snapshot = self._pending
+        if snapshot is None or snapshot.generation == self.generation:
+            return
+        old = self.config
+        undo = []
+        try:
+            self.sampler.update(snapshot.config.log_sampling)
+            undo.append(lambda: self.sampler.update(old.log_sampling))
+            self.upstream_handler.reload(snapshot.config)
+            undo.append(lambda: self.upstream_handler.reload(old))
+            # 只是替换引用，不会失败，放在最后
+            self.warp_handler.swap(snapshot.config, snapshot.ruleset)
+        except Exception as e:
+            logger.error(f"❌ Failed to apply config generation {snapshot.generation}, keeping current config: {e}")
+            for step in reversed(undo):
+                try:
+                    step()
+                except Exception as rollback_error:
+                    logger.error(f"❌ Failed to roll back config: {rollback_error}")
+            # 重载线程可能已经放入更新的快照，只丢弃失败的这一份
+            if self._pending is snapshot:
+                self._pending = None
+            return
+        self.config = snapshot.config
+        self.generation = snapshot.generation
+        if self.reloader is not None:
+            self.reloader.applied(snapshot)
+
     def request(self, flow):
         """处理请求"""
+        self._apply_pending()
         self.chain.request(flow)
         
     def response(self, flow):
         """处理响应"""
         self.chain.response(flow)
 
+    def error(self, flow):
+        """处理连接错误"""
+        self.chain.error(flow)
+
+    def done(self):
+        """代理关闭：停止重载线程并让各处理器写完缓冲的数据，可重复调用"""
+        if self.reloader is not None:
+            self.reloader.stop()
+            self.reloader = None
+        if not self._closed:
+            self._closed = True
+            self.chain.done()
+
 
 def main():
     """主函数"""
@@ -100,11 +198,14 @@ def main():
     args = parser.parse_args()
 
     # 加载配置
-    config = Config(args.config)
+    try:
+        config = Config(args.config)
+    except ConfigError as e:
+        print(f"❌ Invalid config: {e}", file=sys.stderr)
+        sys.exit(1)
     
     # 设置日志
     setup_logging(config)
-    logger = logging.getLogger(__name__)
 
     # 命令行参数覆盖配置
     host = args.host or config.proxy_host
@@ -127,17 +228,24 @@ def main():
     def signal_handler(sig, frame):
         if proxy.stats_handler and not args.no_stats:
             proxy.stats_handler.print_stats()
+        proxy.done()
         logger.info("\n👋 WarpGateway Stopped")
         sys.exit(0)
     
     signal.signal(signal.SIGINT, signal_handler)
 
+    # 配置热重载：文件变化、SIGHUP 都会在后台重建规则
+    proxy.start_reloader()
+    install_reload_signal(proxy)
+
     # 启动 mitmproxy
     try:
         mitmdump_args = [
             "--listen-host", host,
             "--listen-port", str(port),
             "--set", "confdir=~/.mitmproxy",
+            # 推迟建立服务端连接，由 UpstreamHandler 逐请求决定是否经上游代理
+            "--set", "connection_strategy=lazy",
         ]
         
         if config.ssl_insecure:
@@ -151,6 +259,7 @@ def main():
     except KeyboardInterrupt:
         if proxy.stats_handler and not args.no_stats:
             proxy.stats_handler.print_stats()
+        proxy.done()
         logger.info("\n👋 WarpGateway Stopped")
     except Exception as e:
         logger.error(f"❌ Error: {e}", exc_info=True)
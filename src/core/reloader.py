@@ -0,0 +1,155 @@
+"""配置热重载"""
+
+import logging
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Iterable, List, NamedTuple, Optional
+from .config import Config
+from ..utils.file_watcher import FileWatcher
+from ..utils.rule_snapshot import load_ruleset
+from ..utils.rule_sources import resolve_source_path
+from ..utils.ruleset import RuleSet
+
+logger = logging.getLogger(__name__)
+
+# 差异日志中每类变更最多列出的条目数
+MAX_DIFF_LINES = 20
+
+
+class GatewaySnapshot(NamedTuple):
+    """一次重载得到的完整运行状态"""
+    generation: int
+    config: Config
+    ruleset: RuleSet
+
+
+def _log_changes(title: str, old: Iterable[str], new: Iterable[str]):
+    """输出新增和删除的条目"""
+    old, new = set(old), set(new)
+    added, removed = sorted(new - old), sorted(old - new)
+    if not added and not removed:
+        return
+    logger.info(f"📝 {title}: +{len(added)} -{len(removed)}")
+    for sign, items in (("➕", added), ("➖", removed)):
+        for item in items[:MAX_DIFF_LINES]:
+            logger.info(f"  {sign} {item}")
+        if len(items) > MAX_DIFF_LINES:
+            logger.info(f"  {sign} ... {len(items) - MAX_DIFF_LINES} more")
+
+
+def _route_specs(config: Config) -> List[str]:
+    router = config.upstream_router
+    return [
+        f"{pattern} -> {', '.join(m.upstream for m in pool.members) if pool else 'direct'}"
+        for pattern, pool in zip(router.patterns, router.pools)
+    ]
+
+
+class ConfigReloader:
+    """在后台线程中重新解析配置并构建规则集与路由表
+
+    触发方式：监视配置文件和规则文件的变化、SIGHUP 或直接调用 trigger()。
+    多次触发会合并为一次重载。构建完成后以 GatewaySnapshot 调用
+    on_ready，由调用方决定何时换上；构建失败时保留旧配置并记录错误。
+
+    config/ruleset 是正在生效的状态，差异日志以它为基准；调用方换上
+    快照后需调用 applied()，换上失败时基准保持不变。
+    """
+
+    def __init__(
+        self,
+        config: Config,
+        ruleset: RuleSet,
+        on_ready: Callable[[GatewaySnapshot], None],
+        watch: bool = True,
+        interval: float = 2.0,
+    ):
+        self.config = config
+        self.ruleset = ruleset
+        # 最近一次构建出的配置，决定监视哪些规则文件
+        self._latest = config
+        self.on_ready = on_ready
+        self.generation = 0
+        self.watcher = FileWatcher(self._watched_paths, self._on_files_changed, interval) if watch else None
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._reason = ""
+        self._thread: Optional[threading.Thread] = None
+
+    def _watched_paths(self) -> List[Path]:
+        """配置文件和当前配置引用的规则文件"""
+        config = self._latest
+        paths = [config.config_path]
+        for source in config.rule_sources:
+            paths.append(resolve_source_path(source, config.config_dir))
+        return paths
+
+    def _on_files_changed(self, paths: List[Path]):
+        self.trigger(f"{', '.join(p.name for p in paths)} changed")
+
+    def trigger(self, reason: str = "manual"):
+        """请求一次重载（非阻塞）"""
+        self._reason = reason
+        self._wake.set()
+
+    def reload_now(self, reason: str = "manual") -> Optional[GatewaySnapshot]:
+        """在当前线程中重载，返回新的快照，失败时返回 None"""
+        logger.info(f"🔄 Reloading config ({reason})...")
+        start = time.perf_counter()
+        try:
+            config = Config(str(self.config.config_path))
+            ruleset = load_ruleset(config)
+            config.upstream_router  # 预先编译路由表
+        except Exception as e:
+            logger.error(f"❌ Config reload failed, keeping current config: {e}")
+            return None
+
+        # 与正在生效的状态比较；尚未换上或换上失败的快照不作为基准
+        live_config, live_ruleset = self.config, self.ruleset
+        _log_changes("Rule changes", live_ruleset.specs(), ruleset.specs())
+        _log_changes("Upstream route changes", _route_specs(live_config), _route_specs(config))
+        self.generation += 1
+        self._latest = config
+        elapsed = (time.perf_counter() - start) * 1000
+        logger.info(f"✅ Config generation {self.generation} built in {elapsed:.1f}ms")
+
+        snapshot = GatewaySnapshot(self.generation, config, ruleset)
+        self.on_ready(snapshot)
+        return snapshot
+
+    def applied(self, snapshot: GatewaySnapshot):
+        """调用方已换上 snapshot，之后的重载以它为比较基准"""
+        self.config, self.ruleset = snapshot.config, snapshot.ruleset
+
+    def _run(self):
+        while True:
+            self._wake.wait()
+            if self._stop.is_set():
+                return
+            self._wake.clear()
+            try:
+                self.reload_now(self._reason)
+            except Exception as e:
+                logger.error(f"❌ Config reload failed: {e}", exc_info=True)
+
+    def start(self):
+        """启动后台重载线程和文件监视"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="config-reloader", daemon=True)
+        self._thread.start()
+        if self.watcher is not None:
+            self.watcher.start()
+            logger.info(f"👀 Watching {self.config.config_path} for changes")
+
+    def stop(self):
+        """停止重载线程和文件监视"""
+        if self.watcher is not None:
+            self.watcher.stop()
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(5)
+            self._thread = None
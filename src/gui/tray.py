@@ -1,5 +1,7 @@
 """系统托盘应用"""
+import os
 import sys
+import signal
 import subprocess
 import webbrowser
 from pathlib import Path
@@ -27,16 +29,17 @@ class ProxyThread(Thread):
         self.running = True
         cmd = [
             'mitmdump',
-            '-s', str(Path(__file__).parent.parent / 'core' / 'interceptor.py'),
+            '-s', str(Path(__file__).parent.parent / 'core' / 'addon.py'),
             '--listen-host', self.config.proxy.host,
             '--listen-port', str(self.config.proxy.port),
             '--set', f'confdir={self.config.proxy.cert_dir}',
+            # 上游代理由 UpstreamHandler 按请求选择，不再使用全局 upstream 模式
+            '--set', 'connection_strategy=lazy',
         ]
         
-        if self.config.proxy.upstream:
-            cmd.extend(['--mode', f'upstream:{self.config.proxy.upstream}'])
-        
-        self.process = subprocess.Popen(cmd)
+        # addon.py 读取与 GUI 相同的配置文件
+        env = dict(os.environ, WARPGATEWAY_CONFIG=str(self.config.config_path.absolute()))
+        self.process = subprocess.Popen(cmd, env=env)
         self.process.wait()
         self.running = False
     
@@ -199,9 +202,16 @@ class TrayApp(QSystemTrayIcon):
             subprocess.run(['xdg-open', str(config_file.absolute())])
     
     def _reload_config(self):
-        """重新加载配置"""
+        """重新加载配置
+
+        代理进程会监视 config.yaml 并自动重载；这里再发送 SIGHUP 立即触发
+        （Windows 没有 SIGHUP，依赖文件监视）。
+        """
         try:
             self.config = Config()
+            process = self.proxy_thread.process if self.proxy_thread else None
+            if process and process.poll() is None and hasattr(signal, 'SIGHUP'):
+                process.send_signal(signal.SIGHUP)
             self.showMessage('WarpGateway', '配置已重新加载', QSystemTrayIcon.Information, 2000)
         except Exception as e:
             self.showMessage('WarpGateway', f'配置加载失败: {str(e)}', QSystemTrayIcon.Critical, 3000)
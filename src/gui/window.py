@@ -1,4 +1,5 @@
 """桌面窗口应用"""
+import os
 import sys
 import subprocess
 import shutil
@@ -34,16 +35,17 @@ class ProxyThread(Thread):
         self.running = True
         cmd = [
             'mitmdump',
-            '-s', str(Path(__file__).parent.parent / 'core' / 'interceptor.py'),
+            '-s', str(Path(__file__).parent.parent / 'core' / 'addon.py'),
             '--listen-host', self.config.proxy.host,
             '--listen-port', str(self.config.proxy.port),
             '--set', f'confdir={self.config.proxy.cert_dir}',
+            # 上游代理由 UpstreamHandler 按请求选择，不再使用全局 upstream 模式
+            '--set', 'connection_strategy=lazy',
         ]
         
-        if self.config.proxy.upstream:
-            cmd.extend(['--mode', f'upstream:{self.config.proxy.upstream}'])
-        
-        self.process = subprocess.Popen(cmd)
+        # addon.py 读取与 GUI 相同的配置文件
+        env = dict(os.environ, WARPGATEWAY_CONFIG=str(self.config.config_path.absolute()))
+        self.process = subprocess.Popen(cmd, env=env)
         self.process.wait()
         self.running = False
     
@@ -3,5 +3,6 @@
 from .warp import WarpHandler
 from .logger import LoggerHandler
 from .stats import StatsHandler
+from .upstream import UpstreamHandler
 
-__all__ = ["WarpHandler", "LoggerHandler", "StatsHandler"]
+__all__ = ["WarpHandler", "LoggerHandler", "StatsHandler", "UpstreamHandler"]
@@ -1,71 +1,256 @@
 """日志记录处理器"""
 
-import json
 import logging
+from collections import OrderedDict
 from datetime import datetime
 from pathlib import Path
 from mitmproxy import http
-from typing import Optional
+from mitmproxy.net.http.http1 import assemble_request_head, assemble_response_head
+from typing import Dict, Optional
 from ..core.interceptor import BaseInterceptor
+from ..utils.log_format import FORMAT_BINARY, FORMAT_JSONL, create_encoder
+from ..utils.log_index import SegmentIndexer, index_path
+from ..utils.log_sampling import DETAIL_FULL, LogSampler, apply_detail
+from ..utils.log_rotation import RotationPolicy, SegmentRotator, unique_path
+from ..utils.log_writer import AsyncLogWriter
+from ..utils.ruleset import flow_verdict
 
 logger = logging.getLogger(__name__)
 
+# flow.metadata 中的标记，保证每个 flow 只写出一次
+LOGGED_KEY = "warpgateway.logged"
+
+
+def _wire_size(message, assemble_head) -> Optional[int]:
+    """按 HTTP/1.1 报文估算的线上字节数（头部 + 编码后的正文），流式正文未知时为 None"""
+    try:
+        head = len(assemble_head(message))
+    except Exception:
+        return None
+    if message.raw_content is None:
+        return None
+    return head + len(message.raw_content)
+
+
+def flow_timing(flow: http.HTTPFlow) -> Dict[str, float]:
+    """mitmproxy 记录的各阶段时间戳（Unix 秒），未发生的阶段不出现
+
+    server_conn 的时间戳属于连接本身；复用已有连接时 connect_start 早于
+    request_start，并标记 reused。
+    """
+    timing = {}
+    request = flow.request
+    response = flow.response
+    server = flow.server_conn
+    stamps = (
+        ("request_start", request.timestamp_start),
+        ("request_end", request.timestamp_end),
+        ("connect_start", server.timestamp_start if server else None),
+        ("tcp_setup", server.timestamp_tcp_setup if server else None),
+        ("tls_setup", server.timestamp_tls_setup if server else None),
+        ("response_start", response.timestamp_start if response else None),
+        ("response_end", response.timestamp_end if response else None),
+    )
+    for name, value in stamps:
+        if value is not None:
+            timing[name] = value
+    if "connect_start" in timing and timing["connect_start"] < request.timestamp_start:
+        timing["reused"] = True
+    if "response_end" in timing:
+        timing["duration_ms"] = round((timing["response_end"] - request.timestamp_start) * 1000, 3)
+    return timing
+
 
 class LoggerHandler(BaseInterceptor):
-    """日志记录处理器"""
+    """日志记录处理器
+
+    记录交给 AsyncLogWriter 在后台线程中序列化和写入，请求路径上只有
+    一次入队操作；writer_options 透传给 AsyncLogWriter。
+
+    每个 flow 写出一条 type 为 flow 的记录，以 flow_id 关联，包含请求、
+    响应、线上字节数和 mitmproxy 的各阶段时间戳（见 flow_timing）。请求
+    部分在 request() 时记下，响应或错误时合并写出；在途请求最多保留
+    max_pending 个，超出时最早的请求部分先以 complete=false 写出。
+    被规则拦截的请求不经过本处理器的 request()，在响应时一并生成。
+
+    是否记录和请求头的详细程度由 sampler 决定（见 LogSampler）：未被
+    采样的 flow 不写，采样率小于 1 时记录带 sample_rate。被拦截和出错
+    的 flow 始终完整记录。
 
-    def __init__(self, log_dir: str = "logs"):
+    log_format 为
+    binary 时写字典编码的 .wglog 文件（见 log_format）。指定 rotation 时
+    按大小/时间切分为 requests_<时间> 分段，旧分段在后台压缩。index 为真时
+    每个分段旁边写一个 .idx 索引，供 log_index 查询工具使用。
+    """
+
+    def __init__(
+        self,
+        log_dir: str = "logs",
+        rotation: Optional[RotationPolicy] = None,
+        log_format: str = FORMAT_JSONL,
+        max_pending: int = 10000,
+        sampler: Optional[LogSampler] = None,
+        index: bool = True,
+        index_interval: float = 30.0,
+        **writer_options,
+    ):
         super().__init__("LoggerHandler")
+        self.sampler = sampler or LogSampler()
+        self.max_pending = max_pending
+        self.pending: "OrderedDict[str, dict]" = OrderedDict()
+        self.evicted = 0
         self.log_dir = Path(log_dir)
-        self.log_dir.mkdir(exist_ok=True)
+        self.log_dir.mkdir(parents=True, exist_ok=True)
+        encoder = create_encoder(log_format)
+        self.suffix = encoder.suffix
         
-        # 创建请求日志文件
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        self.log_file = self.log_dir / f"requests_{timestamp}.jsonl"
+        # 创建请求日志文件，轮转时按当前时间创建新的分段
+        indexer = None
+        if index:
+            indexer = SegmentIndexer(binary=log_format == FORMAT_BINARY, checkpoint_interval=index_interval)
+        rotator = None
+        if rotation is not None and rotation.enabled:
+            rotator = SegmentRotator(
+                rotation, f"requests_*{self.suffix}*", lambda: self.log_file, sidecar=index_path if index else None
+            )
+        self.writer = AsyncLogWriter(
+            self._segment_path(),
+            rotator=rotator,
+            next_path=self._segment_path,
+            encoder=encoder,
+            indexer=indexer,
+            **writer_options,
+        )
+        
+        queue_size = self.writer.queue.maxsize
+        self.sampler.attach_queue(lambda: self.writer.queue.qsize() / queue_size)
         
         logger.info(f"📁 Request log file: {self.log_file}")
 
+    def _segment_path(self) -> Path:
+        """新日志分段的路径"""
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        return unique_path(self.log_dir / f"requests_{timestamp}{self.suffix}")
+
+    @property
+    def log_file(self) -> Path:
+        """当前正在写入的日志文件"""
+        return self.writer.path
+
+    @classmethod
+    def from_config(cls, config, sampler: Optional[LogSampler] = None) -> "LoggerHandler":
+        """按 logging.requests 配置创建"""
+        options = dict(config.request_log)
+        return cls(options.pop("dir"), sampler=sampler, **options)
+
     def request(self, flow: http.HTTPFlow) -> Optional[http.HTTPFlow]:
-        """记录请求"""
+        """记下请求部分，等响应或错误时合并写出"""
         try:
-            request_data = {
-                "timestamp": datetime.now().isoformat(),
-                "type": "request",
-                "method": flow.request.method,
-                "url": flow.request.pretty_url,
-                "headers": dict(flow.request.headers),
-                "content_length": len(flow.request.content) if flow.request.content else 0,
-            }
-            
-            self._write_log(request_data)
+            decision = self.sampler.decide(flow)
+            if not decision.sampled:
+                return None
+            self.pending[flow.id] = self._request_part(flow, decision.detail, decision.rate)
+            if len(self.pending) > self.max_pending:
+                # 在途请求过多时先写出最早的请求部分
+                _, record = self.pending.popitem(last=False)
+                self.evicted += 1
+                self._write_log(dict(record, complete=False))
         except Exception as e:
             logger.error(f"❌ Failed to log request: {e}")
         
         return None
 
     def response(self, flow: http.HTTPFlow) -> Optional[http.HTTPFlow]:
-        """记录响应"""
+        """写出合并后的请求/响应记录"""
         if not flow.response:
             return None
             
         try:
-            response_data = {
-                "timestamp": datetime.now().isoformat(),
-                "type": "response",
-                "method": flow.request.method,
-                "url": flow.request.pretty_url,
-                "status_code": flow.response.status_code,
-                "headers": dict(flow.response.headers),
-                "content_length": len(flow.response.content) if flow.response.content else 0,
-            }
-            
-            self._write_log(response_data)
+            self._complete(flow)
         except Exception as e:
             logger.error(f"❌ Failed to log response: {e}")
         
         return None
 
+    def error(self, flow: http.HTTPFlow) -> None:
+        """连接出错的请求同样写出一条记录"""
+        try:
+            self._complete(flow)
+        except Exception as e:
+            logger.error(f"❌ Failed to log error: {e}")
+
+    def _request_part(self, flow: http.HTTPFlow, detail: str = DETAIL_FULL, rate: float = 1.0) -> dict:
+        request = flow.request
+        record = {
+            "timestamp": datetime.fromtimestamp(request.timestamp_start).isoformat(),
+            "type": "flow",
+            "flow_id": flow.id,
+            "method": request.method,
+            "url": request.pretty_url,
+        }
+        headers = apply_detail(request.headers, detail)
+        if headers is not None:
+            record["headers"] = headers
+        record["content_length"] = len(request.raw_content) if request.raw_content else 0
+        record["request_bytes"] = _wire_size(request, assemble_request_head)
+        if detail != DETAIL_FULL:
+            record["detail"] = detail
+        if rate < 1.0:
+            record["sample_rate"] = rate
+        return record
+
+    def _complete(self, flow: http.HTTPFlow):
+        """合并请求部分、响应和时间戳并写出，每个 flow 只写一次"""
+        if flow.metadata.get(LOGGED_KEY):
+            return
+        flow.metadata[LOGGED_KEY] = True
+        record = self.pending.pop(flow.id, None)
+        if self.sampler.force_full(flow):
+            detail = DETAIL_FULL
+            if record is None or "detail" in record or "sample_rate" in record:
+                record = self._request_part(flow)
+        else:
+            decision = self.sampler.decide(flow)
+            if not decision.sampled:
+                return
+            detail = decision.detail
+            if record is None:
+                record = self._request_part(flow, detail, decision.rate)
+        response = flow.response
+        if response is not None:
+            record["status_code"] = response.status_code
+            headers = apply_detail(response.headers, detail)
+            if headers is not None:
+                record["response_headers"] = headers
+            record["response_content_length"] = len(response.raw_content) if response.raw_content else 0
+            record["response_bytes"] = _wire_size(response, assemble_response_head)
+        if flow.error is not None:
+            record["error"] = flow.error.msg
+        verdict = flow_verdict(flow.metadata)
+        if verdict is not None:
+            record["action"] = verdict.action
+        upstream = flow.metadata.get("warpgateway.upstream")
+        if upstream:
+            record["upstream"] = upstream
+        record["timing"] = flow_timing(flow)
+        self._write_log(record)
+
     def _write_log(self, data: dict):
-        """写入日志文件"""
-        with open(self.log_file, "a", encoding="utf-8") as f:
-            f.write(json.dumps(data, ensure_ascii=False) + "\n")
+        """提交日志记录"""
+        self.writer.write(data)
+
+    def done(self):
+        """关闭时写出在途请求并写完队列中的记录"""
+        while self.pending:
+            _, record = self.pending.popitem(last=False)
+            self._write_log(dict(record, complete=False))
+        self.writer.close()
+        stats = self.writer.stats()
+        logger.info(f"📁 Request log closed: {stats['written']} written, {stats['dropped']} dropped")
+
+    def writer_stats(self) -> dict:
+        """日志写入统计"""
+        stats = self.writer.stats()
+        stats["pending_flows"] = len(self.pending)
+        stats["evicted_flows"] = self.evicted
+        return stats
@@ -4,55 +4,270 @@ import logging
 from collections import defaultdict
 from datetime import datetime
 from mitmproxy import http
-from typing import Optional, Dict
+from typing import Callable, Optional, Dict, List
 from ..core.interceptor import BaseInterceptor
+from ..utils.latency import LatencyTracker, flow_latencies
+from ..utils.metrics_store import MetricsSink
+from ..utils.rate import WindowedCounter
+from ..utils.stats_snapshot import StatsSnapshotter, load_snapshot
+from ..utils.ruleset import ACTION_BLOCK, flow_verdict
+from ..utils.topk import SpaceSaving
 
 logger = logging.getLogger(__name__)
 
+# 滑动窗口计数的指标；bytes 为请求和响应正文字节数
+RATE_METRICS = ("requests", "responses", "blocked", "errors", "bytes")
+# Top-K 表：主机和路径模板各按请求数、正文字节数统计
+TOP_TABLES = ("hosts", "paths", "host_bytes", "path_bytes")
+
 
 class StatsHandler(BaseInterceptor):
-    """统计分析处理器"""
+    """统计分析处理器
+
+    除计数外，按总体、主机和路径模板记录延迟直方图（总耗时、首字节、
+    上游连接，见 LatencyTracker），内存固定且可以合并。
+
+    请求、响应、拦截、错误和字节数另有 1 秒精度的滑动窗口计数
+    （见 WindowedCounter），get_stats() 中的 requests_per_second 是最近
+    1 分钟的速率，rates 给出 1m/5m/15m 的平均速率和单秒峰值。
+
+    主机和路径模板的 Top-K 用 SpaceSaving 统计，每张表最多跟踪
+    top_capacity 个键，结果带误差上界，不同主机和 URL 再多内存也不变。
 
-    def __init__(self):
+    提供 snapshotter 时按其间隔把累计计数、直方图和 Top-K 写入快照文件
+    （见 to_dict()），启动时可用 restore() 接着上次的数据累计。滑动窗口
+    速率只反映当前负载，不写入快照。
+
+    提供 metrics 时，每个完成的请求还会按分钟汇总进 SQLite 历史指标库
+    （见 MetricsSink），用于查看按天、按主机的趋势。
+    """
+
+    def __init__(
+        self,
+        max_latency_keys: int = 256,
+        top_capacity: int = 1000,
+        snapshotter: Optional[StatsSnapshotter] = None,
+        metrics: Optional[MetricsSink] = None,
+    ):
         super().__init__("StatsHandler")
+        self.snapshotter = snapshotter
+        self.metrics = metrics
+        self.latency = LatencyTracker(max_latency_keys)
+        self.windows = WindowedCounter(RATE_METRICS)
+        self.top_capacity = top_capacity
+        self.top = {name: SpaceSaving(top_capacity) for name in TOP_TABLES}
         self.stats = {
             "total_requests": 0,
             "total_responses": 0,
             "blocked_requests": 0,
+            "errors": 0,
             "methods": defaultdict(int),
             "status_codes": defaultdict(int),
-            "hosts": defaultdict(int),
         }
+        # 本进程开始计数的时间，运行时长和各项速率都以它为准
         self.start_time = datetime.now()
+        # 从快照恢复时，累计统计最初开始的时间及恢复时已有的请求数
+        self.restored_since: Optional[datetime] = None
+        self._restored_requests = 0
+        # 其他组件提供的统计，get_stats() 时按名称合并
+        self.sources: Dict[str, Callable[[], Dict]] = {}
+
+    @classmethod
+    def from_config(cls, config) -> "StatsHandler":
+        """按 stats 配置创建，save_interval 大于 0 时定期保存快照"""
+        options = config.stats
+        snapshotter = None
+        if options["save_interval"] > 0 and options["output_file"]:
+            snapshotter = StatsSnapshotter(options["output_file"], options["save_interval"])
+        metrics = MetricsSink.from_config(options["metrics"]) if options["metrics"]["enabled"] else None
+        handler = cls(
+            max_latency_keys=options["max_latency_keys"],
+            top_capacity=options["top_capacity"],
+            snapshotter=snapshotter,
+            metrics=metrics,
+        )
+        if options["restore"] and options["output_file"]:
+            handler.restore(options["output_file"])
+        if snapshotter is not None:
+            snapshotter.start()
+        if metrics is not None:
+            metrics.start()
+        return handler
+
+    def add_source(self, name: str, provider: Callable[[], Dict]):
+        """注册额外的统计来源"""
+        self.sources[name] = provider
 
     def request(self, flow: http.HTTPFlow) -> Optional[http.HTTPFlow]:
         """统计请求"""
+        self._count_request(flow)
+        return None
+
+    def _keys(self, flow: http.HTTPFlow):
+        """(主机, 路径模板)，与延迟统计使用同一套模板"""
+        host = flow.request.pretty_host
+        return host, self.latency.template(host, flow.request.path)
+
+    def _count_bytes(self, flow: http.HTTPFlow, content: Optional[bytes]):
+        if content:
+            size = len(content)
+            host, path = self._keys(flow)
+            self.top["host_bytes"].add(host, size)
+            self.top["path_bytes"].add(path, size)
+            self.windows.add("bytes", size)
+
+    def _count_request(self, flow: http.HTTPFlow):
         self.stats["total_requests"] += 1
         self.stats["methods"][flow.request.method] += 1
-        self.stats["hosts"][flow.request.host] += 1
-        
-        # 检查是否被拦截
-        if flow.response and flow.response.status_code == 403:
-            self.stats["blocked_requests"] += 1
-        
-        return None
+        host, path = self._keys(flow)
+        self.top["hosts"].add(host)
+        self.top["paths"].add(path)
+        self.windows.add("requests")
+        self._count_bytes(flow, flow.request.raw_content)
 
     def response(self, flow: http.HTTPFlow) -> Optional[http.HTTPFlow]:
         """统计响应"""
         if flow.response:
+            # 被拦截的请求在 WarpHandler 处截止，不会经过 request()，在这里补记
+            verdict = flow_verdict(flow.metadata)
+            blocked = verdict is not None and verdict.action == ACTION_BLOCK
+            if blocked:
+                self._count_request(flow)
+                self.stats["blocked_requests"] += 1
+                self.windows.add("blocked")
             self.stats["total_responses"] += 1
             self.stats["status_codes"][flow.response.status_code] += 1
+            self.windows.add("responses")
+            self._count_bytes(flow, flow.response.raw_content)
+            latencies = flow_latencies(flow)
+            self.latency.record(flow.request.pretty_host, flow.request.path, latencies)
+            if self.metrics is not None:
+                self.metrics.record(
+                    flow.request.pretty_host,
+                    blocked=blocked,
+                    size=len(flow.request.raw_content or b"") + len(flow.response.raw_content or b""),
+                    latency_us=latencies["total"],
+                )
         
+        self._maybe_snapshot()
         return None
 
+    def error(self, flow: http.HTTPFlow) -> None:
+        """统计连接错误"""
+        self.stats["errors"] += 1
+        self.windows.add("errors")
+        if self.metrics is not None:
+            self.metrics.record(
+                flow.request.pretty_host, error=True, size=len(flow.request.raw_content or b"")
+            )
+        self._maybe_snapshot()
+
+    def _maybe_snapshot(self):
+        # 在事件循环中序列化，写文件交给后台线程
+        if self.snapshotter is not None and self.snapshotter.due():
+            self.snapshotter.submit(self.to_dict())
+
+    def done(self):
+        """关闭时写出最后一份快照和当前分钟的历史指标"""
+        if self.snapshotter is not None:
+            self.snapshotter.close(self.to_dict())
+            logger.info(f"💾 Stats snapshot saved to {self.snapshotter.path}")
+        if self.metrics is not None:
+            self.metrics.close()
+
+    def to_dict(self) -> Dict:
+        """累计统计的可 JSON 化表示，可用 load_dict() 恢复"""
+        return {
+            # 累计统计的起点，多次重启后仍是最初的时间
+            "start_time": (self.restored_since or self.start_time).timestamp(),
+            "counters": {
+                name: self.stats[name]
+                for name in ("total_requests", "total_responses", "blocked_requests", "errors")
+            },
+            "methods": dict(self.stats["methods"]),
+            "status_codes": {str(code): n for code, n in self.stats["status_codes"].items()},
+            "latency": self.latency.to_dict(),
+            "top": {name: summary.to_dict() for name, summary in self.top.items()},
+        }
+
+    def load_dict(self, data: Dict):
+        """用 to_dict() 的结果替换当前的累计统计
+
+        start_time 保持为本进程的启动时间，停机期间不计入运行时长和速率；
+        快照中的起点记为 restored_since。
+        """
+        start_time = self.start_time
+        self._clear()
+        self.start_time = start_time
+        self.restored_since = datetime.fromtimestamp(data["start_time"])
+        self.stats.update(data.get("counters", {}))
+        self._restored_requests = self.stats["total_requests"]
+        self.stats["methods"].update(data.get("methods", {}))
+        for code, n in data.get("status_codes", {}).items():
+            self.stats["status_codes"][int(code)] = n
+        latency = LatencyTracker.from_dict(data.get("latency", {}))
+        latency.max_keys = self.latency.max_keys
+        self.latency = latency
+        for name, summary in data.get("top", {}).items():
+            if name in self.top:
+                restored = SpaceSaving.from_dict(summary)
+                if restored.capacity != self.top_capacity:
+                    # 容量改变时合并进新表，超出的键按计数裁剪
+                    self.top[name].merge(restored)
+                else:
+                    self.top[name] = restored
+
+    def restore(self, path) -> bool:
+        """从快照文件恢复累计统计，没有可用快照时返回 False"""
+        data = load_snapshot(path)
+        if data is None:
+            return False
+        try:
+            self.load_dict(data)
+        except Exception as e:
+            logger.warning(f"⚠️ Failed to restore stats from {path}: {e}")
+            self._clear()
+            return False
+        logger.info(
+            f"♻️ Restored stats from {path}: {self.stats['total_requests']} requests since "
+            f"{self.restored_since:%Y-%m-%d %H:%M:%S}"
+        )
+        return True
+
+    def top_keys(self, name: str, n: int = 20) -> List[Dict]:
+        """某张 Top-K 表中计数最大的 n 个键，count - error 是真实值的下界"""
+        return [
+            {"key": key, "count": count, "error": error} for key, count, error in self.top[name].top(n)
+        ]
+
     def get_stats(self) -> Dict:
         """获取统计信息"""
         uptime = (datetime.now() - self.start_time).total_seconds()
-        return {
+        # 速率只用本进程处理的请求，恢复的累计值不计入
+        requests = self.stats["total_requests"] - self._restored_requests
+        top = {name: self.top_keys(name) for name in TOP_TABLES}
+        stats = {
             **self.stats,
+            "hosts": {item["key"]: item["count"] for item in top["hosts"]},
+            "top": top,
             "uptime_seconds": uptime,
-            "requests_per_second": self.stats["total_requests"] / uptime if uptime > 0 else 0,
+            "restored_since": self.restored_since.timestamp() if self.restored_since else None,
+            "requests_per_second": 0.0,
+            "lifetime_requests_per_second": requests / uptime if uptime > 0 else 0,
+            "rates": self.windows.rates(elapsed=uptime),
+            "latency": self.latency.stats(),
         }
+        if self.snapshotter is not None:
+            stats["snapshot"] = self.snapshotter.stats()
+        if self.metrics is not None:
+            stats["metrics"] = self.metrics.stats()
+        stats["requests_per_second"] = stats["rates"]["1m"]["rate"]["requests"]
+        for name, provider in self.sources.items():
+            try:
+                stats[name] = provider()
+            except Exception as e:
+                logger.error(f"❌ Failed to collect stats from {name}: {e}")
+        return stats
 
     def print_stats(self):
         """打印统计信息"""
@@ -62,25 +277,113 @@ class StatsHandler(BaseInterceptor):
         logger.info(f"  Total Requests: {stats['total_requests']}")
         logger.info(f"  Total Responses: {stats['total_responses']}")
         logger.info(f"  Blocked Requests: {stats['blocked_requests']}")
+        logger.info(f"  Errors: {stats['errors']}")
         logger.info(f"  Uptime: {stats['uptime_seconds']:.2f}s")
-        logger.info(f"  Requests/sec: {stats['requests_per_second']:.2f}")
+        if self.restored_since is not None:
+            logger.info(f"  Counting Since: {self.restored_since:%Y-%m-%d %H:%M:%S} (restored)")
+        logger.info(
+            f"  Requests/sec: {stats['requests_per_second']:.2f} (1m), "
+            f"{stats['lifetime_requests_per_second']:.2f} (lifetime)"
+        )
+        for window, values in stats["rates"].items():
+            rate = values["rate"]
+            logger.info(
+                f"  {window:>3}: {rate['requests']:.2f} req/s (peak {values['peak']['requests']}/s), "
+                f"{rate['blocked']:.2f} blocked/s, {rate['errors']:.2f} errors/s, "
+                f"{rate['bytes'] / 1024:.1f} KiB/s"
+            )
         logger.info(f"  Methods: {dict(stats['methods'])}")
         logger.info(f"  Status Codes: {dict(stats['status_codes'])}")
-        logger.info(f"  Top Hosts: {dict(list(stats['hosts'].items())[:5])}")
+        top = stats["top"]
+        for title, name, unit in (
+            ("Top Hosts", "hosts", ""),
+            ("Top Paths", "paths", ""),
+            ("Top Hosts by Bytes", "host_bytes", "B"),
+            ("Top Paths by Bytes", "path_bytes", "B"),
+        ):
+            if top[name]:
+                items = ", ".join(
+                    f"{item['key']}={item['count']}{unit}" + (f"(±{item['error']})" if item["error"] else "")
+                    for item in top[name][:5]
+                )
+                logger.info(f"  {title}: {items}")
+        latency = stats["latency"]
+        if latency["overall"]["total"]["count"]:
+            logger.info(f"  Latency: {_format_latency(latency['overall'])}")
+            for title, table in (("Host", latency["hosts"]), ("Path", latency["paths"])):
+                for key, summary in list(table.items())[:5]:
+                    logger.info(f"    {title} {key}: {_format_latency(summary)}")
+        rules = stats.get("rules")
+        if rules:
+            timing = rules["match_ns"]
+            logger.info(
+                f"  Rules: {rules['total_rules']} total, {rules['hit_rules']} hit, "
+                f"{rules['never_hit']} never hit"
+            )
+            logger.info(
+                f"  Match Time: p50={timing['p50'] / 1000:.1f}us "
+                f"p99={timing['p99'] / 1000:.1f}us (1/{rules['timing_sample_every']} sampled)"
+            )
+            for rule in rules["top_rules"][:5]:
+                logger.info(f"    {rule['id']} {rule['pattern']}: {rule['hits']} hits")
+        upstream = stats.get("upstream")
+        if upstream:
+            logger.info(f"  Upstream: {upstream['direct']} direct")
+            for route in upstream["routes"]:
+                for member in route["upstreams"]:
+                    state = "healthy" if member["healthy"] else "unhealthy"
+                    latency = member["latency_ms"]
+                    latency = f"{latency:.1f}ms" if latency is not None else "n/a"
+                    logger.info(
+                        f"    {route['pattern']} -> {member['upstream']}: {state}, "
+                        f"{latency}, {member['requests']} requests, {member['errors']} errors"
+                    )
+        request_log = stats.get("request_log")
+        if request_log:
+            logger.info(
+                f"  Request Log: {request_log['written']} written, {request_log['dropped']} dropped, "
+                f"{request_log['queued']} queued"
+            )
+        sampling = stats.get("log_sampling")
+        if sampling:
+            logger.info(
+                f"  Log Sampling: detail={sampling['detail']}, {sampling['sampled']} sampled, "
+                f"{sampling['skipped']} skipped"
+            )
         logger.info("=" * 60)
 
     def reset(self):
         """重置统计"""
+        self._clear()
+        logger.info("🔄 Statistics reset")
+
+    def _clear(self):
         self.stats = {
             "total_requests": 0,
             "total_responses": 0,
             "blocked_requests": 0,
+            "errors": 0,
             "methods": defaultdict(int),
             "status_codes": defaultdict(int),
-            "hosts": defaultdict(int),
         }
         self.start_time = datetime.now()
-        logger.info("🔄 Statistics reset")
+        self.restored_since = None
+        self._restored_requests = 0
+        self.latency.clear()
+        self.top = {name: SpaceSaving(self.top_capacity) for name in TOP_TABLES}
+        self.windows.clear()
+
+
+def _format_latency(summary: Dict) -> str:
+    """一行延迟摘要：总耗时、首字节和连接的 p50/p90/p99/max（毫秒）"""
+    parts = []
+    for metric in ("total", "ttfb", "connect"):
+        m = summary[metric]
+        if m["count"]:
+            parts.append(
+                f"{metric} p50={m['p50']:.1f} p90={m['p90']:.1f} p99={m['p99']:.1f} max={m['max']:.1f}ms"
+            )
+    return f"{summary['total']['count']} req, " + ", ".join(parts)
 
 
 # 别名，用于 GUI
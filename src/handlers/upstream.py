@@ -0,0 +1,137 @@
+"""上游代理路由处理器"""
+
+import logging
+from mitmproxy import http
+from mitmproxy.connection import Server
+from typing import Optional
+from weakref import WeakKeyDictionary
+from ..core.interceptor import BaseInterceptor
+from ..utils.routing import UpstreamRouter
+from ..utils.upstream_pool import UpstreamHealthChecker
+
+logger = logging.getLogger(__name__)
+
+
+class UpstreamHandler(BaseInterceptor):
+    """按请求选择上游代理
+
+    根据 Config.upstream_router 的结果设置 flow.server_conn.via：命中路由的
+    请求经代理池中健康且延迟最低的上游转发，其余请求直连。mitmproxy 按
+    (地址, TLS, via) 复用同一客户端连接上的服务端连接，所以每个上游各自
+    保持长连接，直连流量不受影响。代理需以 connection_strategy=lazy 运行，
+    服务端连接才会推迟到 request 钩子之后建立。
+
+    上游连接失败时立即把该上游标记为不健康，后续请求切换到池中其他成员；
+    后台健康检查负责恢复。
+    """
+
+    def __init__(self, config):
+        super().__init__("UpstreamHandler")
+        self.config = config
+        self.direct = 0
+        # 每个 flow 使用请求开始时的路由表，重载不影响进行中的请求
+        self._routers: "WeakKeyDictionary[http.HTTPFlow, UpstreamRouter]" = WeakKeyDictionary()
+        self.health_checker: Optional[UpstreamHealthChecker] = None
+        self._start_health_checks()
+        logger.info(f"🔀 Loaded {len(config.upstream_router)} upstream routes")
+
+    def _start_health_checks(self):
+        """有上游代理时启动后台健康检查，探测对象随配置切换"""
+        health = self.config.upstream_health
+        if self.health_checker is not None:
+            self.health_checker.interval = health["interval"]
+            self.health_checker.timeout = health["timeout"]
+            self.health_checker.target = health["probe_target"]
+            return
+        if not self.config.upstream_router.members:
+            return
+        self.health_checker = UpstreamHealthChecker(
+            lambda: self.config.upstream_router.members.values(),
+            interval=health["interval"],
+            timeout=health["timeout"],
+            target=health["probe_target"],
+        )
+        self.health_checker.start()
+
+    def stop(self):
+        """停止健康检查"""
+        if self.health_checker is not None:
+            self.health_checker.stop()
+            self.health_checker = None
+
+    def done(self):
+        """代理关闭时停止健康检查"""
+        self.stop()
+
+    def reload(self, config):
+        """切换到新配置，同名上游沿用已有的健康状态"""
+        config.upstream_router.inherit(self.config.upstream_router)
+        self.config = config
+        self._start_health_checks()
+        logger.info(f"🔄 Upstream routes reloaded ({len(config.upstream_router)} routes)")
+
+    def request(self, flow: http.HTTPFlow) -> Optional[http.HTTPFlow]:
+        """为请求设置上游代理"""
+        router = self.config.upstream_router
+        member = router.select(flow.request.pretty_url, flow.request.host)
+        if member is None:
+            self.direct += 1
+            spec = None
+        else:
+            member.requests += 1
+            spec = (member.scheme, member.address)
+            flow.metadata["warpgateway.upstream"] = member.upstream
+            self._routers[flow] = router
+
+        if spec != flow.server_conn.via:
+            # 已建立的服务端连接不能再修改，换成新的连接对象，
+            # 由 mitmproxy 从连接池中取出或新建对应 via 的连接
+            if flow.server_conn.timestamp_start is not None:
+                flow.server_conn = Server(address=flow.server_conn.address)
+            flow.server_conn.via = spec
+            if member is not None:
+                logger.debug(f"🔀 UPSTREAM: {flow.request.pretty_url} via {member.upstream}")
+        return None
+
+    def _member(self, flow: http.HTTPFlow):
+        """请求所用的上游；metadata 中只存地址，保证 flow 可以序列化"""
+        upstream = flow.metadata.get("warpgateway.upstream")
+        if not upstream:
+            return None
+        router = self._routers.get(flow, self.config.upstream_router)
+        return router.members.get(upstream)
+
+    def response(self, flow: http.HTTPFlow) -> Optional[http.HTTPFlow]:
+        """用本次请求新建连接的耗时更新上游延迟"""
+        member = self._member(flow)
+        if member is None:
+            return None
+        conn = flow.server_conn
+        # 经上游的连接是隧道，没有 timestamp_tcp_setup，timestamp_start 是隧道
+        # （TCP + CONNECT）建立完成的时刻；连接在请求读完后才建立，复用的连接
+        # 早于本次请求，不计入
+        started = flow.request.timestamp_end
+        if conn.timestamp_start and started and conn.timestamp_start >= started:
+            member.record_success(conn.timestamp_start - started)
+        return None
+
+    def error(self, flow: http.HTTPFlow) -> None:
+        """上游连接失败时标记该上游不健康，后续请求随即切换
+
+        只统计连接未能建立的错误：连接上游或 CONNECT 失败时 flow.server_conn
+        保持未连接状态（timestamp_start 为空）；客户端断开、服务端中途出错等
+        发生在隧道建立之后，与上游健康无关。
+        """
+        member = self._member(flow)
+        if member is None or flow.response is not None:
+            return None
+        if flow.server_conn.timestamp_start is not None:
+            return None
+        message = flow.error.msg if flow.error else "unknown error"
+        logger.warning(f"⚠️  UPSTREAM FAILED: {flow.request.pretty_url} via {member.upstream}: {message}")
+        member.record_failure(message)
+        return None
+
+    def route_stats(self) -> dict:
+        """路由统计与各上游健康状态"""
+        return {"direct": self.direct, **self.config.upstream_router.stats()}
@@ -4,45 +4,61 @@ import logging
 from mitmproxy import http
 from typing import Optional
 from ..core.interceptor import BaseInterceptor
-from ..utils.rules import RuleMatcher, RuleType
+from ..utils.log_sampling import LogSampler
+from ..utils.rules import RuleType
+from ..utils.rule_snapshot import load_ruleset
+from ..utils.ruleset import ACTION_ALLOW, ACTION_BLOCK, ACTION_LOG_ONLY, RuleSet, store_verdict
 
 logger = logging.getLogger(__name__)
 
 
 class WarpHandler(BaseInterceptor):
-    """Warp 请求处理器"""
+    """Warp 请求处理器
 
-    def __init__(self, config):
+    分类逻辑全部在 RuleSet 中，这里只负责把判定结果作用到 flow 上。
+    规则集整体替换，每个请求在开始时取一次 self.ruleset，重载不会让
+    同一个请求看到两套规则。
+    """
+
+    def __init__(self, config, sampler: Optional[LogSampler] = None):
         super().__init__("WarpHandler")
         self.config = config
-
-        # 初始化规则匹配器
-        self.block_matcher = RuleMatcher()
-        self.allow_matcher = RuleMatcher()
-        self.log_only_matcher = RuleMatcher()
-
-        # 加载规则
-        self._load_rules()
-
-    def _load_rules(self):
-        """加载规则"""
-        # 默认使用包含匹配，可以根据配置使用其他类型
-        self.block_matcher.add_rules(self.config.block_rules, RuleType.CONTAINS)
-        self.allow_matcher.add_rules(self.config.allow_rules, RuleType.CONTAINS)
-        self.log_only_matcher.add_rules(self.config.log_only_rules, RuleType.CONTAINS)
-
-        logger.info(f"📋 Loaded {len(self.block_matcher)} block rules")
-        logger.info(f"📋 Loaded {len(self.allow_matcher)} allow rules")
-        logger.info(f"📋 Loaded {len(self.log_only_matcher)} log_only rules")
+        # 负载高时只为采样到的请求输出逐请求的 INFO 日志
+        self.sampler = sampler
+        self.ruleset = load_ruleset(config)
+        self.generation = 0
+        self._log_rule_counts()
+
+    def _log_rule_counts(self):
+        """输出规则数量"""
+        logger.info(f"📋 Loaded {self.ruleset.count(ACTION_BLOCK)} block rules")
+        logger.info(f"📋 Loaded {self.ruleset.count(ACTION_ALLOW)} allow rules")
+        logger.info(f"📋 Loaded {self.ruleset.count(ACTION_LOG_ONLY)} log_only rules")
+
+    def reload(self, config):
+        """使用新配置重建规则集"""
+        self.swap(config, load_ruleset(config))
+
+    def swap(self, config, ruleset: RuleSet):
+        """换上已经构建好的规则集"""
+        self.config = config
+        self.ruleset = ruleset
+        self.generation += 1
+        self._log_rule_counts()
+        logger.info(f"🔄 Rules reloaded (generation {self.generation})")
 
     def request(self, flow: http.HTTPFlow) -> Optional[http.HTTPFlow]:
         """处理请求"""
         url = flow.request.pretty_url
         method = flow.request.method
-        path = flow.request.path
+
+        verdict = self.ruleset.classify(url, flow.request.host)
+        store_verdict(flow.metadata, verdict)
+        flow.metadata["warpgateway.generation"] = self.generation
+        action = verdict.action
 
         # 检查拦截规则
-        if self.block_matcher.match(url):
+        if action == ACTION_BLOCK:
             logger.warning(f"🚫 BLOCKED: {method} {url}")
             flow.response = http.Response.make(
                 403,
@@ -52,27 +68,33 @@ class WarpHandler(BaseInterceptor):
             return flow  # 返回修改后的 flow，阻止后续处理
 
         # 启用流式响应（适用于 AI 流式输出）
-        for stream_path in self.config.streaming_paths:
-            if stream_path in path:
-                flow.response = http.Response.make(200)
-                flow.response.stream = True
+        if verdict.stream:
+            flow.response = http.Response.make(200)
+            flow.response.stream = True
+            if self._verbose(flow):
                 logger.info(f"🌊 STREAM ENABLED: {method} {url}")
-                break
 
         # 检查放行规则
-        if self.allow_matcher.match(url):
-            logger.info(f"✅ ALLOWED: {method} {url}")
+        if action == ACTION_ALLOW:
+            if self._verbose(flow):
+                logger.info(f"✅ ALLOWED: {method} {url}")
             return None
 
         # 检查仅记录规则
-        if self.log_only_matcher.match(url):
-            logger.info(f"📝 LOG_ONLY: {method} {url}")
+        if action == ACTION_LOG_ONLY:
+            if self._verbose(flow):
+                logger.info(f"📝 LOG_ONLY: {method} {url}")
             return None
 
         # 其他请求正常通过
         logger.debug(f"➡️  PASS: {method} {url}")
         return None
 
+    def _verbose(self, flow: http.HTTPFlow) -> bool:
+        if not logger.isEnabledFor(logging.INFO):
+            return False
+        return self.sampler is None or self.sampler.verbose(flow)
+
     def response(self, flow: http.HTTPFlow) -> Optional[http.HTTPFlow]:
         """处理响应"""
         if flow.response:
@@ -83,10 +105,18 @@ class WarpHandler(BaseInterceptor):
 
     def add_block_rule(self, pattern: str, rule_type: RuleType = RuleType.CONTAINS):
         """动态添加拦截规则"""
-        self.block_matcher.add_rule(pattern, rule_type)
+        self.ruleset.add_rule(ACTION_BLOCK, pattern, rule_type)
         logger.info(f"➕ Added block rule: {pattern}")
 
     def add_allow_rule(self, pattern: str, rule_type: RuleType = RuleType.CONTAINS):
         """动态添加放行规则"""
-        self.allow_matcher.add_rule(pattern, rule_type)
+        self.ruleset.add_rule(ACTION_ALLOW, pattern, rule_type)
         logger.info(f"➕ Added allow rule: {pattern}")
+
+    def cache_stats(self) -> dict:
+        """判定缓存统计"""
+        return self.ruleset.cache_stats()
+
+    def rule_stats(self) -> dict:
+        """规则命中与匹配耗时统计"""
+        return self.ruleset.stats()
@@ -1,5 +1,7 @@
 """工具模块"""
 
-from .rules import RuleMatcher, Rule
+from .rules import RuleMatcher, Rule, RuleType, parse_rule_spec
+from .ruleset import RuleSet, Verdict
+from .routing import UpstreamRouter
 
-__all__ = ["RuleMatcher", "Rule"]
+__all__ = ["RuleMatcher", "Rule", "RuleType", "parse_rule_spec", "RuleSet", "Verdict", "UpstreamRouter"]
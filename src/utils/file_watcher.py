@@ -0,0 +1,80 @@
+"""文件变更监视"""
+
+import logging
+import os
+import threading
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+_Signature = Optional[Tuple[int, int]]
+
+
+def _signature(path: Path) -> _Signature:
+    """文件的 (mtime_ns, size)，文件不存在时为 None"""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
+
+class FileWatcher:
+    """轮询方式的文件变更监视
+
+    每隔 interval 秒比较一次各文件的修改时间和大小，有变化时以变化的
+    路径列表调用 callback。被监视的文件列表每轮重新获取，配置中新增的
+    规则文件会自动纳入。轮询只做 stat，不依赖平台相关的通知机制。
+    """
+
+    def __init__(
+        self,
+        paths: Callable[[], Iterable[Path]],
+        callback: Callable[[List[Path]], None],
+        interval: float = 2.0,
+    ):
+        self.paths = paths
+        self.callback = callback
+        self.interval = interval
+        self._signatures: Dict[Path, _Signature] = {}
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def poll(self) -> List[Path]:
+        """检查一轮，返回发生变化的文件；首次出现的文件只记录不算变化"""
+        changed = []
+        signatures = {}
+        for path in self.paths():
+            path = Path(path)
+            signature = _signature(path)
+            signatures[path] = signature
+            if path in self._signatures and self._signatures[path] != signature:
+                changed.append(path)
+        self._signatures = signatures
+        return changed
+
+    def _run(self):
+        self.poll()
+        while not self._stop.wait(self.interval):
+            try:
+                changed = self.poll()
+                if changed:
+                    self.callback(changed)
+            except Exception as e:
+                logger.error(f"❌ File watcher error: {e}")
+
+    def start(self):
+        """启动后台轮询"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="file-watcher", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """停止轮询"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(self.interval + 1)
+            self._thread = None
@@ -0,0 +1,132 @@
+"""对数分桶直方图"""
+
+from typing import Dict, Optional
+
+
+class LogHistogram:
+    """HDR 风格的对数分桶直方图
+
+    小于 2**sub_bits 的值各占一个桶；更大的值按 2 的幂分段，每段再线性
+    切成 2**sub_bits 个子桶，相对误差不超过 1/2**sub_bits。桶数只与数值
+    范围有关（64 位整数最多约 60 * 2**sub_bits 个），内存固定；两个
+    sub_bits 相同的直方图可以直接合并。
+
+    只接受非负整数，调用方负责选择单位（纳秒、微秒、字节等）。
+    """
+
+    __slots__ = ("sub_bits", "counts", "count", "total", "min", "max")
+
+    def __init__(self, sub_bits: int = 4):
+        self.sub_bits = sub_bits
+        self.counts: Dict[int, int] = {}
+        self.count = 0
+        self.total = 0
+        self.min: Optional[int] = None
+        self.max: Optional[int] = None
+
+    def _index(self, value: int) -> int:
+        """值所在的桶编号"""
+        sub = 1 << self.sub_bits
+        if value < sub:
+            return value
+        shift = value.bit_length() - 1 - self.sub_bits
+        return sub + shift * sub + (value >> shift) - sub
+
+    def _bounds(self, index: int):
+        """桶的取值范围 [low, high]"""
+        sub = 1 << self.sub_bits
+        if index < sub:
+            return index, index
+        shift, offset = divmod(index - sub, sub)
+        low = (sub + offset) << shift
+        return low, low + (1 << shift) - 1
+
+    def record(self, value: int, count: int = 1):
+        """记录一个值"""
+        if value < 0:
+            value = 0
+        index = self._index(value)
+        counts = self.counts
+        counts[index] = counts.get(index, 0) + count
+        self.count += count
+        self.total += value * count
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def percentile(self, p: float) -> float:
+        """近似百分位数（p 取 0-100），空直方图返回 0"""
+        if not self.count:
+            return 0
+        target = max(1, int(round(self.count * p / 100.0)))
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= target:
+                low, high = self._bounds(index)
+                # 取桶中点，并收敛到实际观测到的最小/最大值之内
+                return min(max((low + high) / 2, self.min), self.max)
+        return self.max
+
+    def merge(self, other: "LogHistogram"):
+        """合并另一个直方图"""
+        if other.sub_bits != self.sub_bits:
+            raise ValueError("Cannot merge histograms with different sub_bits")
+        counts = self.counts
+        for index, n in other.counts.items():
+            counts[index] = counts.get(index, 0) + n
+        self.count += other.count
+        self.total += other.total
+        if other.min is not None and (self.min is None or other.min < self.min):
+            self.min = other.min
+        if other.max is not None and (self.max is None or other.max > self.max):
+            self.max = other.max
+
+    def clear(self):
+        """清空"""
+        self.counts = {}
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    def summary(self) -> Dict:
+        """计数、均值、最值和常用百分位"""
+        return {
+            "count": self.count,
+            "min": self.min or 0,
+            "max": self.max or 0,
+            "mean": self.total / self.count if self.count else 0,
+            "p50": self.percentile(50),
+            "p90": self.percentile(90),
+            "p99": self.percentile(99),
+        }
+
+    def to_dict(self) -> Dict:
+        """序列化为可 JSON 化的字典"""
+        return {
+            "sub_bits": self.sub_bits,
+            "counts": {str(k): v for k, v in self.counts.items()},
+            "count": self.count,
+            "total": self.total,
+            "min": self.min,
+            "max": self.max,
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "LogHistogram":
+        """从 to_dict() 的结果恢复"""
+        hist = cls(data.get("sub_bits", 4))
+        hist.counts = {int(k): v for k, v in data.get("counts", {}).items()}
+        hist.count = data.get("count", 0)
+        hist.total = data.get("total", 0)
+        hist.min = data.get("min")
+        hist.max = data.get("max")
+        return hist
+
+    def __len__(self):
+        return self.count
+
+    def __repr__(self):
+        return f"LogHistogram(count={self.count}, p50={self.percentile(50)}, max={self.max})"
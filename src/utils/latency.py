@@ -0,0 +1,193 @@
+"""按主机和路径模板统计的延迟直方图"""
+
+import re
+from typing import Dict, Optional
+from .cache import LRUCache
+from .histogram import LogHistogram
+
+# total：请求开始到响应结束；ttfb：请求开始到收到响应头；connect：建立上游连接（含 TLS）
+METRICS = ("total", "ttfb", "connect")
+OTHER = "(other)"
+
+_UUID = re.compile(r"^[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}$")
+_HEX = re.compile(r"^[0-9a-fA-F]{16,}$")
+_TOKEN = re.compile(r"^[A-Za-z0-9_\-.=~]{24,}$")
+_HAS_DIGIT = re.compile(r"\d")
+
+
+def _normalize_segment(segment: str) -> str:
+    if not segment:
+        return segment
+    if segment.isdigit():
+        return "{n}"
+    if _UUID.match(segment):
+        return "{uuid}"
+    if _HEX.match(segment):
+        return "{hex}"
+    if _TOKEN.match(segment) and _HAS_DIGIT.search(segment):
+        return "{token}"
+    return segment
+
+
+def normalize_path(path: str) -> str:
+    """把路径中的数字、UUID、长十六进制串和令牌替换为占位符，去掉查询串
+
+    /api/v1/users/123/sessions/9f1c...  ->  /api/v1/users/{n}/sessions/{hex}
+    """
+    path = path.split("?", 1)[0]
+    return "/".join(_normalize_segment(s) for s in path.split("/"))
+
+
+def flow_latencies(flow) -> Dict[str, Optional[int]]:
+    """flow 各阶段耗时（微秒），未发生的阶段为 None
+
+    只统计真正访问了上游的 flow：本地生成响应（如被拦截）时 total 为 None。
+    连接被复用时 connect 为 None。
+    """
+    request = flow.request
+    response = flow.response
+    server = flow.server_conn
+    start = request.timestamp_start
+    result: Dict[str, Optional[int]] = dict.fromkeys(METRICS)
+    if response is None or server is None or server.timestamp_start is None:
+        return result
+    if response.timestamp_end is not None:
+        result["total"] = int((response.timestamp_end - start) * 1e6)
+    if response.timestamp_start is not None:
+        result["ttfb"] = int((response.timestamp_start - start) * 1e6)
+    connected = server.timestamp_tls_setup or server.timestamp_tcp_setup
+    if connected is not None and server.timestamp_start >= start:
+        result["connect"] = int((connected - server.timestamp_start) * 1e6)
+    return result
+
+
+class LatencyGroup:
+    """一组键共用的三个直方图"""
+
+    __slots__ = ("histograms",)
+
+    def __init__(self):
+        self.histograms = {metric: LogHistogram() for metric in METRICS}
+
+    @property
+    def count(self) -> int:
+        return self.histograms["total"].count
+
+    def record(self, values: Dict[str, Optional[int]]):
+        for metric, value in values.items():
+            if value is not None:
+                self.histograms[metric].record(value)
+
+    def merge(self, other: "LatencyGroup"):
+        for metric in METRICS:
+            self.histograms[metric].merge(other.histograms[metric])
+
+    def summary(self) -> Dict[str, Dict]:
+        """各指标的 count/p50/p90/p99/max（毫秒）"""
+        result = {}
+        for metric, hist in self.histograms.items():
+            result[metric] = {
+                "count": hist.count,
+                "p50": hist.percentile(50) / 1000,
+                "p90": hist.percentile(90) / 1000,
+                "p99": hist.percentile(99) / 1000,
+                "max": (hist.max or 0) / 1000,
+            }
+        return result
+
+    def to_dict(self) -> Dict:
+        return {metric: hist.to_dict() for metric, hist in self.histograms.items()}
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "LatencyGroup":
+        group = cls()
+        for metric, hist in data.items():
+            if metric in group.histograms:
+                group.histograms[metric] = LogHistogram.from_dict(hist)
+        return group
+
+
+class LatencyTracker:
+    """总体、按主机和按路径模板的延迟直方图
+
+    主机和路径模板各最多跟踪 max_keys 个，之后出现的新键归入 "(other)"，
+    内存上限固定。同构的两个 LatencyTracker 可以合并。
+    """
+
+    def __init__(self, max_keys: int = 256):
+        self.max_keys = max_keys
+        self.overall = LatencyGroup()
+        self.hosts: Dict[str, LatencyGroup] = {}
+        self.paths: Dict[str, LatencyGroup] = {}
+        self._templates = LRUCache(4096)
+
+    def _group(self, table: Dict[str, LatencyGroup], key: str) -> LatencyGroup:
+        group = table.get(key)
+        if group is None:
+            if len(table) >= self.max_keys:
+                key = OTHER
+                group = table.get(key)
+            if group is None:
+                group = table[key] = LatencyGroup()
+        return group
+
+    def template(self, host: str, path: str) -> str:
+        """主机 + 归一化后的路径"""
+        key = (host, path)
+        template = self._templates.get(key)
+        if template is None:
+            template = host + normalize_path(path)
+            self._templates.put(key, template)
+        return template
+
+    def record(self, host: str, path: str, values: Dict[str, Optional[int]]):
+        if values["total"] is None:
+            return
+        self.overall.record(values)
+        self._group(self.hosts, host).record(values)
+        self._group(self.paths, self.template(host, path)).record(values)
+
+    def record_flow(self, flow):
+        """记录一个已完成的 flow"""
+        self.record(flow.request.pretty_host, flow.request.path, flow_latencies(flow))
+
+    def merge(self, other: "LatencyTracker"):
+        self.overall.merge(other.overall)
+        for mine, theirs in ((self.hosts, other.hosts), (self.paths, other.paths)):
+            for key, group in theirs.items():
+                self._group(mine, key).merge(group)
+
+    def clear(self):
+        self.overall = LatencyGroup()
+        self.hosts = {}
+        self.paths = {}
+
+    @staticmethod
+    def _top(table: Dict[str, LatencyGroup], top: int) -> Dict[str, Dict]:
+        keys = sorted(table, key=lambda k: table[k].count, reverse=True)[:top]
+        return {key: table[key].summary() for key in keys}
+
+    def stats(self, top: int = 20) -> Dict:
+        """总体和请求数最多的 top 个主机、路径模板的延迟摘要（毫秒）"""
+        return {
+            "overall": self.overall.summary(),
+            "hosts": self._top(self.hosts, top),
+            "paths": self._top(self.paths, top),
+        }
+
+    def to_dict(self) -> Dict:
+        """序列化全部直方图，可用 from_dict() 恢复后合并"""
+        return {
+            "max_keys": self.max_keys,
+            "overall": self.overall.to_dict(),
+            "hosts": {key: group.to_dict() for key, group in self.hosts.items()},
+            "paths": {key: group.to_dict() for key, group in self.paths.items()},
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "LatencyTracker":
+        tracker = cls(data.get("max_keys", 256))
+        tracker.overall = LatencyGroup.from_dict(data.get("overall", {}))
+        tracker.hosts = {key: LatencyGroup.from_dict(g) for key, g in data.get("hosts", {}).items()}
+        tracker.paths = {key: LatencyGroup.from_dict(g) for key, g in data.get("paths", {}).items()}
+        return tracker
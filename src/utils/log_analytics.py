@@ -0,0 +1,289 @@
+"""请求日志离线统计
+
+把日志文件切成工作单元（未压缩的 JSON Lines 按字节范围切分，压缩和
+二进制分段整个文件一个单元），交给进程池流式解析；每个单元产出一个
+可合并的部分统计（计数器、LogHistogram、SpaceSaving），主进程按完成
+顺序逐个合并。各部分的大小只与直方图桶数和 Top-K 容量有关，内存占用
+不随输入增长。
+
+    python -m src.utils.log_analytics logs/ --workers 8 --output report.json
+
+报告的结构与 StatsHandler.get_stats() 一致，另外带有字节数、延迟分布
+和 Top-K 的误差上界。
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from collections import defaultdict
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from pathlib import Path
+from typing import Dict, Iterator, List, NamedTuple, Optional
+from urllib.parse import urlsplit
+from .histogram import LogHistogram
+from .log_format import read_records
+from .log_index import find_segments, record_time
+from .topk import SpaceSaving
+
+# 未压缩 JSON Lines 按此大小切分字节范围
+CHUNK_BYTES = 32 * 1024 * 1024
+TOP_CAPACITY = 1000
+# URL 解析缓存的上限，超过后清空，保证内存不随输入增长
+URL_CACHE_SIZE = 50000
+
+
+class WorkUnit(NamedTuple):
+    """一个文件中的一段；end 为 None 表示整个文件"""
+    path: str
+    start: int = 0
+    end: Optional[int] = None
+
+
+def plan_units(paths: List[Path], chunk_bytes: int = CHUNK_BYTES) -> List[WorkUnit]:
+    """把文件切分为工作单元"""
+    units = []
+    for path in paths:
+        if path.suffix != ".jsonl":
+            units.append(WorkUnit(str(path)))
+            continue
+        size = path.stat().st_size
+        for start in range(0, max(size, 1), chunk_bytes):
+            units.append(WorkUnit(str(path), start, min(start + chunk_bytes, size)))
+    return units
+
+
+def _read_range(unit: WorkUnit) -> Iterator[Dict]:
+    """读取起始字节落在 [start, end) 内的行"""
+    with open(unit.path, "rb") as f:
+        if unit.start:
+            # 从前一个字节开始对齐到行首，恰好在行首时不会丢行
+            f.seek(unit.start - 1)
+            f.readline()
+        while f.tell() < unit.end:
+            line = f.readline()
+            if not line:
+                break
+            if line.strip():
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    # 写入中断留下的半行
+                    continue
+
+
+def _records(unit: WorkUnit) -> Iterator[Dict]:
+    if unit.end is None:
+        return read_records(unit.path)
+    return _read_range(unit)
+
+
+class Aggregate:
+    """可合并的部分统计"""
+
+    def __init__(self, top_capacity: int = TOP_CAPACITY):
+        self.total_requests = 0
+        self.total_responses = 0
+        self.blocked_requests = 0
+        self.errors = 0
+        self.records = 0
+        self.methods: Dict[str, int] = defaultdict(int)
+        self.status_codes: Dict[int, int] = defaultdict(int)
+        self.hosts = SpaceSaving(top_capacity)
+        self.paths = SpaceSaving(top_capacity)
+        self.latency_us = LogHistogram()
+        self.request_bytes = LogHistogram()
+        self.response_bytes = LogHistogram()
+        self.first_seen: Optional[float] = None
+        self.last_seen: Optional[float] = None
+        self._urls: Dict[str, tuple] = {}
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_urls"] = {}
+        return state
+
+    def _split(self, url: str) -> tuple:
+        """(主机, 主机+路径)，日志中的 URL 大量重复，缓存解析结果"""
+        parts = self._urls.get(url)
+        if parts is None:
+            if len(self._urls) >= URL_CACHE_SIZE:
+                self._urls.clear()
+            split = urlsplit(url)
+            host = split.hostname or ""
+            parts = self._urls[url] = (host, host + split.path)
+        return parts
+
+    def add(self, record: Dict):
+        """统计一条记录；flow 记录同时计入请求和响应，采样记录按采样率加权"""
+        self.records += 1
+        kind = record.get("type", "flow")
+        weight = int(round(1 / record["sample_rate"])) if record.get("sample_rate") else 1
+        status = record.get("status_code")
+
+        if kind in ("flow", "request"):
+            self.total_requests += weight
+            self.methods[record.get("method", "")] += weight
+            host, path = self._split(record.get("url", ""))
+            self.hosts.add(host, weight)
+            self.paths.add(path, weight)
+            if "action" in record:
+                if record["action"] == "block":
+                    self.blocked_requests += weight
+            elif status == 403:
+                self.blocked_requests += weight
+            size = record.get("request_bytes")
+            if size is not None:
+                self.request_bytes.record(size, weight)
+            ts = record_time(record)
+            if ts:
+                if self.first_seen is None or ts < self.first_seen:
+                    self.first_seen = ts
+                if self.last_seen is None or ts > self.last_seen:
+                    self.last_seen = ts
+
+        if status is not None and kind in ("flow", "response"):
+            self.total_responses += weight
+            self.status_codes[status] += weight
+            size = record.get("response_bytes")
+            if size is not None:
+                self.response_bytes.record(size, weight)
+        if record.get("error"):
+            self.errors += weight
+
+        duration = (record.get("timing") or {}).get("duration_ms")
+        if duration is not None:
+            self.latency_us.record(int(duration * 1000), weight)
+
+    def merge(self, other: "Aggregate"):
+        self.total_requests += other.total_requests
+        self.total_responses += other.total_responses
+        self.blocked_requests += other.blocked_requests
+        self.errors += other.errors
+        self.records += other.records
+        for key, n in other.methods.items():
+            self.methods[key] += n
+        for key, n in other.status_codes.items():
+            self.status_codes[key] += n
+        self.hosts.merge(other.hosts)
+        self.paths.merge(other.paths)
+        self.latency_us.merge(other.latency_us)
+        self.request_bytes.merge(other.request_bytes)
+        self.response_bytes.merge(other.response_bytes)
+        for ts in (other.first_seen, other.last_seen):
+            if ts is None:
+                continue
+            if self.first_seen is None or ts < self.first_seen:
+                self.first_seen = ts
+            if self.last_seen is None or ts > self.last_seen:
+                self.last_seen = ts
+
+    def report(self, top: int = 20) -> Dict:
+        """与 StatsHandler.get_stats() 同构的报告"""
+        span = (self.last_seen - self.first_seen) if self.first_seen is not None else 0.0
+        latency = self.latency_us.summary()
+        for key in ("min", "max", "mean", "p50", "p90", "p99"):
+            latency[key] = latency[key] / 1000
+        return {
+            "total_requests": self.total_requests,
+            "total_responses": self.total_responses,
+            "blocked_requests": self.blocked_requests,
+            "methods": dict(self.methods),
+            "status_codes": dict(sorted(self.status_codes.items())),
+            "hosts": {host: count for host, count, _ in self.hosts.top(top)},
+            "uptime_seconds": span,
+            "requests_per_second": self.total_requests / span if span > 0 else 0,
+            "errors": self.errors,
+            "records": self.records,
+            "first_seen": self.first_seen,
+            "last_seen": self.last_seen,
+            "latency_ms": latency,
+            "bytes": {
+                "request": {"total": self.request_bytes.total, **self.request_bytes.summary()},
+                "response": {"total": self.response_bytes.total, **self.response_bytes.summary()},
+            },
+            "top_hosts": [
+                {"host": host, "count": count, "error": error} for host, count, error in self.hosts.top(top)
+            ],
+            "top_paths": [
+                {"path": path, "count": count, "error": error} for path, count, error in self.paths.top(top)
+            ],
+        }
+
+
+def analyze_unit(unit: WorkUnit, top_capacity: int = TOP_CAPACITY) -> Aggregate:
+    """在工作进程中统计一个单元"""
+    aggregate = Aggregate(top_capacity)
+    for record in _records(unit):
+        aggregate.add(record)
+    return aggregate
+
+
+def collect_files(inputs: List[str]) -> List[Path]:
+    """展开目录为其中的请求日志分段"""
+    files = []
+    for item in map(Path, inputs):
+        files.extend(find_segments(item) if item.is_dir() else [item])
+    return files
+
+
+def analyze(
+    files: List[Path],
+    workers: Optional[int] = None,
+    chunk_bytes: int = CHUNK_BYTES,
+    top_capacity: int = TOP_CAPACITY,
+) -> Aggregate:
+    """并行统计多个文件，workers 为 1 时在当前进程中进行"""
+    units = plan_units(files, chunk_bytes)
+    result = Aggregate(top_capacity)
+    if workers == 1 or len(units) <= 1:
+        for unit in units:
+            result.merge(analyze_unit(unit, top_capacity))
+        return result
+    workers = workers or os.cpu_count() or 1
+    # 最多保留 2×workers 个未合并的单元，部分结果合并后即释放，
+    # 内存不随单元数增长
+    window = 2 * workers
+    pending = set()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for unit in units:
+            if len(pending) >= window:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    result.merge(future.result())
+            pending.add(pool.submit(analyze_unit, unit, top_capacity))
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                result.merge(future.result())
+    return result
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="请求日志离线统计")
+    parser.add_argument("inputs", nargs="*", default=["logs"], help="日志目录或文件（.jsonl / .wglog，可带 .gz）")
+    parser.add_argument("--workers", "-j", type=int, default=os.cpu_count(), help="工作进程数")
+    parser.add_argument("--chunk-mb", type=int, default=CHUNK_BYTES >> 20, help="JSON Lines 切分大小（MB）")
+    parser.add_argument("--top", type=int, default=20, help="报告中的 Top-K 条数")
+    parser.add_argument("--capacity", type=int, default=TOP_CAPACITY, help="Top-K 跟踪容量")
+    parser.add_argument("--output", "-o", help="报告文件，默认标准输出")
+    args = parser.parse_args(argv)
+
+    files = collect_files(args.inputs)
+    if not files:
+        parser.error("no request logs found")
+    started = time.perf_counter()
+    result = analyze(files, args.workers, args.chunk_mb << 20, args.capacity)
+    report = result.report(args.top)
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        Path(args.output).write_text(text + "\n", encoding="utf-8")
+    else:
+        print(text)
+    elapsed = time.perf_counter() - started
+    print(f"{result.records} records from {len(files)} files in {elapsed:.2f}s", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,386 @@
+"""请求日志的编码格式
+
+jsonl：每条记录一行 JSON。
+
+binary：紧凑的二进制格式。文件以 MAGIC 开头，之后是一系列帧，每帧为
+"varint 长度 + 类型字节 + 内容"：
+
+- DEFINE：向本分段的字符串字典追加若干字符串，编号依次递增
+- RECORD：一条记录，值按类型标签编码
+- RESET：清空字符串字典（用于在已有文件后追加写入）
+
+字典的键、请求头名称和值等重复出现的字符串只在第一次出现时写入字典，
+之后以编号引用；时间戳等每条都不同的字段直接写字面量。
+
+把二进制日志转换为 JSON Lines：
+
+    python -m src.utils.log_format logs/requests_20240101_000000.wglog > out.jsonl
+"""
+
+import argparse
+import gzip
+import io
+import json
+import logging
+import struct
+import sys
+from pathlib import Path
+from typing import Any, BinaryIO, Dict, Iterator, List, Optional
+
+logger = logging.getLogger(__name__)
+
+FORMAT_JSONL = "jsonl"
+FORMAT_BINARY = "binary"
+LOG_FORMATS = (FORMAT_JSONL, FORMAT_BINARY)
+
+MAGIC = b"WGLOG\x01\n"
+
+# 帧类型
+_F_DEFINE = 1
+_F_RECORD = 2
+_F_RESET = 3
+
+# 值类型标签
+_T_NONE = 0
+_T_FALSE = 1
+_T_TRUE = 2
+_T_INT = 3
+_T_FLOAT = 4
+_T_STR = 5
+_T_REF = 6
+_T_LIST = 7
+_T_DICT = 8
+
+# 单个分段字典的最大条目数，满了之后新字符串直接写字面量
+MAX_DICTIONARY = 1 << 16
+# 超过此长度的字符串不进字典
+MAX_INTERNED_LENGTH = 512
+# 每条记录都不同的字段，值不进字典
+LITERAL_FIELDS = frozenset({"timestamp", "flow_id", "content_length"})
+
+_FLOAT = struct.Struct("<d")
+
+
+class LogFormatError(ValueError):
+    """二进制日志内容损坏"""
+
+
+def _varint(value: int) -> bytes:
+    out = bytearray()
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+def _read_varint(data: bytes, pos: int):
+    result = shift = 0
+    while True:
+        if pos >= len(data):
+            raise LogFormatError("truncated varint")
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return result, pos
+        shift += 7
+
+
+class JsonLinesEncoder:
+    """每条记录一行 JSON"""
+
+    suffix = ".jsonl"
+
+    def begin(self, fresh: bool) -> bytes:
+        return b""
+
+    def encode(self, record: Dict) -> bytes:
+        return (json.dumps(record, ensure_ascii=False, default=str) + "\n").encode("utf-8")
+
+
+class BinaryLogEncoder:
+    """字典编码的二进制格式，见模块说明
+
+    encode() 返回的字节包含本条记录用到的新字典条目（DEFINE 帧）和记录
+    本身（RECORD 帧），必须按顺序写入同一个分段。编码失败时回滚本条记录
+    新增的字典条目。
+    """
+
+    suffix = ".wglog"
+
+    def __init__(self, max_dictionary: int = MAX_DICTIONARY):
+        self.max_dictionary = max_dictionary
+        # 字符串 -> 编码好的引用（标签 + 编号）
+        self._refs: Dict[str, bytes] = {}
+        # (键, 值) -> 编码好的键值对，请求头大多整对重复出现
+        self._pairs: Dict[tuple, bytes] = {}
+        self._new: List[str] = []
+
+    def begin(self, fresh: bool) -> bytes:
+        """开始写一个分段：新文件写文件头，追加写入时写 RESET 帧"""
+        self._refs.clear()
+        self._pairs.clear()
+        if fresh:
+            return MAGIC
+        return b"\x01" + bytes((_F_RESET,))
+
+    def encode(self, record: Dict) -> bytes:
+        self._new.clear()
+        body = bytearray((_F_RECORD,))
+        try:
+            self._value(body, record, True)
+        except Exception:
+            for s in self._new:
+                del self._refs[s]
+            self._pairs.clear()
+            raise
+        out = bytearray()
+        if self._new:
+            define = bytearray((_F_DEFINE,))
+            define += _varint(len(self._new))
+            for s in self._new:
+                raw = s.encode("utf-8")
+                define += _varint(len(raw))
+                define += raw
+            out += _varint(len(define))
+            out += define
+        out += _varint(len(body))
+        out += body
+        return bytes(out)
+
+    def _string(self, out: bytearray, value: str, intern: bool):
+        ref = self._refs.get(value)
+        if ref is not None:
+            out += ref
+            return
+        if intern and len(value) <= MAX_INTERNED_LENGTH and len(self._refs) < self.max_dictionary:
+            ref = bytes((_T_REF,)) + _varint(len(self._refs))
+            self._refs[value] = ref
+            self._new.append(value)
+            out += ref
+            return
+        raw = value.encode("utf-8")
+        out.append(_T_STR)
+        out += _varint(len(raw))
+        out += raw
+
+    def _value(self, out: bytearray, value: Any, intern: bool):
+        if isinstance(value, str):
+            self._string(out, value, intern)
+        elif isinstance(value, dict):
+            out.append(_T_DICT)
+            out += _varint(len(value))
+            pairs = self._pairs
+            for key, item in value.items():
+                if type(item) is str:
+                    pair = pairs.get((key, item))
+                    if pair is not None:
+                        out += pair
+                        continue
+                if not isinstance(key, str):
+                    key = str(key)
+                start = len(out)
+                self._string(out, key, True)
+                self._value(out, item, key not in LITERAL_FIELDS)
+                if (
+                    type(item) is str
+                    and item in self._refs
+                    and key in self._refs
+                    and len(pairs) < self.max_dictionary
+                ):
+                    pairs[(key, item)] = bytes(out[start:])
+        elif value is None:
+            out.append(_T_NONE)
+        elif value is True:
+            out.append(_T_TRUE)
+        elif value is False:
+            out.append(_T_FALSE)
+        elif isinstance(value, int):
+            out.append(_T_INT)
+            # zigzag，负数也用短编码
+            out += _varint(value * 2 if value >= 0 else -value * 2 - 1)
+        elif isinstance(value, float):
+            out.append(_T_FLOAT)
+            out += _FLOAT.pack(value)
+        elif isinstance(value, (list, tuple)):
+            out.append(_T_LIST)
+            out += _varint(len(value))
+            for item in value:
+                self._value(out, item, intern)
+        else:
+            # 与 JSON 编码的 default=str 一致
+            self._string(out, str(value), False)
+
+
+def defines_strings(chunk: bytes) -> bool:
+    """encode() 返回的字节是否以 DEFINE 帧开头（即新增了字典条目）"""
+    try:
+        _, pos = _read_varint(chunk, 0)
+    except LogFormatError:
+        return False
+    return pos < len(chunk) and chunk[pos] == _F_DEFINE
+
+
+def create_encoder(fmt: str):
+    """按格式名创建编码器"""
+    if fmt == FORMAT_JSONL:
+        return JsonLinesEncoder()
+    if fmt == FORMAT_BINARY:
+        return BinaryLogEncoder()
+    raise ValueError(f"Unknown log format: {fmt}")
+
+
+class BinaryLogReader:
+    """逐条读取二进制日志，支持 .gz 压缩的分段和多个分段首尾拼接
+
+    末尾不完整的帧（写入时进程退出）会被忽略并记录警告。
+    """
+
+    def __init__(self, stream: Optional[BinaryIO] = None):
+        self.stream = stream
+        self.strings: List[str] = []
+        self.truncated = False
+
+    @classmethod
+    def open(cls, path) -> "BinaryLogReader":
+        path = Path(path)
+        opener = gzip.open if path.suffix == ".gz" else open
+        return cls(opener(path, "rb"))
+
+    def close(self):
+        if self.stream is not None:
+            self.stream.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __iter__(self) -> Iterator[Dict]:
+        data = self.stream.read()
+        if not data.startswith(MAGIC):
+            raise LogFormatError("not a binary request log")
+        yield from self.feed(data, len(MAGIC))
+
+    def feed(self, data, pos: int = 0, end: Optional[int] = None, definitions: bool = True) -> Iterator[Dict]:
+        """解码 data[pos:end] 中的帧，DEFINE 帧更新字典，返回其中的记录
+
+        data 可以是 bytes 或 mmap；按索引随机读取时，先用本方法处理含
+        DEFINE 帧的片段建立字典，再以 definitions=False 解码目标记录。
+        """
+        if end is None:
+            end = len(data)
+        magic = len(MAGIC)
+        while pos < end:
+            if data[pos:pos + magic] == MAGIC:
+                # 拼接的下一个分段
+                self.strings = []
+                pos += magic
+                continue
+            try:
+                length, start = _read_varint(data, pos)
+            except LogFormatError:
+                length, start = 1, end
+            frame_end = start + length
+            if frame_end > end or length == 0:
+                self.truncated = True
+                logger.warning(f"⚠️ Truncated record at offset {pos}, ignoring the rest")
+                return
+            pos = frame_end
+            kind = data[start]
+            if kind == _F_RECORD:
+                value, _ = self._value(data, start + 1)
+                yield value
+            elif kind == _F_DEFINE and definitions:
+                count, p = _read_varint(data, start + 1)
+                for _ in range(count):
+                    n, p = _read_varint(data, p)
+                    self.strings.append(data[p:p + n].decode("utf-8"))
+                    p += n
+            elif kind == _F_RESET:
+                self.strings = []
+            elif kind != _F_DEFINE:
+                raise LogFormatError(f"unknown frame type {kind} at offset {start}")
+
+    def _value(self, data: bytes, pos: int):
+        tag = data[pos]
+        pos += 1
+        if tag == _T_REF:
+            index, pos = _read_varint(data, pos)
+            try:
+                return self.strings[index], pos
+            except IndexError:
+                raise LogFormatError(f"undefined string #{index} at offset {pos}")
+        if tag == _T_STR:
+            n, pos = _read_varint(data, pos)
+            return data[pos:pos + n].decode("utf-8"), pos + n
+        if tag == _T_DICT:
+            n, pos = _read_varint(data, pos)
+            result = {}
+            for _ in range(n):
+                key, pos = self._value(data, pos)
+                result[key], pos = self._value(data, pos)
+            return result, pos
+        if tag == _T_INT:
+            n, pos = _read_varint(data, pos)
+            return (n >> 1) ^ -(n & 1), pos
+        if tag == _T_NONE:
+            return None, pos
+        if tag == _T_TRUE:
+            return True, pos
+        if tag == _T_FALSE:
+            return False, pos
+        if tag == _T_FLOAT:
+            return _FLOAT.unpack_from(data, pos)[0], pos + 8
+        if tag == _T_LIST:
+            n, pos = _read_varint(data, pos)
+            items = []
+            for _ in range(n):
+                item, pos = self._value(data, pos)
+                items.append(item)
+            return items, pos
+        raise LogFormatError(f"unknown value tag {tag} at offset {pos - 1}")
+
+
+def read_records(path) -> Iterator[Dict]:
+    """按文件名读取任一格式的请求日志（含 .gz）"""
+    path = Path(path)
+    name = path.name[:-3] if path.suffix == ".gz" else path.name
+    if name.endswith(BinaryLogEncoder.suffix):
+        with BinaryLogReader.open(path) as reader:
+            yield from reader
+        return
+    opener = gzip.open if path.suffix == ".gz" else open
+    with opener(path, "rt", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="把请求日志转换为 JSON Lines")
+    parser.add_argument("files", nargs="+", help="日志文件（.wglog / .jsonl，可带 .gz）")
+    parser.add_argument("--output", "-o", help="输出文件，默认标准输出")
+    args = parser.parse_args(argv)
+
+    out = open(args.output, "w", encoding="utf-8") if args.output else io.TextIOWrapper(
+        sys.stdout.buffer, encoding="utf-8", newline="\n"
+    )
+    count = 0
+    try:
+        for path in args.files:
+            for record in read_records(path):
+                out.write(json.dumps(record, ensure_ascii=False))
+                out.write("\n")
+                count += 1
+    finally:
+        out.flush()
+        if args.output:
+            out.close()
+    print(f"{count} records", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,555 @@
+"""请求日志分段的旁路索引与查询
+
+每个日志分段 requests_<时间>.jsonl / .wglog 旁边写一个同名的 .idx 索引：
+
+- 每条记录在分段中的字节偏移、长度和请求开始时间
+- 按分钟划分的时间桶 -> 记录序号范围
+- 主机、状态码、请求方法 -> 记录序号列表（倒排表）
+
+索引由写日志的线程定期写出（原子替换），覆盖到分段中的某个字节位置；
+之后追加的记录和没有索引的分段在查询时顺序扫描。分段被压缩为 .gz 后
+索引仍然有效，只有可能包含匹配记录的分段才会被解压。
+
+查询：
+
+    python -m src.utils.log_index query --since "2024-01-01 14:00" --until "2024-01-01 14:05" \\
+        --host api.warp.dev --status 200
+
+为已有分段重建索引：
+
+    python -m src.utils.log_index build logs/
+"""
+
+import argparse
+import gzip
+import json
+import logging
+import mmap
+import os
+import struct
+import sys
+import time
+from array import array
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+from urllib.parse import urlsplit
+from .log_format import BinaryLogEncoder, BinaryLogReader, JsonLinesEncoder, MAGIC, _read_varint, defines_strings
+
+logger = logging.getLogger(__name__)
+
+INDEX_MAGIC = b"WGIDX\x01\n"
+INDEX_SUFFIX = ".idx"
+BUCKET_SECONDS = 60
+SEGMENT_SUFFIXES = (JsonLinesEncoder.suffix, BinaryLogEncoder.suffix)
+# 倒排表的字段
+FIELDS = ("host", "status", "method")
+
+_DIR_LEN = struct.Struct("<I")
+
+
+def index_path(segment: Path) -> Path:
+    """分段对应的索引文件（压缩前后相同）"""
+    segment = Path(segment)
+    name = segment.name[:-3] if segment.name.endswith(".gz") else segment.name
+    for suffix in SEGMENT_SUFFIXES:
+        if name.endswith(suffix):
+            name = name[: -len(suffix)]
+            break
+    return segment.with_name(name + INDEX_SUFFIX)
+
+
+def record_time(record: Dict) -> float:
+    """记录的请求开始时间（Unix 秒）"""
+    timing = record.get("timing")
+    if timing and "request_start" in timing:
+        return timing["request_start"]
+    try:
+        return datetime.fromisoformat(record["timestamp"]).timestamp()
+    except (KeyError, TypeError, ValueError):
+        return 0.0
+
+
+def record_keys(record: Dict) -> Tuple[str, str, str]:
+    """记录在倒排表中的 (主机, 状态码, 方法)"""
+    host = urlsplit(record.get("url", "")).hostname or ""
+    status = record.get("status_code")
+    return host, str(status) if status is not None else "-", record.get("method", "")
+
+
+class SegmentIndexer:
+    """在写线程中为当前分段累积索引
+
+    AsyncLogWriter 每写一条记录调用 add()，刷盘后调用 maybe_checkpoint()，
+    分段关闭时调用 finish()。
+    """
+
+    def __init__(self, binary: bool = False, checkpoint_interval: float = 30.0, bucket_seconds: int = BUCKET_SECONDS):
+        self.binary = binary
+        self.checkpoint_interval = checkpoint_interval
+        self.bucket_seconds = bucket_seconds
+        self.checkpoints = 0
+        self.reset()
+
+    def reset(self):
+        """开始新分段"""
+        self.offsets = array("Q")
+        self.lengths = array("I")
+        self.times = array("d")
+        self.defines = array("I")
+        self.postings: Dict[str, Dict[str, array]] = {field: {} for field in FIELDS}
+        self.buckets: Dict[int, List[int]] = {}
+        self.end = 0
+        self._dirty = False
+        self._last_checkpoint = time.monotonic()
+
+    def add(self, record: Dict, offset: int, chunk: bytes):
+        """登记一条已写入（尚未刷盘）的记录"""
+        i = len(self.offsets)
+        ts = record_time(record)
+        self.offsets.append(offset)
+        self.lengths.append(len(chunk))
+        self.times.append(ts)
+        if self.binary and defines_strings(chunk):
+            self.defines.append(i)
+        for field, key in zip(FIELDS, record_keys(record)):
+            posting = self.postings[field].get(key)
+            if posting is None:
+                posting = self.postings[field][key] = array("I")
+            posting.append(i)
+        bucket = int(ts // self.bucket_seconds)
+        span = self.buckets.get(bucket)
+        if span is None:
+            self.buckets[bucket] = [i, i + 1]
+        else:
+            span[1] = i + 1
+        self.end = offset + len(chunk)
+        self._dirty = True
+
+    def maybe_checkpoint(self, segment: Path):
+        """距上次写出超过 checkpoint_interval 时写出索引，调用前数据须已刷盘"""
+        if self._dirty and time.monotonic() - self._last_checkpoint >= self.checkpoint_interval:
+            self.write(segment)
+
+    def finish(self, segment: Path):
+        """分段已关闭：写出最终索引并重置"""
+        if self._dirty:
+            self.write(segment)
+        self.reset()
+
+    def write(self, segment: Path):
+        """原子写出 segment 的索引文件"""
+        self._last_checkpoint = time.monotonic()
+        self._dirty = False
+        blobs = []
+        position = 0
+
+        def place(values: array) -> List[int]:
+            nonlocal position
+            data = values.tobytes()
+            # 按 8 字节对齐，便于直接 cast
+            data += b"\0" * (-len(data) % 8)
+            blobs.append(data)
+            start = position
+            position += len(data)
+            return [start, len(values)]
+
+        directory = {
+            "segment": Path(segment).name,
+            "end": self.end,
+            "count": len(self.offsets),
+            "t_min": min(self.times) if self.times else 0.0,
+            "t_max": max(self.times) if self.times else 0.0,
+            "bucket_seconds": self.bucket_seconds,
+            "buckets": {str(b): span for b, span in self.buckets.items()},
+            "offsets": place(self.offsets),
+            "lengths": place(self.lengths),
+            "times": place(self.times),
+            "defines": place(self.defines),
+            "postings": {
+                field: {key: place(values) for key, values in table.items()}
+                for field, table in self.postings.items()
+            },
+        }
+        head = json.dumps(directory, separators=(",", ":")).encode("utf-8")
+        head += b" " * (-(len(INDEX_MAGIC) + _DIR_LEN.size + len(head)) % 8)
+        path = index_path(segment)
+        tmp = path.with_name(path.name + ".tmp")
+        try:
+            with open(tmp, "wb") as f:
+                f.write(INDEX_MAGIC)
+                f.write(_DIR_LEN.pack(len(head)))
+                f.write(head)
+                for blob in blobs:
+                    f.write(blob)
+            os.replace(tmp, path)
+            self.checkpoints += 1
+        except OSError as e:
+            logger.error(f"❌ Failed to write log index {path}: {e}")
+
+
+class SegmentIndex:
+    """只读打开的索引文件（mmap）"""
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        with open(self.path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._map[: len(INDEX_MAGIC)] != INDEX_MAGIC:
+            self._map.close()
+            raise ValueError(f"{self.path}: not a log index")
+        start = len(INDEX_MAGIC) + _DIR_LEN.size
+        (length,) = _DIR_LEN.unpack_from(self._map, len(INDEX_MAGIC))
+        self.directory = json.loads(self._map[start:start + length])
+        self._base = start + length
+        self._view = memoryview(self._map)
+        self.offsets = self._array(self.directory["offsets"], "Q")
+        self.lengths = self._array(self.directory["lengths"], "I")
+        self.times = self._array(self.directory["times"], "d")
+        self.defines = self._array(self.directory["defines"], "I")
+
+    def _array(self, place: List[int], code: str) -> memoryview:
+        start, count = place
+        size = struct.calcsize(code)
+        begin = self._base + start
+        return self._view[begin:begin + count * size].cast(code)
+
+    @property
+    def end(self) -> int:
+        return self.directory["end"]
+
+    def overlaps(self, since: Optional[float], until: Optional[float]) -> bool:
+        d = self.directory
+        if not d["count"]:
+            return False
+        return (since is None or d["t_max"] >= since) and (until is None or d["t_min"] < until)
+
+    def posting(self, field: str, keys: Iterable[str]) -> Set[int]:
+        """若干键的倒排表并集"""
+        table = self.directory["postings"][field]
+        result: Set[int] = set()
+        for key in keys:
+            place = table.get(key)
+            if place is not None:
+                result.update(self._array(place, "I"))
+        return result
+
+    def keys(self, field: str) -> List[str]:
+        return list(self.directory["postings"][field])
+
+    def candidates(self, since: Optional[float], until: Optional[float]) -> Iterator[int]:
+        """按时间桶给出可能落在时间范围内的记录序号（升序）"""
+        count = self.directory["count"]
+        if since is None and until is None:
+            yield from range(count)
+            return
+        width = self.directory["bucket_seconds"]
+        lo = int(since // width) if since is not None else None
+        hi = int(until // width) if until is not None else None
+        spans = sorted(
+            span
+            for bucket, span in ((int(b), s) for b, s in self.directory["buckets"].items())
+            if (lo is None or bucket >= lo) and (hi is None or bucket <= hi)
+        )
+        last = 0
+        for start, stop in spans:
+            for i in range(max(start, last), stop):
+                yield i
+            last = max(last, stop)
+
+    def close(self):
+        self._view.release()
+        for name in ("offsets", "lengths", "times", "defines"):
+            getattr(self, name).release()
+        self._map.close()
+
+
+class LogQuery:
+    """查询条件，各项为空表示不限"""
+
+    def __init__(
+        self,
+        since: Optional[float] = None,
+        until: Optional[float] = None,
+        hosts: Iterable[str] = (),
+        statuses: Iterable[str] = (),
+        methods: Iterable[str] = (),
+    ):
+        self.since = since
+        self.until = until
+        self.hosts = [h.lower() for h in hosts]
+        self.statuses = [str(s) for s in statuses]
+        self.methods = [m.upper() for m in methods]
+
+    def _host_keys(self, keys: Iterable[str]) -> List[str]:
+        """展开 *.example.com 形式的主机条件
+
+        与 host: 规则（HostTrie）含义相同：只匹配子域名，不含 example.com 本身。
+        """
+        result = []
+        for host in self.hosts:
+            if host.startswith("*."):
+                suffix = host[1:]
+                result.extend(k for k in keys if k.endswith(suffix))
+            else:
+                result.append(host)
+        return result
+
+    def match_time(self, ts: float) -> bool:
+        return (self.since is None or ts >= self.since) and (self.until is None or ts < self.until)
+
+    def match(self, record: Dict) -> bool:
+        """顺序扫描时判断一条记录"""
+        if not self.match_time(record_time(record)):
+            return False
+        host, status, method = record_keys(record)
+        if self.hosts and host not in self._host_keys([host]):
+            return False
+        if self.statuses and status not in self.statuses:
+            return False
+        if self.methods and method not in self.methods:
+            return False
+        return True
+
+    def ordinals(self, index: SegmentIndex) -> List[int]:
+        """用索引找出匹配的记录序号"""
+        if not index.overlaps(self.since, self.until):
+            return []
+        selected: Optional[Set[int]] = None
+        for field, keys in (
+            ("host", self._host_keys(index.keys("host")) if self.hosts else None),
+            ("status", self.statuses or None),
+            ("method", self.methods or None),
+        ):
+            if keys is None:
+                continue
+            posting = index.posting(field, keys)
+            selected = posting if selected is None else selected & posting
+            if not selected:
+                return []
+        times = index.times
+        if selected is None:
+            return [i for i in index.candidates(self.since, self.until) if self.match_time(times[i])]
+        return sorted(i for i in selected if self.match_time(times[i]))
+
+
+def _segment_data(segment: Path):
+    """分段内容：未压缩的用 mmap，.gz 整体解压"""
+    if segment.suffix == ".gz":
+        with gzip.open(segment, "rb") as f:
+            return f.read(), None
+    with open(segment, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return b"", None
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    return data, data
+
+
+def _scan(data, start: int, binary: bool, reader: Optional[BinaryLogReader]) -> Iterator[Dict]:
+    """顺序解码 data[start:] 中的记录"""
+    if binary:
+        if start < len(MAGIC):
+            start = len(MAGIC)
+        yield from reader.feed(data, start)
+        return
+    end = len(data)
+    pos = start
+    while pos < end:
+        newline = data.find(b"\n", pos)
+        if newline < 0:
+            break  # 末尾不完整的行
+        line = data[pos:newline]
+        pos = newline + 1
+        if line.strip():
+            try:
+                yield json.loads(line)
+            except ValueError:
+                logger.warning(f"⚠️ Skipping malformed log line at offset {pos}")
+
+
+def query_segment(segment: Path, query: LogQuery) -> Iterator[Dict]:
+    """查询一个分段：有索引的部分按偏移直接读取，之后的部分顺序扫描"""
+    segment = Path(segment)
+    binary = BinaryLogEncoder.suffix in segment.name
+    index = None
+    ipath = index_path(segment)
+    if ipath.exists():
+        try:
+            index = SegmentIndex(ipath)
+        except (OSError, ValueError) as e:
+            logger.warning(f"⚠️ Ignoring log index {ipath}: {e}")
+
+    try:
+        ordinals = query.ordinals(index) if index is not None else []
+        # 索引之后是否还有数据要扫描
+        size = segment.stat().st_size
+        has_tail = index is None or (segment.suffix != ".gz" and size > index.end)
+        if not ordinals and not has_tail:
+            return
+        data, mapped = _segment_data(segment)
+        try:
+            reader = BinaryLogReader() if binary else None
+            if index is not None:
+                if binary:
+                    for i in index.defines:
+                        for _ in reader.feed(data, index.offsets[i], index.offsets[i] + index.lengths[i]):
+                            pass
+                for i in ordinals:
+                    start = index.offsets[i]
+                    chunk_end = start + index.lengths[i]
+                    if binary:
+                        # 字典已经建好，跳过片段中的 DEFINE 帧
+                        yield from reader.feed(data, start, chunk_end, definitions=False)
+                    else:
+                        yield json.loads(data[start:chunk_end])
+            if index is None or len(data) > index.end:
+                start = index.end if index is not None else 0
+                for record in _scan(data, start, binary, reader):
+                    if query.match(record):
+                        yield record
+        finally:
+            if mapped is not None:
+                mapped.close()
+    finally:
+        if index is not None:
+            index.close()
+
+
+def find_segments(directory: Path) -> List[Path]:
+    """目录中的请求日志分段，按文件名（即创建时间）排序"""
+    segments = []
+    for path in Path(directory).glob("requests_*"):
+        name = path.name[:-3] if path.name.endswith(".gz") else path.name
+        if name.endswith(SEGMENT_SUFFIXES):
+            segments.append(path)
+    return sorted(segments, key=lambda p: (p.name.split(".")[0].split("-")[0], _sequence(p)))
+
+
+def _sequence(path: Path) -> int:
+    """unique_path 追加的序号"""
+    stem = path.name.split(".")[0]
+    head, _, tail = stem.rpartition("-")
+    return int(tail) if head and tail.isdigit() else 0
+
+
+def query_logs(directory: Path, query: LogQuery) -> Iterator[Dict]:
+    """按分段顺序查询目录中的请求日志"""
+    for segment in find_segments(directory):
+        yield from query_segment(segment, query)
+
+
+def build_index(segment: Path, checkpoint_interval: float = 30.0) -> int:
+    """顺序扫描分段并写出索引，返回记录数"""
+    segment = Path(segment)
+    binary = BinaryLogEncoder.suffix in segment.name
+    indexer = SegmentIndexer(binary=binary, checkpoint_interval=checkpoint_interval)
+    data, mapped = _segment_data(segment)
+    try:
+        if binary:
+            if data[: len(MAGIC)] != MAGIC:
+                raise ValueError(f"{segment}: not a binary request log")
+            _index_binary(indexer, data)
+        else:
+            pos = 0
+            while True:
+                newline = data.find(b"\n", pos)
+                if newline < 0:
+                    break
+                line = data[pos:newline + 1]
+                if line.strip():
+                    try:
+                        indexer.add(json.loads(line), pos, line)
+                    except ValueError:
+                        pass
+                pos = newline + 1
+    finally:
+        if mapped is not None:
+            mapped.close()
+    count = len(indexer.offsets)
+    indexer.write(segment)
+    return count
+
+
+def _index_binary(indexer: SegmentIndexer, data):
+    """二进制分段：把 DEFINE 帧与其后的 RECORD 帧当作一条记录登记"""
+    reader = BinaryLogReader()
+    pos = chunk_start = len(MAGIC)
+    while pos < len(data):
+        length, start = _read_varint(data, pos)
+        frame_end = start + length
+        if frame_end > len(data) or length == 0:
+            break
+        records = list(reader.feed(data, pos, frame_end))
+        pos = frame_end
+        if records:
+            indexer.add(records[0], chunk_start, data[chunk_start:frame_end])
+            chunk_start = pos
+
+
+def _parse_time(value: Optional[str]) -> Optional[float]:
+    """Unix 秒、ISO 时间，或当天的 HH:MM[:SS]"""
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        return datetime.fromisoformat(value).timestamp()
+    except ValueError:
+        pass
+    try:
+        clock = datetime.strptime(value, "%H:%M:%S" if value.count(":") == 2 else "%H:%M").time()
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid time: {value}")
+    return datetime.combine(datetime.now().date(), clock).timestamp()
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="请求日志索引与查询")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    query_parser = sub.add_parser("query", help="查询请求日志，结果以 JSON Lines 输出")
+    query_parser.add_argument("--dir", default="logs", help="日志目录")
+    query_parser.add_argument("--since", type=_parse_time, help="开始时间（含）")
+    query_parser.add_argument("--until", type=_parse_time, help="结束时间（不含）")
+    query_parser.add_argument("--host", action="append", default=[], help="主机，可用 *.example.com（不含 example.com 本身），可重复")
+    query_parser.add_argument("--status", action="append", default=[], help="状态码，- 表示无响应，可重复")
+    query_parser.add_argument("--method", action="append", default=[], help="请求方法，可重复")
+    query_parser.add_argument("--limit", type=int, default=0, help="最多输出的记录数")
+    query_parser.add_argument("--count", action="store_true", help="只输出匹配数")
+
+    build_parser = sub.add_parser("build", help="为已有分段（重新）建立索引")
+    build_parser.add_argument("paths", nargs="+", help="日志目录或分段文件")
+
+    args = parser.parse_args(argv)
+
+    if args.command == "build":
+        for path in map(Path, args.paths):
+            segments = find_segments(path) if path.is_dir() else [path]
+            for segment in segments:
+                started = time.perf_counter()
+                count = build_index(segment)
+                elapsed = time.perf_counter() - started
+                print(f"{segment}: {count} records ({elapsed:.2f}s)", file=sys.stderr)
+        return
+
+    query = LogQuery(args.since, args.until, args.host, args.status, args.method)
+    started = time.perf_counter()
+    count = 0
+    out = sys.stdout
+    for record in query_logs(Path(args.dir), query):
+        count += 1
+        if not args.count:
+            out.write(json.dumps(record, ensure_ascii=False))
+            out.write("\n")
+        if args.limit and count >= args.limit:
+            break
+    if args.count:
+        print(count)
+    out.flush()
+    print(f"{count} records in {time.perf_counter() - started:.3f}s", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
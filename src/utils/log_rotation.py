@@ -0,0 +1,232 @@
+"""日志文件轮转、压缩与保留"""
+
+import gzip
+import logging
+import os
+import queue
+import shutil
+import threading
+import time
+from datetime import datetime
+from logging.handlers import BaseRotatingHandler
+from pathlib import Path
+from typing import Callable, Iterable, List, NamedTuple, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class RotationPolicy(NamedTuple):
+    """轮转与保留策略，各项为 0 表示不限制"""
+    max_bytes: int = 0          # 单个分段的最大字节数
+    interval: float = 0         # 按本地时间对齐的轮转间隔（秒），如 3600 为整点
+    backup_count: int = 0       # 最多保留的历史分段数
+    max_total_bytes: int = 0    # 历史分段的总字节数上限
+    compress: bool = True       # 历史分段是否 gzip 压缩
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.max_bytes or self.interval)
+
+
+def next_boundary(interval: float, now: Optional[float] = None) -> float:
+    """下一个按本地时间对齐的轮转时刻"""
+    if now is None:
+        now = time.time()
+    offset = datetime.fromtimestamp(now).astimezone().utcoffset().total_seconds()
+    return ((now + offset) // interval + 1) * interval - offset
+
+
+def unique_path(path: Path) -> Path:
+    """路径已存在（或已有压缩版本）时追加序号"""
+    candidate, n = path, 1
+    while candidate.exists() or candidate.with_name(candidate.name + ".gz").exists():
+        candidate = path.with_name(f"{path.stem}-{n}{path.suffix}")
+        n += 1
+    return candidate
+
+
+def apply_retention(
+    directory: Path,
+    pattern: str,
+    policy: RotationPolicy,
+    exclude: Iterable[Path] = (),
+    sidecar: Optional[Callable[[Path], Path]] = None,
+) -> List[Path]:
+    """按数量和总大小删除最旧的历史分段，返回被删除的文件
+
+    sidecar 给出分段的附属文件（如索引），随分段一起删除。
+    """
+    if not policy.backup_count and not policy.max_total_bytes:
+        return []
+    excluded = {Path(p).absolute() for p in exclude}
+    segments = []
+    for path in Path(directory).glob(pattern):
+        if path.suffix == ".tmp" or path.absolute() in excluded:
+            continue
+        try:
+            st = path.stat()
+        except OSError:
+            continue
+        segments.append((st.st_mtime, st.st_size, path))
+    segments.sort(reverse=True)
+
+    removed = []
+    total = 0
+    for count, (_, size, path) in enumerate(segments, 1):
+        total += size
+        if (policy.backup_count and count > policy.backup_count) or (
+            policy.max_total_bytes and total > policy.max_total_bytes
+        ):
+            try:
+                path.unlink()
+                removed.append(path)
+                if sidecar is not None:
+                    sidecar(path).unlink(missing_ok=True)
+            except OSError as e:
+                logger.warning(f"⚠️ Failed to remove old log {path}: {e}")
+    if removed:
+        logger.info(f"🧹 Removed {len(removed)} old log segments from {directory}")
+    return removed
+
+
+def compress_file(path: Path) -> Path:
+    """gzip 压缩文件并删除原文件，返回压缩后的路径"""
+    target = path.with_name(path.name + ".gz")
+    tmp = target.with_name(target.name + ".tmp")
+    with open(path, "rb") as src, gzip.open(tmp, "wb", compresslevel=6) as dst:
+        shutil.copyfileobj(src, dst, 1 << 20)
+    # 保留原文件的修改时间，保留策略按时间排序
+    st = path.stat()
+    os.utime(tmp, (st.st_atime, st.st_mtime))
+    os.replace(tmp, target)
+    path.unlink()
+    return target
+
+
+class _Job(NamedTuple):
+    path: Path
+    pattern: str
+    policy: RotationPolicy
+    exclude: Callable[[], Iterable[Path]]
+    sidecar: Optional[Callable[[Path], Path]]
+
+
+class SegmentCompressor:
+    """后台压缩线程，所有轮转器共用一个"""
+
+    _instance: Optional["SegmentCompressor"] = None
+    _instance_lock = threading.Lock()
+
+    def __init__(self):
+        self.queue: "queue.Queue[Optional[_Job]]" = queue.Queue()
+        self.compressed = 0
+        self._thread = threading.Thread(target=self._run, name="log-compressor", daemon=True)
+        self._thread.start()
+
+    @classmethod
+    def shared(cls) -> "SegmentCompressor":
+        with cls._instance_lock:
+            if cls._instance is None:
+                cls._instance = cls()
+            return cls._instance
+
+    def submit(self, job: _Job):
+        self.queue.put(job)
+
+    def join(self):
+        """等待已提交的任务完成"""
+        self.queue.join()
+
+    def _run(self):
+        while True:
+            job = self.queue.get()
+            try:
+                if job.policy.compress and job.path.exists():
+                    compress_file(job.path)
+                    self.compressed += 1
+                apply_retention(job.path.parent, job.pattern, job.policy, job.exclude(), job.sidecar)
+            except Exception as e:
+                logger.error(f"❌ Failed to compress {job.path}: {e}")
+            finally:
+                self.queue.task_done()
+
+
+class SegmentRotator:
+    """判断何时轮转，并把旧分段交给后台压缩和清理
+
+    pattern 是同一组日志所有分段的 glob（用于保留策略），active 返回
+    当前正在写入的文件，清理时跳过；sidecar 见 apply_retention。
+    """
+
+    def __init__(
+        self,
+        policy: RotationPolicy,
+        pattern: str,
+        active: Callable[[], Path],
+        sidecar: Optional[Callable[[Path], Path]] = None,
+    ):
+        self.policy = policy
+        self.pattern = pattern
+        self.active = active
+        self.sidecar = sidecar
+        self.rotations = 0
+        self._deadline = 0.0
+        self.opened()
+
+    def opened(self, now: Optional[float] = None):
+        """新分段开始写入时调用，计算下一个按时间轮转的时刻"""
+        self._deadline = next_boundary(self.policy.interval, now) if self.policy.interval else 0.0
+
+    def should_rotate(self, size: int, now: Optional[float] = None) -> bool:
+        """当前分段是否应该轮转"""
+        if self.policy.max_bytes and size >= self.policy.max_bytes:
+            return True
+        if self._deadline:
+            now = now or time.time()
+            if now >= self._deadline:
+                if size:
+                    return True
+                # 空分段不轮转，直接顺延到下一个时刻
+                self.opened(now)
+        return False
+
+    def retire(self, path: Path):
+        """已关闭的旧分段交给后台处理"""
+        self.rotations += 1
+        self.opened()
+        SegmentCompressor.shared().submit(
+            _Job(Path(path), self.pattern, self.policy, lambda: (self.active(),), self.sidecar)
+        )
+
+
+class RotatingLogFileHandler(BaseRotatingHandler):
+    """按大小和时间轮转的 logging 文件处理器
+
+    旧文件改名为 "<主名>.<时间戳>.<扩展名>"，压缩和清理在后台线程中进行，
+    不会阻塞写日志的线程。
+    """
+
+    def __init__(self, filename: str, policy: RotationPolicy, encoding: str = "utf-8"):
+        super().__init__(filename, "a", encoding=encoding, delay=False)
+        base = Path(self.baseFilename)
+        self.rotator = SegmentRotator(policy, f"{base.stem}.*{base.suffix}*", lambda: base)
+
+    def shouldRollover(self, record) -> bool:
+        if self.stream is None:
+            return False
+        return self.rotator.should_rotate(self.stream.tell())
+
+    def doRollover(self):
+        if self.stream:
+            self.stream.close()
+            self.stream = None
+        base = Path(self.baseFilename)
+        stamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        rotated = unique_path(base.with_name(f"{base.stem}.{stamp}{base.suffix}"))
+        try:
+            os.replace(base, rotated)
+        except OSError:
+            rotated = None
+        self.stream = self._open()
+        if rotated is not None:
+            self.rotator.retire(rotated)
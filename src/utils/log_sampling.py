@@ -0,0 +1,176 @@
+"""请求日志的采样与详细程度"""
+
+import logging
+import time
+import zlib
+from typing import Callable, Mapping, NamedTuple, Optional
+from .cache import LRUCache
+from .ruleset import ACTION_BLOCK, flow_verdict
+
+logger = logging.getLogger(__name__)
+
+DETAIL_FULL = "full"        # 记录请求头名称和值
+DETAIL_NAMES = "names"      # 只记录请求头名称
+DETAIL_NONE = "none"        # 不记录请求头
+DETAIL_AUTO = "auto"        # 按负载在以上三档之间切换
+DETAIL_LEVELS = (DETAIL_FULL, DETAIL_NAMES, DETAIL_NONE)
+DETAIL_MODES = DETAIL_LEVELS + (DETAIL_AUTO,)
+
+# flow.metadata 中缓存的采样结果
+SAMPLE_KEY = "warpgateway.sample"
+
+
+class SampleDecision(NamedTuple):
+    """一个 flow 的采样结果"""
+    sampled: bool
+    rate: float
+    detail: str
+
+
+FULL = SampleDecision(True, 1.0, DETAIL_FULL)
+
+
+def apply_detail(headers, detail: str):
+    """按详细程度裁剪请求头：full 原样返回字典，names 只保留名称，none 返回 None"""
+    if detail == DETAIL_FULL:
+        return dict(headers)
+    if detail == DETAIL_NAMES:
+        return list(headers.keys())
+    return None
+
+
+class LogSampler:
+    """决定每个 flow 是否写日志、写多详细
+
+    采样率按主机（含上级域名，最具体的优先）、规则（rule_id 如
+    "allow:2"，或动作名如 "allow"）和默认值依次查找。采样按 flow.id 的
+    哈希决定，同一个 flow 在各处理器中的结果一致，并缓存在 flow.metadata。
+
+    detail 为 auto 时，每隔 interval 秒根据请求速率和写入队列占用率
+    选择档位：任一指标超过 *_names 阈值降为 names，超过 *_none 阈值降为
+    none。被拦截和出错的 flow 始终完整记录（见 force_full）。
+    """
+
+    def __init__(self, settings: Optional[Mapping] = None, interval: float = 0.5):
+        self.interval = interval
+        self.queue_fill: Optional[Callable[[], float]] = None
+        self.level = DETAIL_FULL
+        self.rate = 0.0
+        self.sampled = 0
+        self.skipped = 0
+        self._count = 0
+        self._window_start = time.monotonic()
+        self.update(settings or {})
+
+    @classmethod
+    def from_config(cls, config) -> "LogSampler":
+        return cls(config.log_sampling)
+
+    def update(self, settings: Mapping):
+        """换上新的采样配置（热重载）"""
+        self.default_rate = settings.get("rate", 1.0)
+        self.host_rates = dict(settings.get("hosts", {}))
+        self.rule_rates = dict(settings.get("rules", {}))
+        self.detail = settings.get("detail", DETAIL_FULL)
+        self.thresholds = dict(settings.get("auto", {}))
+        self._host_cache = LRUCache(4096)
+        if self.detail != DETAIL_AUTO:
+            self.level = self.detail
+
+    def attach_queue(self, queue_fill: Callable[[], float]):
+        """注册写入队列占用率（0~1）的读取函数，auto 模式使用"""
+        self.queue_fill = queue_fill
+
+    def _host_rate(self, host: str) -> Optional[float]:
+        rate = self._host_cache.get(host)
+        if rate is None:
+            rate = -1.0
+            name = host
+            while name:
+                if name in self.host_rates:
+                    rate = self.host_rates[name]
+                    break
+                _, _, name = name.partition(".")
+            self._host_cache.put(host, rate)
+        return None if rate < 0 else rate
+
+    def rate_for(self, host: str, verdict=None) -> float:
+        """flow 的采样率"""
+        if self.host_rates:
+            rate = self._host_rate(host)
+            if rate is not None:
+                return rate
+        if verdict is not None and self.rule_rates:
+            if verdict.rule_id in self.rule_rates:
+                return self.rule_rates[verdict.rule_id]
+            if verdict.action in self.rule_rates:
+                return self.rule_rates[verdict.action]
+        return self.default_rate
+
+    def _observe(self):
+        """统计请求速率，auto 模式下重新选择档位"""
+        self._count += 1
+        now = time.monotonic()
+        elapsed = now - self._window_start
+        if elapsed < self.interval:
+            return
+        self.rate = self._count / elapsed
+        self._count = 0
+        self._window_start = now
+        if self.detail != DETAIL_AUTO:
+            return
+        fill = self.queue_fill() if self.queue_fill is not None else 0.0
+        t = self.thresholds
+        if fill >= t.get("queue_none", 0.8) or self.rate >= t.get("rate_none", 1000):
+            level = DETAIL_NONE
+        elif fill >= t.get("queue_names", 0.5) or self.rate >= t.get("rate_names", 200):
+            level = DETAIL_NAMES
+        else:
+            level = DETAIL_FULL
+        if level != self.level:
+            logger.info(f"📉 Request log detail: {self.level} -> {level} ({self.rate:.0f} req/s, queue {fill:.0%})")
+            self.level = level
+
+    def decide(self, flow) -> SampleDecision:
+        """flow 的采样结果，每个 flow 只计算一次"""
+        cached = flow.metadata.get(SAMPLE_KEY)
+        if cached is not None:
+            return SampleDecision(*cached)
+        self._observe()
+        rate = self.rate_for(flow.request.pretty_host, flow_verdict(flow.metadata))
+        if rate >= 1.0:
+            sampled = True
+        elif rate <= 0.0:
+            sampled = False
+        else:
+            sampled = zlib.crc32(flow.id.encode()) < rate * 0x100000000
+        if sampled:
+            self.sampled += 1
+        else:
+            self.skipped += 1
+        decision = SampleDecision(sampled, rate, self.level)
+        flow.metadata[SAMPLE_KEY] = tuple(decision)
+        return decision
+
+    def verbose(self, flow) -> bool:
+        """是否输出逐请求的 INFO 日志：被采样且处于 full 档位"""
+        decision = self.decide(flow)
+        return decision.sampled and decision.detail == DETAIL_FULL
+
+    @staticmethod
+    def force_full(flow) -> bool:
+        """被拦截或出错的 flow 不受采样和档位影响"""
+        if flow.error is not None:
+            return True
+        if flow.response is not None and flow.response.status_code >= 500:
+            return True
+        verdict = flow_verdict(flow.metadata)
+        return verdict is not None and verdict.action == ACTION_BLOCK
+
+    def stats(self) -> dict:
+        return {
+            "detail": self.level,
+            "rate": round(self.rate, 1),
+            "sampled": self.sampled,
+            "skipped": self.skipped,
+        }
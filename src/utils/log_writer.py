@@ -0,0 +1,308 @@
+"""后台批量写入的请求日志"""
+
+import logging
+import queue
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Dict, Optional
+from .log_format import JsonLinesEncoder
+from .log_rotation import SegmentRotator
+
+logger = logging.getLogger(__name__)
+
+BACKPRESSURE_DROP = "drop"
+BACKPRESSURE_BLOCK = "block"
+BACKPRESSURE_MODES = (BACKPRESSURE_DROP, BACKPRESSURE_BLOCK)
+
+
+class _Flush:
+    """队列中的刷盘请求，写入完成后置位 done"""
+
+    __slots__ = ("done",)
+
+    def __init__(self):
+        self.done = threading.Event()
+
+
+# 队列中的关闭标记
+_CLOSE = object()
+
+
+class AsyncLogWriter:
+    """把日志记录交给后台线程批量序列化和写入
+
+    write() 只把字典放进有界队列，编码和磁盘 IO 都在写线程中进行。写线程
+    一次取出最多 batch_size 条记录，用 encoder 编码（默认 JSON Lines，见
+    log_format）后拼接写入同一个带缓冲的文件句柄；缓冲数据超过
+    flush_bytes 或距上次刷盘超过 flush_interval 秒时刷盘，close() 时写完
+    队列中剩余的记录。
+
+    队列满时按 backpressure 处理：drop 丢弃并计数，block 阻塞调用方
+    直到有空位。
+
+    传入 rotator 和 next_path 时按策略轮转：关闭当前文件，改写到
+    next_path() 给出的新文件，旧文件交给后台压缩和清理。轮转检查在
+    写线程中进行，空闲时也会按时间轮转。
+
+    传入 indexer（见 log_index.SegmentIndexer）时登记每条记录的偏移，
+    刷盘后定期写出旁路索引，分段关闭时写出最终索引。
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        queue_size: int = 10000,
+        batch_size: int = 256,
+        flush_interval: float = 1.0,
+        flush_bytes: int = 64 * 1024,
+        backpressure: str = BACKPRESSURE_DROP,
+        rotator: Optional[SegmentRotator] = None,
+        next_path: Optional[Callable[[], Path]] = None,
+        encoder=None,
+        indexer=None,
+    ):
+        if backpressure not in BACKPRESSURE_MODES:
+            raise ValueError(f"Unknown backpressure mode: {backpressure}")
+        self.path = Path(path)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.flush_bytes = flush_bytes
+        self.backpressure = backpressure
+        self.encoder = encoder or JsonLinesEncoder()
+        self.indexer = indexer
+        self.rotator = rotator if next_path is not None else None
+        self.next_path = next_path
+        self.queue: "queue.Queue" = queue.Queue(queue_size)
+        self.written = 0
+        self.dropped = 0
+        self.errors = 0
+        self.index_errors = 0
+        self.batches = 0
+        self.bytes = 0
+        self._closed = False
+        self._file = None
+        self._size = 0
+        self._thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+        self._thread.start()
+
+    def write(self, record: Dict) -> bool:
+        """提交一条记录，被丢弃时返回 False；提交后不应再修改 record"""
+        if self._closed:
+            self.dropped += 1
+            return False
+        if self.backpressure == BACKPRESSURE_BLOCK:
+            self.queue.put(record)
+            return True
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+            return False
+        return True
+
+    def flush(self, timeout: Optional[float] = None):
+        """等待此前提交的记录全部写入并刷盘"""
+        if self._closed:
+            return
+        request = _Flush()
+        self.queue.put(request)
+        request.done.wait(timeout)
+
+    def close(self, timeout: Optional[float] = 10.0):
+        """写完剩余记录并关闭文件，可重复调用"""
+        if self._closed:
+            return
+        self._closed = True
+        self.queue.put(_CLOSE)
+        self._thread.join(timeout)
+
+    def _open(self):
+        if self._file is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._file = open(self.path, "ab", buffering=1 << 16)
+            self._size = self._file.tell()
+            header = self.encoder.begin(self._size == 0)
+            self._file.write(header)
+            self._size += len(header)
+        return self._file
+
+    def _close_segment(self):
+        """关闭当前文件并写出其最终索引"""
+        if self._file is not None:
+            try:
+                self._file.close()
+            except OSError as e:
+                logger.error(f"❌ Failed to close log: {e}")
+            self._file = None
+        if self.indexer is not None:
+            self.indexer.finish(self.path)
+
+    def _maybe_rotate(self):
+        """当前文件达到轮转条件时切换到新文件"""
+        if self.rotator is None or not self.rotator.should_rotate(self._size):
+            return
+        self._close_segment()
+        old, self.path = self.path, self.next_path()
+        self._size = 0
+        self.rotator.retire(old)
+        logger.info(f"🔁 Request log rotated: {self.path}")
+
+    def _abandon_segment(self):
+        """写入失败后结束当前分段
+
+        编码器已经把这批记录的新字符串加入字典，但对应的 DEFINE 帧没有
+        写出，继续写入的记录会引用不存在的编号。重新打开文件时 begin()
+        清空字典：有 next_path 时换到新分段，否则在原文件后追加 RESET 帧。
+        """
+        self._close_segment()
+        if self.next_path is not None:
+            old, self.path = self.path, self.next_path()
+            self._size = 0
+            if self.rotator is not None:
+                self.rotator.retire(old)
+            logger.warning(f"⚠️ Request log continues in new segment: {self.path}")
+
+    def _write_batch(self, batch) -> int:
+        """编码并写入一批记录，返回写入的字节数"""
+        self._maybe_rotate()
+        try:
+            file = self._open()
+        except OSError as e:
+            self.errors += len(batch)
+            logger.error(f"❌ Failed to open log: {e}")
+            return 0
+        chunks = []
+        encoded = []
+        for record in batch:
+            try:
+                chunk = self.encoder.encode(record)
+            except Exception as e:
+                self.errors += 1
+                logger.error(f"❌ Failed to serialize log record: {e}")
+                continue
+            chunks.append(chunk)
+            encoded.append(record)
+        if not chunks:
+            return 0
+        data = b"".join(chunks)
+        try:
+            file.write(data)
+        except OSError as e:
+            self.errors += len(chunks)
+            logger.error(f"❌ Failed to write log: {e}")
+            self._abandon_segment()
+            return 0
+        if self.indexer is not None:
+            # 写入成功后才登记，索引不会指向没有写出的数据
+            offset = self._size
+            for record, chunk in zip(encoded, chunks):
+                # 索引失败只影响查询，记录本身已经写入
+                try:
+                    self.indexer.add(record, offset, chunk)
+                except Exception as e:
+                    self.index_errors += 1
+                    logger.error(f"❌ Failed to index log record: {e}")
+                offset += len(chunk)
+        self.written += len(chunks)
+        self.batches += 1
+        self.bytes += len(data)
+        self._size += len(data)
+        return len(data)
+
+    def _flush_file(self):
+        if self._file is not None:
+            try:
+                self._file.flush()
+            except OSError as e:
+                logger.error(f"❌ Failed to flush log: {e}")
+                return
+            if self.indexer is not None:
+                self.indexer.maybe_checkpoint(self.path)
+
+    def _run(self):
+        pending = 0
+        last_flush = time.monotonic()
+        while True:
+            try:
+                item = self.queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                item = None
+
+            batch = []
+            control = None
+            while item is not None:
+                if item is _CLOSE or isinstance(item, _Flush):
+                    control = item
+                    break
+                batch.append(item)
+                if len(batch) >= self.batch_size:
+                    break
+                try:
+                    item = self.queue.get_nowait()
+                except queue.Empty:
+                    item = None
+
+            # 写线程退出后 block 模式的 write() 和 flush() 会永久阻塞，
+            # 所以任何异常都只记录并继续
+            try:
+                if batch:
+                    pending += self._write_batch(batch)
+                elif item is None and control is None:
+                    # 空闲时也检查按时间轮转
+                    self._flush_file()
+                    pending = 0
+                    self._maybe_rotate()
+
+                now = time.monotonic()
+                if control is not None or pending >= self.flush_bytes or (pending and now - last_flush >= self.flush_interval):
+                    self._flush_file()
+                    pending = 0
+                    last_flush = now
+            except Exception as e:
+                self.errors += max(len(batch), 1)
+                logger.error(f"❌ Log writer error: {e}")
+
+            if control is _CLOSE:
+                self._close_remaining()
+                return
+            if control is not None:
+                control.done.set()
+
+    def _close_remaining(self):
+        """关闭前写完队列里剩下的记录"""
+        rest = []
+        while True:
+            try:
+                item = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if isinstance(item, _Flush):
+                item.done.set()
+            elif item is not _CLOSE:
+                rest.append(item)
+        try:
+            if rest:
+                self._write_batch(rest)
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+                if self.indexer is not None:
+                    self.indexer.finish(self.path)
+        except Exception as e:
+            logger.error(f"❌ Failed to close log: {e}")
+
+    def stats(self) -> Dict:
+        """写入统计"""
+        return {
+            "queued": self.queue.qsize(),
+            "written": self.written,
+            "dropped": self.dropped,
+            "errors": self.errors,
+            "index_errors": self.index_errors,
+            "batches": self.batches,
+            "bytes": self.bytes,
+        }
+
+    def __repr__(self):
+        return f"AsyncLogWriter({self.path}, queued={self.queue.qsize()}, dropped={self.dropped})"
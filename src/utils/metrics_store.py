@@ -0,0 +1,537 @@
+"""历史指标的 SQLite 时序存储
+
+StatsHandler 通过 MetricsSink 按分钟汇总每个主机的请求数、拦截数、错误
+数、字节数和延迟直方图，整分钟交给后台线程批量写入 SQLite。同一线程
+定期把分钟数据汇总为小时、再汇总为天，并按保留期删除旧数据。延迟直方图
+以 JSON 存在每一行中，汇总时合并直方图，所以小时、天的百分位不是由
+分钟百分位平均得来的。
+
+每个时间桶另有 host 为 "*" 的一行表示全部主机，画总体趋势时只需按主键
+读取一段连续的行。时间桶按 UTC 对齐。
+
+    python -m src.utils.metrics_store series --since 24h
+    python -m src.utils.metrics_store hosts --since 7d --by bytes
+"""
+
+import argparse
+import json
+import logging
+import queue
+import re
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Iterable, List, Mapping, Optional, Tuple
+from .histogram import LogHistogram
+
+logger = logging.getLogger(__name__)
+
+MINUTE, HOUR, DAY = 60, 3600, 86400
+RESOLUTIONS = {"minute": MINUTE, "hour": HOUR, "day": DAY}
+# (来源精度, 目标精度)
+ROLLUPS = ((MINUTE, HOUR), (HOUR, DAY))
+COUNTERS = ("requests", "blocked", "errors", "bytes")
+ALL_HOSTS = "*"
+OTHER = "(other)"
+# 各精度默认保留天数
+DEFAULT_RETENTION = {"minute": 2, "hour": 30, "day": 365}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS metrics (
+    resolution INTEGER NOT NULL,
+    bucket INTEGER NOT NULL,
+    host TEXT NOT NULL,
+    requests INTEGER NOT NULL,
+    blocked INTEGER NOT NULL,
+    errors INTEGER NOT NULL,
+    bytes INTEGER NOT NULL,
+    p50_ms REAL,
+    p90_ms REAL,
+    p99_ms REAL,
+    max_ms REAL,
+    latency TEXT,
+    PRIMARY KEY (resolution, host, bucket)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS metrics_bucket ON metrics (resolution, bucket);
+CREATE TABLE IF NOT EXISTS rollup_state (
+    resolution INTEGER PRIMARY KEY,
+    done_until INTEGER NOT NULL
+);
+"""
+
+
+class MetricBucket:
+    """一个主机在一个时间桶内的汇总"""
+
+    __slots__ = ("requests", "blocked", "errors", "bytes", "latency")
+
+    def __init__(self):
+        self.requests = 0
+        self.blocked = 0
+        self.errors = 0
+        self.bytes = 0
+        self.latency = LogHistogram()
+
+    def merge(self, other: "MetricBucket"):
+        self.requests += other.requests
+        self.blocked += other.blocked
+        self.errors += other.errors
+        self.bytes += other.bytes
+        self.latency.merge(other.latency)
+
+    def row(self, resolution: int, bucket: int, host: str) -> tuple:
+        latency = self.latency
+        if latency.count:
+            percentiles = (
+                latency.percentile(50) / 1000,
+                latency.percentile(90) / 1000,
+                latency.percentile(99) / 1000,
+                latency.max / 1000,
+            )
+            encoded = json.dumps(latency.to_dict(), separators=(",", ":"))
+        else:
+            percentiles = (None, None, None, None)
+            encoded = None
+        return (resolution, bucket, host, self.requests, self.blocked, self.errors, self.bytes, *percentiles, encoded)
+
+    @classmethod
+    def from_row(cls, requests: int, blocked: int, errors: int, size: int, latency: Optional[str]) -> "MetricBucket":
+        bucket = cls()
+        bucket.requests, bucket.blocked, bucket.errors, bucket.bytes = requests, blocked, errors, size
+        if latency:
+            bucket.latency = LogHistogram.from_dict(json.loads(latency))
+        return bucket
+
+
+def pick_resolution(since: float, until: float, max_points: int = 360) -> int:
+    """点数不超过 max_points 的最细精度"""
+    span = max(until - since, 1)
+    for seconds in (MINUTE, HOUR):
+        if span / seconds <= max_points:
+            return seconds
+    return DAY
+
+
+class MetricsStore:
+    """指标数据库；sqlite3 连接只能在创建它的线程中使用"""
+
+    def __init__(self, path, readonly: bool = False):
+        self.path = Path(path)
+        if readonly:
+            self.conn = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True)
+        else:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self.conn = sqlite3.connect(str(self.path))
+            # WAL 模式下 GUI 和命令行读取不会阻塞写入
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=NORMAL")
+            self.conn.executescript(_SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    # 写入
+
+    def _load(self, resolution: int, bucket: int) -> Dict[str, MetricBucket]:
+        rows = self.conn.execute(
+            "SELECT host, requests, blocked, errors, bytes, latency FROM metrics WHERE resolution = ? AND bucket = ?",
+            (resolution, bucket),
+        )
+        return {host: MetricBucket.from_row(*values) for host, *values in rows}
+
+    def _merge(self, resolution: int, bucket: int, buckets: Mapping[str, MetricBucket]):
+        """把数据累加到一个时间桶已有的行上"""
+        merged = self._load(resolution, bucket)
+        for host, part in buckets.items():
+            if host in merged:
+                merged[host].merge(part)
+            else:
+                merged[host] = part
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO metrics VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            [part.row(resolution, bucket, host) for host, part in merged.items()],
+        )
+
+    def write(self, batch: Iterable[Tuple[int, Mapping[str, MetricBucket]]]):
+        """在一个事务中写入若干分钟的数据，该分钟已有数据（如重启前写过）时合并
+
+        落在已经汇总过的小时、天里的迟到数据直接累加到汇总行上，不重新
+        汇总，因为那段时间的分钟数据可能已经过期删除。
+        """
+        with self.conn:
+            done = {target: self._done_until(target) for _, target in ROLLUPS}
+            late: Dict[Tuple[int, int], Dict[str, MetricBucket]] = {}
+            for minute, buckets in batch:
+                self._merge(MINUTE, minute, buckets)
+                for target, until in done.items():
+                    if until is not None and minute < until:
+                        parts = late.setdefault((target, minute // target * target), {})
+                        for host, part in buckets.items():
+                            parts.setdefault(host, MetricBucket()).merge(part)
+            for (target, bucket), parts in late.items():
+                self._merge(target, bucket, parts)
+
+    def _done_until(self, resolution: int) -> Optional[int]:
+        row = self.conn.execute("SELECT done_until FROM rollup_state WHERE resolution = ?", (resolution,)).fetchone()
+        return row[0] if row else None
+
+    def rollup(self, now: Optional[float] = None) -> int:
+        """把已结束的小时、天从下一级精度汇总出来，返回写入的行数"""
+        now = now if now is not None else time.time()
+        written = 0
+        for source, target in ROLLUPS:
+            limit = int(now) // target * target
+            with self.conn:
+                start = self._done_until(target)
+                if start is None:
+                    start = 0
+                buckets = [
+                    row[0]
+                    for row in self.conn.execute(
+                        "SELECT DISTINCT bucket / ? * ? FROM metrics WHERE resolution = ? AND bucket >= ? AND bucket < ?",
+                        (target, target, source, start, limit),
+                    )
+                ]
+                for bucket in buckets:
+                    merged: Dict[str, MetricBucket] = {}
+                    rows = self.conn.execute(
+                        "SELECT host, requests, blocked, errors, bytes, latency FROM metrics "
+                        "WHERE resolution = ? AND bucket >= ? AND bucket < ?",
+                        (source, bucket, bucket + target),
+                    )
+                    for host, *values in rows:
+                        part = MetricBucket.from_row(*values)
+                        if host in merged:
+                            merged[host].merge(part)
+                        else:
+                            merged[host] = part
+                    self.conn.execute(
+                        "DELETE FROM metrics WHERE resolution = ? AND bucket = ?", (target, bucket)
+                    )
+                    self.conn.executemany(
+                        "INSERT INTO metrics VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                        [part.row(target, bucket, host) for host, part in merged.items()],
+                    )
+                    written += len(merged)
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO rollup_state VALUES (?, ?)", (target, max(start, limit))
+                )
+        return written
+
+    def prune(self, retention: Mapping[str, float], now: Optional[float] = None) -> int:
+        """删除超过保留期（天）的行；尚未汇总到上一级的行保留"""
+        now = now if now is not None else time.time()
+        deleted = 0
+        parents = dict(ROLLUPS)
+        with self.conn:
+            for name, seconds in RESOLUTIONS.items():
+                days = retention.get(name, 0)
+                if not days:
+                    continue
+                cutoff = int(now - days * 86400)
+                if seconds in parents:
+                    done = self._done_until(parents[seconds]) or 0
+                    cutoff = min(cutoff, done)
+                cursor = self.conn.execute(
+                    "DELETE FROM metrics WHERE resolution = ? AND bucket < ?", (seconds, cutoff)
+                )
+                deleted += cursor.rowcount
+        return deleted
+
+    # 查询
+
+    def series(
+        self,
+        since: float,
+        until: Optional[float] = None,
+        host: str = ALL_HOSTS,
+        resolution: Optional[int] = None,
+    ) -> List[Dict]:
+        """一个主机（缺省为全部主机）的时间序列，按时间升序"""
+        until = until if until is not None else time.time()
+        resolution = resolution or pick_resolution(since, until)
+        start = int(since) // resolution * resolution
+        rows = self.conn.execute(
+            "SELECT bucket, requests, blocked, errors, bytes, p50_ms, p90_ms, p99_ms, max_ms FROM metrics "
+            "WHERE resolution = ? AND host = ? AND bucket >= ? AND bucket < ? ORDER BY bucket",
+            (resolution, host, start, until),
+        )
+        names = ("time", *COUNTERS, "p50_ms", "p90_ms", "p99_ms", "max_ms")
+        return [dict(zip(names, row)) for row in rows]
+
+    def top_hosts(
+        self,
+        since: float,
+        until: Optional[float] = None,
+        limit: int = 10,
+        by: str = "requests",
+        resolution: Optional[int] = None,
+    ) -> List[Dict]:
+        """时间范围内按某个计数排序的主机"""
+        if by not in COUNTERS:
+            raise ValueError(f"by must be one of {', '.join(COUNTERS)}")
+        until = until if until is not None else time.time()
+        resolution = resolution or pick_resolution(since, until)
+        start = int(since) // resolution * resolution
+        rows = self.conn.execute(
+            f"SELECT host, SUM(requests), SUM(blocked), SUM(errors), SUM(bytes) FROM metrics "
+            f"WHERE resolution = ? AND bucket >= ? AND bucket < ? AND host != ? "
+            f"GROUP BY host ORDER BY SUM({by}) DESC LIMIT ?",
+            (resolution, start, until, ALL_HOSTS, limit),
+        )
+        return [dict(zip(("host", *COUNTERS), row)) for row in rows]
+
+    def summary(
+        self,
+        since: float,
+        until: Optional[float] = None,
+        host: str = ALL_HOSTS,
+        resolution: Optional[int] = None,
+    ) -> Dict:
+        """时间范围内的合计和合并直方图得到的延迟百分位（毫秒）"""
+        until = until if until is not None else time.time()
+        resolution = resolution or pick_resolution(since, until)
+        start = int(since) // resolution * resolution
+        total = MetricBucket()
+        rows = self.conn.execute(
+            "SELECT requests, blocked, errors, bytes, latency FROM metrics "
+            "WHERE resolution = ? AND host = ? AND bucket >= ? AND bucket < ?",
+            (resolution, host, start, until),
+        )
+        for values in rows:
+            total.merge(MetricBucket.from_row(*values))
+        latency = total.latency.summary()
+        return {
+            **{name: getattr(total, name) for name in COUNTERS},
+            "latency_ms": {key: value / 1000 for key, value in latency.items() if key != "count"},
+        }
+
+
+class MetricsSink:
+    """在事件循环中按分钟汇总，后台线程写库、汇总和清理
+
+    每个主机一行，超过 max_hosts 个主机时新主机计入 "(other)"。一分钟
+    结束后（下一次 record() 发现分钟变化时）把整分钟的数据交给写线程，
+    最后一分钟在 close() 时写出。写线程每 rollup_interval 秒做一次汇总和
+    过期清理。
+    """
+
+    def __init__(
+        self,
+        path,
+        max_hosts: int = 200,
+        rollup_interval: float = 300.0,
+        retention: Optional[Mapping[str, float]] = None,
+    ):
+        self.path = Path(path)
+        self.max_hosts = max_hosts
+        self.rollup_interval = rollup_interval
+        self.retention = dict(retention or DEFAULT_RETENTION)
+        self.minutes_written = 0
+        self.failed = 0
+        self._minute: Optional[int] = None
+        self._buckets: Dict[str, MetricBucket] = {}
+        # 元素为 (分钟, {主机: MetricBucket})，None 表示停止
+        self._queue: queue.Queue = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+
+    @classmethod
+    def from_config(cls, options: Mapping) -> "MetricsSink":
+        return cls(
+            options["db"],
+            max_hosts=options["max_hosts"],
+            rollup_interval=options["rollup_interval"],
+            retention=options["retention"],
+        )
+
+    def _bucket(self, host: str) -> MetricBucket:
+        bucket = self._buckets.get(host)
+        if bucket is None:
+            # 总体一行加上 max_hosts 个主机
+            if len(self._buckets) > self.max_hosts:
+                host = OTHER
+                bucket = self._buckets.get(host)
+            if bucket is None:
+                bucket = self._buckets[host] = MetricBucket()
+        return bucket
+
+    def record(
+        self,
+        host: str,
+        blocked: bool = False,
+        error: bool = False,
+        size: int = 0,
+        latency_us: Optional[int] = None,
+        now: Optional[float] = None,
+    ):
+        """记录一个已完成的请求"""
+        minute = int(now if now is not None else time.time()) // MINUTE * MINUTE
+        if minute != self._minute:
+            self._rotate(minute)
+        for bucket in (self._bucket(ALL_HOSTS), self._bucket(host)):
+            bucket.requests += 1
+            if blocked:
+                bucket.blocked += 1
+            if error:
+                bucket.errors += 1
+            bucket.bytes += size
+            if latency_us is not None:
+                bucket.latency.record(latency_us)
+
+    def _rotate(self, minute: Optional[int]):
+        if self._buckets:
+            self._queue.put((self._minute, self._buckets))
+        self._minute = minute
+        self._buckets = {}
+
+    def _run(self):
+        store = MetricsStore(self.path)
+        next_rollup = time.monotonic()
+        try:
+            while True:
+                timeout = max(next_rollup - time.monotonic(), 0)
+                try:
+                    item = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    item = ()
+                if item is None:
+                    break
+                if item:
+                    self._write(store, *item)
+                if time.monotonic() >= next_rollup:
+                    self._maintain(store)
+                    next_rollup = time.monotonic() + self.rollup_interval
+            # 关闭前汇总一次，保证最近的小时和天可以查询
+            self._maintain(store)
+        finally:
+            store.close()
+
+    def _write(self, store: MetricsStore, minute: int, buckets: Dict[str, MetricBucket]):
+        # 把已排队的分钟一起写出
+        batch = [(minute, buckets)]
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                self._queue.put(None)
+                break
+            batch.append(item)
+        try:
+            store.write(batch)
+            self.minutes_written += len(batch)
+        except Exception as e:
+            self.failed += len(batch)
+            logger.error(f"❌ Failed to write {len(batch)} minutes of metrics: {e}")
+
+    def _maintain(self, store: MetricsStore):
+        try:
+            store.rollup()
+            store.prune(self.retention)
+        except Exception as e:
+            logger.error(f"❌ Metrics rollup failed: {e}")
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._thread = threading.Thread(target=self._run, name="metrics-store", daemon=True)
+        self._thread.start()
+
+    def close(self):
+        """写出当前分钟并等待写线程结束"""
+        self._rotate(None)
+        self._queue.put(None)
+        if self._thread is not None:
+            self._thread.join(10)
+            self._thread = None
+
+    def stats(self) -> Dict:
+        return {
+            "db": str(self.path),
+            "minutes_written": self.minutes_written,
+            "failed": self.failed,
+            "queued": self._queue.qsize(),
+            "hosts": max(len(self._buckets) - 1, 0),
+        }
+
+
+_RELATIVE = re.compile(r"^(\d+(?:\.\d+)?)([smhd])$")
+_UNITS = {"s": 1, "m": MINUTE, "h": HOUR, "d": DAY}
+
+
+def _parse_time(value: Optional[str]) -> Optional[float]:
+    """Unix 秒、ISO 时间，或 30m / 24h / 7d 这样的相对时间（距现在）"""
+    if value is None:
+        return None
+    match = _RELATIVE.match(value)
+    if match:
+        return time.time() - float(match.group(1)) * _UNITS[match.group(2)]
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        return datetime.fromisoformat(value).timestamp()
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid time: {value}")
+
+
+def _print_table(rows: Iterable[Dict], columns: List[str]):
+    def cell(value) -> str:
+        if value is None:
+            return ""
+        return f"{value:.1f}" if isinstance(value, float) else str(value)
+
+    cells = [[cell(row[c]) for c in columns] for row in rows]
+    widths = [max([len(c)] + [len(r[i]) for r in cells]) for i, c in enumerate(columns)]
+    print("  ".join(c.rjust(w) for c, w in zip(columns, widths)))
+    for r in cells:
+        print("  ".join(v.rjust(w) for v, w in zip(r, widths)))
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="历史指标查询")
+    sub = parser.add_subparsers(dest="command", required=True)
+    for name, help_text in (("series", "时间序列"), ("hosts", "按计数排序的主机"), ("summary", "时间范围内的合计")):
+        p = sub.add_parser(name, help=help_text)
+        p.add_argument("--db", default="logs/metrics.db", help="指标数据库")
+        p.add_argument("--since", type=_parse_time, default="24h", help="开始时间，默认 24h 前")
+        p.add_argument("--until", type=_parse_time, help="结束时间，默认现在")
+        p.add_argument("--resolution", choices=["auto", *RESOLUTIONS], default="auto", help="时间精度")
+        p.add_argument("--json", action="store_true", help="以 JSON 输出")
+        if name == "hosts":
+            p.add_argument("--by", choices=COUNTERS, default="requests", help="排序依据")
+            p.add_argument("--limit", type=int, default=20, help="主机数")
+        else:
+            p.add_argument("--host", default=ALL_HOSTS, help="主机，默认全部")
+    args = parser.parse_args(argv)
+
+    if not Path(args.db).exists():
+        parser.error(f"{args.db} not found")
+    store = MetricsStore(args.db, readonly=True)
+    resolution = None if args.resolution == "auto" else RESOLUTIONS[args.resolution]
+    try:
+        if args.command == "series":
+            result = store.series(args.since, args.until, args.host, resolution)
+            for row in result:
+                row["time"] = datetime.fromtimestamp(row["time"]).isoformat(sep=" ")
+            columns = ["time", *COUNTERS, "p50_ms", "p90_ms", "p99_ms", "max_ms"]
+        elif args.command == "hosts":
+            result = store.top_hosts(args.since, args.until, args.limit, args.by, resolution)
+            columns = ["host", *COUNTERS]
+        else:
+            result = store.summary(args.since, args.until, args.host, resolution)
+    finally:
+        store.close()
+
+    if args.json or args.command == "summary":
+        print(json.dumps(result, ensure_ascii=False, indent=2))
+    else:
+        _print_table(result, columns)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""滑动窗口速率计数"""
+
+import time
+from typing import Dict, Iterable, Optional, Tuple
+
+# 默认窗口：1 分钟、5 分钟、15 分钟
+WINDOWS = (("1m", 60), ("5m", 300), ("15m", 900))
+
+
+class WindowedCounter:
+    """1 秒精度的环形缓冲计数器
+
+    每个指标一个长度为 horizon 的环，槽位记录所属的秒；写入时若槽位属于
+    更早的一圈则先清零，所以 add() 是 O(1)，读取最近 window 秒是
+    O(window)。无锁，只应在单个线程（mitmproxy 事件循环）中写入。
+    """
+
+    def __init__(self, metrics: Iterable[str], horizon: int = 900):
+        self.horizon = horizon
+        self.metrics = tuple(metrics)
+        self._counts: Dict[str, list] = {m: [0] * horizon for m in self.metrics}
+        self._stamps: Dict[str, list] = {m: [-1] * horizon for m in self.metrics}
+
+    def add(self, metric: str, n: int = 1, now: Optional[float] = None):
+        """计数，now 缺省为当前时间"""
+        second = int(now if now is not None else time.time())
+        slot = second % self.horizon
+        stamps = self._stamps[metric]
+        counts = self._counts[metric]
+        if stamps[slot] != second:
+            stamps[slot] = second
+            counts[slot] = n
+        else:
+            counts[slot] += n
+
+    def window(self, metric: str, seconds: int, now: Optional[float] = None) -> Tuple[int, int]:
+        """最近 seconds 秒（含当前这一秒）的 (总数, 单秒峰值)"""
+        seconds = min(seconds, self.horizon)
+        current = int(now if now is not None else time.time())
+        stamps = self._stamps[metric]
+        counts = self._counts[metric]
+        total = peak = 0
+        for second in range(current - seconds + 1, current + 1):
+            slot = second % self.horizon
+            if stamps[slot] == second:
+                n = counts[slot]
+                total += n
+                if n > peak:
+                    peak = n
+        return total, peak
+
+    def rates(self, windows=WINDOWS, now: Optional[float] = None, elapsed: Optional[float] = None) -> Dict:
+        """各窗口内每个指标的平均速率（每秒）和单秒峰值
+
+        elapsed 为开始计数以来的秒数，窗口比它长时按实际时长计算平均值，
+        避免刚启动时速率偏低。
+        """
+        now = now if now is not None else time.time()
+        result = {}
+        for name, seconds in windows:
+            span = min(seconds, max(elapsed, 1.0)) if elapsed is not None else seconds
+            rates = {}
+            peaks = {}
+            for metric in self.metrics:
+                total, peak = self.window(metric, seconds, now)
+                rates[metric] = total / span
+                peaks[metric] = peak
+            result[name] = {"rate": rates, "peak": peaks}
+        return result
+
+    def clear(self):
+        for metric in self.metrics:
+            self._counts[metric] = [0] * self.horizon
+            self._stamps[metric] = [-1] * self.horizon
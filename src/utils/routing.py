@@ -0,0 +1,147 @@
+"""上游代理路由表"""
+
+from typing import Dict, Iterable, List, Optional, Union
+from urllib.parse import urlsplit
+from .cache import LRUCache
+from .rules import HostTrie, RuleMatcher, RuleType, parse_rule_spec
+from .upstream_pool import UpstreamMember, UpstreamPool
+
+_NO_ROUTE = -1
+
+Upstreams = Union[str, List[str]]
+
+
+class UpstreamRouter:
+    """编译后的上游路由表
+
+    路由的 pattern 与拦截规则写法相同（见 parse_rule_spec），按配置顺序
+    先匹配者优先。host: 路由放进主机名后缀树，结果只取决于主机名，按主机
+    缓存；其余类型的路由编译进 RuleMatcher，对完整 URL 匹配。配置中没有
+    URL 路由时，一次查询只是一次缓存读取。
+
+    每条路由对应一个 UpstreamPool，可以是单个上游，也可以是多个上游组成
+    的池；同一地址的上游在所有池之间共享一个 UpstreamMember，健康状态
+    只维护一份。
+    """
+
+    def __init__(
+        self,
+        routes: Iterable[Dict] = (),
+        default: Upstreams = "",
+        cache_size: int = 4096,
+        alpha: float = 0.3,
+    ):
+        self.alpha = alpha
+        self.members: Dict[str, UpstreamMember] = {}
+        self.pools: List[UpstreamPool] = []
+        self.patterns: List[str] = []
+        self._hosts = HostTrie()
+        self._urls = RuleMatcher()
+        self.cache = LRUCache(cache_size)
+        self.default = self._pool(default)
+        for route in routes:
+            self.add_route(route.get("pattern", ""), route.get("upstreams") or route.get("upstream", ""))
+
+    def _pool(self, upstreams: Upstreams) -> Optional[UpstreamPool]:
+        """由上游地址（或地址列表）构建代理池，空地址返回 None 表示直连"""
+        if isinstance(upstreams, str):
+            upstreams = [upstreams]
+        members = []
+        for upstream in upstreams:
+            if not upstream:
+                continue
+            member = self.members.get(upstream)
+            if member is None:
+                member = self.members[upstream] = UpstreamMember(upstream, self.alpha)
+            members.append(member)
+        return UpstreamPool(members) if members else None
+
+    def add_route(self, spec: str, upstreams: Upstreams) -> Optional[int]:
+        """追加一条路由，返回路由序号；pattern 为空时忽略"""
+        if not spec:
+            return None
+        index = len(self.pools)
+        pattern, rule_type = parse_rule_spec(spec)
+        if rule_type == RuleType.HOST:
+            self._hosts.add(pattern, index)
+        else:
+            self._urls.add(pattern, rule_type, rule_id=f"route:{index}")
+        self.pools.append(self._pool(upstreams))
+        self.patterns.append(spec)
+        self.cache.clear()
+        return index
+
+    def inherit(self, other: "UpstreamRouter"):
+        """从旧路由表继承同名上游的健康状态，重载后无需重新探测"""
+        for upstream, member in self.members.items():
+            old = other.members.get(upstream)
+            if old is not None:
+                member.copy_state(old)
+
+    def compile(self) -> "UpstreamRouter":
+        """完成 URL 规则的延迟构建"""
+        self._urls.compile()
+        return self
+
+    def _host_route(self, host: str) -> int:
+        """主机名命中的最靠前路由，结果按主机缓存"""
+        index = self.cache.get(host)
+        if index is None:
+            index = min(self._hosts.iter_matches(host), default=_NO_ROUTE) if host else _NO_ROUTE
+            self.cache.put(host, index)
+        return index
+
+    def route_index(self, url: str, host: Optional[str] = None) -> int:
+        """命中的路由序号，未命中返回 -1"""
+        if host is None:
+            host = urlsplit(url).hostname or ""
+        index = self._host_route(host) if len(self._hosts) else _NO_ROUTE
+        if len(self._urls):
+            rule = self._urls.match_first(url)
+            if rule is not None:
+                url_index = int(rule.rule_id.partition(":")[2])
+                if index == _NO_ROUTE or url_index < index:
+                    index = url_index
+        return index
+
+    def pool(self, url: str, host: Optional[str] = None) -> Optional[UpstreamPool]:
+        """请求对应的代理池，未命中路由时为默认池，None 表示直连"""
+        index = self.route_index(url, host)
+        return self.default if index == _NO_ROUTE else self.pools[index]
+
+    def select(self, url: str, host: Optional[str] = None) -> Optional[UpstreamMember]:
+        """为请求选出具体的上游，None 表示直连"""
+        pool = self.pool(url, host)
+        return pool.select() if pool is not None else None
+
+    def route(self, url: str, host: Optional[str] = None) -> str:
+        """返回请求应使用的上游代理地址，直连时返回空字符串"""
+        member = self.select(url, host)
+        return member.upstream if member is not None else ""
+
+    def stats(self) -> Dict:
+        """各路由代理池的健康状态和延迟"""
+        return {
+            "routes": [
+                {"pattern": pattern, "upstreams": pool.stats() if pool else []}
+                for pattern, pool in zip(self.patterns, self.pools)
+            ],
+            "default": self.default.stats() if self.default else [],
+            "cache": self.cache.stats(),
+        }
+
+    def clear(self):
+        """清空路由表"""
+        self.members = {}
+        self.pools = []
+        self.patterns = []
+        self.default = None
+        self._hosts.clear()
+        self._urls.clear()
+        self.cache.clear()
+
+    def __len__(self):
+        return len(self.pools)
+
+    def __repr__(self):
+        return f"UpstreamRouter(routes={len(self.pools)}, default={self.default!r})"
@@ -0,0 +1,152 @@
+"""编译后规则集的磁盘快照
+
+大型规则列表每次启动都重新解析、构建自动机代价很高。这里把编译好的
+RuleSet 序列化到缓存目录，键为内联规则和所有来源文件内容的摘要；
+来源文件的 mtime/大小未变化时直接复用上次计算的哈希，不再读取文件。
+
+快照使用 pickle，只应放在本机可信目录中。
+"""
+
+import hashlib
+import json
+import logging
+import os
+import pickle
+import time
+from pathlib import Path
+from typing import Dict, Optional
+from .rule_sources import resolve_source_path
+from .ruleset import RuleSet
+
+logger = logging.getLogger(__name__)
+
+# 快照格式版本，RuleSet 内部结构变化时递增
+SNAPSHOT_VERSION = 2
+
+_MANIFEST = "manifest.json"
+
+
+class RuleSnapshotCache:
+    """规则快照缓存目录"""
+
+    def __init__(self, snapshot_dir: str):
+        self.dir = Path(snapshot_dir)
+        self._manifest_path = self.dir / _MANIFEST
+
+    def load_manifest(self) -> Dict[str, Dict]:
+        """读取来源文件的 mtime/大小/哈希记录"""
+        try:
+            with open(self._manifest_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _file_digest(self, path: Path, manifest: Dict[str, Dict]) -> Optional[str]:
+        """来源文件内容哈希，mtime 和大小未变时使用记录值；无法读取时返回 None"""
+        key = str(path.absolute())
+        h = hashlib.sha256()
+        try:
+            st = path.stat()
+            entry = manifest.get(key)
+            if entry and entry["mtime_ns"] == st.st_mtime_ns and entry["size"] == st.st_size:
+                return entry["sha256"]
+
+            with open(path, "rb") as f:
+                for block in iter(lambda: f.read(1 << 20), b""):
+                    h.update(block)
+        except OSError as e:
+            # 与 read_source 一致按空来源处理，文件出现后键随之变化
+            logger.warning(f"⚠️ Skipping unreadable rule source {path}: {e}")
+            manifest.pop(key, None)
+            return None
+        digest = h.hexdigest()
+        manifest[key] = {"mtime_ns": st.st_mtime_ns, "size": st.st_size, "sha256": digest}
+        return digest
+
+    def key_for(self, config, manifest: Dict[str, Dict]) -> str:
+        """计算配置对应的快照键"""
+        parts = {
+            "version": SNAPSHOT_VERSION,
+            "block": list(config.block_rules),
+            "allow": list(config.allow_rules),
+            "log_only": list(config.log_only_rules),
+            "streaming": list(config.streaming_paths),
+            "cache_size": config.verdict_cache_size,
+            "sources": [
+                {
+                    **source,
+                    "sha256": self._file_digest(
+                        resolve_source_path(source, config.config_dir), manifest
+                    ),
+                }
+                for source in config.rule_sources
+            ],
+        }
+        blob = json.dumps(parts, sort_keys=True, ensure_ascii=False).encode("utf-8")
+        return hashlib.sha256(blob).hexdigest()
+
+    def _snapshot_path(self, key: str) -> Path:
+        return self.dir / f"ruleset-{key[:32]}.pickle"
+
+    def load(self, key: str) -> Optional[RuleSet]:
+        """读取快照，不存在或损坏时返回 None"""
+        path = self._snapshot_path(key)
+        try:
+            with open(path, "rb") as f:
+                ruleset = pickle.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning(f"⚠️ Discarding unreadable rule snapshot {path}: {e}")
+            return None
+        return ruleset if isinstance(ruleset, RuleSet) else None
+
+    def save(self, key: str, ruleset: RuleSet, manifest: Dict[str, Dict]):
+        """原子写入快照并清理旧快照"""
+        self.dir.mkdir(parents=True, exist_ok=True)
+        path = self._snapshot_path(key)
+        _atomic_write(path, pickle.dumps(ruleset, protocol=pickle.HIGHEST_PROTOCOL))
+        _atomic_write(
+            self._manifest_path,
+            json.dumps(manifest, indent=2, ensure_ascii=False).encode("utf-8"),
+        )
+        for old in self.dir.glob("ruleset-*.pickle"):
+            if old != path:
+                try:
+                    old.unlink()
+                except OSError:
+                    pass
+
+
+def _atomic_write(path: Path, data: bytes):
+    """先写临时文件再改名"""
+    tmp = path.with_name(path.name + ".tmp")
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def load_ruleset(config) -> RuleSet:
+    """构建规则集，优先使用磁盘快照"""
+    if not config.rule_snapshot_dir:
+        return RuleSet.from_config(config).compile()
+
+    start = time.perf_counter()
+    cache = RuleSnapshotCache(Path(config.config_dir) / config.rule_snapshot_dir)
+    manifest = cache.load_manifest()
+    key = cache.key_for(config, manifest)
+
+    ruleset = cache.load(key)
+    if ruleset is not None:
+        elapsed = (time.perf_counter() - start) * 1000
+        logger.info(f"⚡ Loaded rule snapshot ({len(ruleset)} rules) in {elapsed:.1f}ms")
+        return ruleset
+
+    ruleset = RuleSet.from_config(config).compile()
+    try:
+        cache.save(key, ruleset, manifest)
+    except OSError as e:
+        logger.warning(f"⚠️ Failed to write rule snapshot: {e}")
+    elapsed = (time.perf_counter() - start) * 1000
+    logger.info(f"🔨 Compiled {len(ruleset)} rules in {elapsed:.1f}ms")
+    return ruleset
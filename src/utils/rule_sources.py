@@ -0,0 +1,101 @@
+"""外部规则列表解析
+
+支持的格式：
+    hosts    hosts 文件（"0.0.0.0 example.com"），每个域名精确匹配
+    adblock  Adblock 风格（"||example.com^"），匹配域名及其子域名
+    domains  每行一个域名，匹配域名及其子域名
+    rules    每行一条规则字符串，写法与 config.yaml 中相同
+"""
+
+import logging
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List
+
+logger = logging.getLogger(__name__)
+
+SOURCE_FORMATS = ("hosts", "adblock", "domains", "rules")
+
+# hosts 文件中需要忽略的本机条目
+_HOSTS_IGNORED = {
+    "localhost", "localhost.localdomain", "local", "broadcasthost",
+    "ip6-localhost", "ip6-loopback", "ip6-localnet", "ip6-mcastprefix",
+    "ip6-allnodes", "ip6-allrouters", "ip6-allhosts", "0.0.0.0",
+}
+
+
+def _strip_lines(lines: Iterable[str], comment: str = "#") -> Iterator[str]:
+    """去掉注释和空行"""
+    for line in lines:
+        line = line.split(comment, 1)[0].strip()
+        if line:
+            yield line
+
+
+def _domain_specs(domain: str) -> List[str]:
+    """域名及其全部子域名"""
+    domain = domain.lower().rstrip(".")
+    return [f"host:{domain}", f"host:*.{domain}"]
+
+
+def parse_hosts(lines: Iterable[str]) -> Iterator[str]:
+    """解析 hosts 文件"""
+    for line in _strip_lines(lines):
+        parts = line.split()
+        for name in parts[1:]:
+            name = name.lower()
+            if name not in _HOSTS_IGNORED:
+                yield f"host:{name}"
+
+
+def parse_adblock(lines: Iterable[str]) -> Iterator[str]:
+    """解析 Adblock 风格的域名规则，只接受 "||domain^" 形式"""
+    for line in lines:
+        line = line.strip()
+        if not line.startswith("||") or "$" in line:
+            continue
+        domain = line[2:].rstrip("^|")
+        if domain and "/" not in domain and "*" not in domain and "^" not in domain:
+            yield from _domain_specs(domain)
+
+
+def parse_domains(lines: Iterable[str]) -> Iterator[str]:
+    """解析每行一个域名的列表"""
+    for line in _strip_lines(lines):
+        yield from _domain_specs(line.split()[0])
+
+
+def parse_rules(lines: Iterable[str]) -> Iterator[str]:
+    """解析每行一条规则字符串的列表"""
+    return _strip_lines(lines)
+
+
+_PARSERS = {
+    "hosts": parse_hosts,
+    "adblock": parse_adblock,
+    "domains": parse_domains,
+    "rules": parse_rules,
+}
+
+
+def resolve_source_path(source: Dict, base_dir: Path) -> Path:
+    """规则来源文件路径，相对路径以配置文件所在目录为准"""
+    path = Path(source["path"]).expanduser()
+    return path if path.is_absolute() else base_dir / path
+
+
+def read_source(source: Dict, base_dir: Path) -> List[str]:
+    """读取规则来源文件，返回规则字符串列表；文件无法读取时视为空列表"""
+    path = resolve_source_path(source, base_dir)
+    fmt = source.get("format", "hosts")
+    parser = _PARSERS.get(fmt)
+    if parser is None:
+        raise ValueError(f"Unknown rule source format: {fmt}")
+
+    try:
+        with open(path, "r", encoding="utf-8", errors="replace") as f:
+            specs = list(dict.fromkeys(parser(f)))
+    except OSError as e:
+        logger.warning(f"⚠️ Skipping unreadable rule source {path}: {e}")
+        return []
+    logger.info(f"📥 Loaded {len(specs)} rules from {path} ({fmt})")
+    return specs
@@ -1,8 +1,21 @@
 """规则匹配工具"""
 
 import re
-from typing import List, Pattern
+import time
+from collections import deque
+from collections.abc import Sequence
+from typing import Dict, List, Optional, Pattern, Tuple
 from enum import Enum
+from .histogram import LogHistogram
+
+# 合并正则中单个分块的最大规则数，编译失败时会继续对半拆分
+MAX_REGEX_CHUNK = 200
+# 可用作预筛选的最短必需字面量
+MIN_PREFILTER_LITERAL = 3
+# 规则排序键中优先级的权重，保证同一优先级内按添加顺序排列
+_RANK_STRIDE = 1 << 40
+# 每 N 次匹配调用采样一次耗时
+TIMING_SAMPLE_EVERY = 64
 
 
 class RuleType(Enum):
@@ -11,6 +24,7 @@ class RuleType(Enum):
     CONTAINS = "contains"  # 包含匹配
     REGEX = "regex"        # 正则匹配
     WILDCARD = "wildcard"  # 通配符匹配
+    HOST = "host"          # 主机名匹配（支持 *.suffix）
 
 
 class Rule:
@@ -19,9 +33,19 @@ class Rule:
     def __init__(self, pattern: str, rule_type: RuleType = RuleType.CONTAINS):
         self.pattern = pattern
         self.rule_type = rule_type
+        self.rule_id: Optional[str] = None
         self._compiled_pattern: Pattern = None
 
-        if rule_type == RuleType.REGEX:
+        # 命中统计
+        self.hits = 0
+        self.last_hit: Optional[float] = None
+        # 采样到的正则执行耗时（仅 REGEX/WILDCARD）
+        self.evals = 0
+        self.cost_ns = 0
+
+        if rule_type == RuleType.HOST:
+            self.pattern = normalize_host(pattern)
+        elif rule_type == RuleType.REGEX:
             self._compiled_pattern = re.compile(pattern)
         elif rule_type == RuleType.WILDCARD:
             # 转换通配符为正则表达式
@@ -36,40 +60,755 @@ class Rule:
             return self.pattern in text
         elif self.rule_type in (RuleType.REGEX, RuleType.WILDCARD):
             return bool(self._compiled_pattern.search(text))
+        elif self.rule_type == RuleType.HOST:
+            host = normalize_host(text)
+            if self.pattern.startswith("*."):
+                return host.endswith(self.pattern[1:])
+            if self.pattern == "*":
+                return bool(host)
+            return host == self.pattern
         return False
 
+    def record_hit(self, now: Optional[float] = None):
+        """记录一次命中"""
+        self.hits += 1
+        self.last_hit = now if now is not None else time.time()
+
+    def stats(self) -> Dict:
+        """规则统计"""
+        data = {
+            "id": self.rule_id,
+            "pattern": self.pattern,
+            "type": self.rule_type.value,
+            "hits": self.hits,
+            "last_hit": self.last_hit,
+        }
+        if self.evals:
+            data["sampled_evals"] = self.evals
+            data["avg_cost_ns"] = self.cost_ns / self.evals
+        return data
+
+    @property
+    def regex(self) -> Optional[Pattern]:
+        """REGEX/WILDCARD 规则编译后的正则"""
+        return self._compiled_pattern
+
     def __repr__(self):
         return f"Rule(pattern={self.pattern}, type={self.rule_type.value})"
 
 
-class RuleMatcher:
-    """规则匹配器"""
+def normalize_host(host: str) -> str:
+    """主机名归一化：小写并去掉末尾的点"""
+    return host.lower().rstrip(".")
+
+
+def parse_rule_spec(spec: str) -> Tuple[str, RuleType]:
+    """解析配置中的规则字符串
+
+    支持 "类型:模式" 前缀写法，例如 "host:*.sentry.io"、"regex:^https://.*"，
+    未带已知类型前缀时按 CONTAINS 处理。
+    """
+    prefix, sep, rest = spec.partition(":")
+    if sep:
+        try:
+            return rest, RuleType(prefix.strip().lower())
+        except ValueError:
+            pass
+    return spec, RuleType.CONTAINS
+
+
+class HostTrie:
+    """按反转 DNS 标签组织的域名后缀树
+
+    "api.warp.dev" 存为 dev -> warp -> api，查询沿主机名标签逐级下行，
+    耗时只与标签数有关。"*.warp.dev" 匹配所有子域名但不含 warp.dev 本身，
+    单独的 "*" 匹配任意主机。
+
+    节点以反转后的标签路径（如 "dev.warp.api"）为键存放在同一张字典中，
+    每个节点是 (精确匹配标识, 子域名匹配标识) 二元组；结构扁平，
+    序列化和反序列化都很快。
+    """
+
+    __slots__ = ("_nodes", "_count")
+
+    def __init__(self):
+        self._nodes: Dict[str, Tuple[Tuple[int, ...], Tuple[int, ...]]] = {"": _EMPTY_HOST_NODE}
+        self._count = 0
+
+    def add(self, pattern: str, value: int):
+        """添加主机名模式"""
+        labels = normalize_host(pattern).split(".")
+        wildcard = labels[0] == "*"
+        if wildcard:
+            labels = labels[1:]
+        nodes = self._nodes
+        key = ""
+        for label in reversed(labels):
+            key = f"{key}.{label}" if key else label
+            if key not in nodes:
+                nodes[key] = _EMPTY_HOST_NODE
+        exact, subdomains = nodes[key]
+        if wildcard:
+            nodes[key] = (exact, subdomains + (value,))
+        else:
+            nodes[key] = (exact + (value,), subdomains)
+        self._count += 1
+
+    def iter_matches(self, host: str):
+        """产出命中的标识，由顶级域向下依次给出"""
+        host = normalize_host(host)
+        if not host:
+            return
+        nodes = self._nodes
+        node = nodes[""]
+        key = ""
+        for label in reversed(host.split(".")):
+            if node[1]:
+                yield from node[1]
+            key = f"{key}.{label}" if key else label
+            node = nodes.get(key)
+            if node is None:
+                return
+        if node[0]:
+            yield from node[0]
+
+    def clear(self):
+        """清空后缀树"""
+        self._nodes = {"": _EMPTY_HOST_NODE}
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+
+_EMPTY_HOST_NODE: Tuple[Tuple[int, ...], Tuple[int, ...]] = ((), ())
+
+
+def required_literal(regex: Pattern) -> str:
+    """提取正则任意匹配中都必然出现的最长字面量，无法确定时返回空串
+
+    只分析最外层的顺序结构：遇到顶层分支直接放弃，分组、字符类和
+    转义类视为断点，可选量词会去掉其前面的字符。结果偏保守，但保证
+    "不含该字面量的文本一定不会匹配"。
+    """
+    if regex.flags & (re.IGNORECASE | re.VERBOSE):
+        return ""
+
+    source = regex.pattern
+    best = ""
+    run: List[str] = []
+    last_literal = False
+    depth = 0
+    i, n = 0, len(source)
+
+    def cut():
+        nonlocal best, run, last_literal
+        if len(run) > len(best):
+            best = "".join(run)
+        run = []
+        last_literal = False
+
+    while i < n:
+        ch = source[i]
+        if depth:
+            if ch == "\\":
+                i = _skip_escape(source, i)
+                continue
+            if ch == "[":
+                i = _skip_class(source, i)
+                continue
+            if ch == "(":
+                depth += 1
+            elif ch == ")":
+                depth -= 1
+            i += 1
+            continue
+
+        if ch == "|":
+            return ""
+        if ch == "\\" and i + 1 < n:
+            nxt = source[i + 1]
+            if nxt.isalnum():
+                # \x2f、\101、\N{...} 等转义带有操作数，整体视为断点
+                cut()
+                i = _skip_escape(source, i)
+            else:
+                run.append(nxt)
+                last_literal = True
+                i += 2
+            continue
+        if ch in "*?{":
+            if last_literal:
+                run.pop()
+            cut()
+            if ch == "{":
+                close = source.find("}", i)
+                i = close + 1 if close != -1 else n
+            else:
+                i += 1
+            continue
+        if ch == "+":
+            cut()
+            i += 1
+            continue
+        if ch == "(":
+            cut()
+            depth += 1
+            i += 1
+            continue
+        if ch == "[":
+            cut()
+            i = _skip_class(source, i)
+            continue
+        if ch in ".^$)":
+            cut()
+            i += 1
+            continue
+        run.append(ch)
+        last_literal = True
+        i += 1
+
+    cut()
+    return best if len(best) >= MIN_PREFILTER_LITERAL else ""
+
+
+def _skip_escape(source: str, i: int) -> int:
+    """跳过从 i 开始的转义序列及其操作数（\\x2f、\\N{...}、\\101 等），返回其后的位置"""
+    nxt = source[i + 1:i + 2]
+    if nxt == "x":
+        return i + 4
+    if nxt == "u":
+        return i + 6
+    if nxt == "U":
+        return i + 10
+    if nxt == "N" and source.startswith("{", i + 2):
+        close = source.find("}", i)
+        return close + 1 if close != -1 else len(source)
+    if nxt == "0":
+        j = i + 2
+        while j < i + 4 and source[j:j + 1] in _OCTDIGITS:
+            j += 1
+        return j
+    if nxt in _DIGITS:
+        # 与 re 一致：三位八进制数字是八进制转义，否则是一到两位的分组引用
+        if len(source[i + 1:i + 4]) == 3 and all(c in _OCTDIGITS for c in source[i + 1:i + 4]):
+            return i + 4
+        return i + 3 if source[i + 2:i + 3] in _DIGITS else i + 2
+    return i + 2
+
+
+_DIGITS = frozenset("0123456789")
+_OCTDIGITS = frozenset("01234567")
+
+
+def _skip_class(source: str, i: int) -> int:
+    """跳过从 i 开始的字符类 [...]，返回其后的位置"""
+    i += 1
+    if i < len(source) and source[i] == "^":
+        i += 1
+    if i < len(source) and source[i] == "]":
+        i += 1
+    while i < len(source) and source[i] != "]":
+        i += 2 if source[i] == "\\" else 1
+    return i + 1
+
+
+# 合并后会改变语义的正则写法：数字反向引用、命名反向引用、条件分组
+_UNCOMBINABLE = re.compile(r"(?<!\\)(?:\\\\)*\\[1-9]|\(\?P=|\(\?\(")
+
+
+class _RegexChunk:
+    """一段合并后的正则分支
+
+    每条规则编译为 (?:原正则)(?P<_rN>)，空命名组放在分支末尾，
+    既能用 lastgroup 识别命中的规则，又不会让 sre 在回溯时保存大量分组标记。
+    """
+
+    __slots__ = ("program", "indices")
+
+    def __init__(self, program: Pattern, indices: List[int]):
+        self.program = program
+        self.indices = indices
+
+    def search(self, text: str) -> Optional[int]:
+        """命中时返回对应的规则下标"""
+        m = self.program.search(text)
+        if m is None:
+            return None
+        return int(m.lastgroup[2:])
+
+
+def _compile_chunks(rules: "RuleList", indices: List[int]) -> Tuple[List[_RegexChunk], List[int]]:
+    """把规则合并编译成若干分块，返回 (分块列表, 无法合并的规则下标)"""
+    chunks: List[_RegexChunk] = []
+    fallback: List[int] = []
+    pending = [indices[i:i + MAX_REGEX_CHUNK] for i in range(0, len(indices), MAX_REGEX_CHUNK)]
+    pending.reverse()
+    while pending:
+        group = pending.pop()
+        source = "|".join(f"(?:{rules[i].regex.pattern})(?P<_r{i}>)" for i in group)
+        try:
+            chunks.append(_RegexChunk(re.compile(source), group))
+        except (re.error, OverflowError, RecursionError, AssertionError):
+            if len(group) == 1:
+                fallback.extend(group)
+            else:
+                half = len(group) // 2
+                pending.append(group[half:])
+                pending.append(group[:half])
+    return chunks, fallback
+
+
+class AhoCorasick:
+    """Aho-Corasick 多模式匹配自动机
+
+    所有模式共享一棵字典树，一次扫描文本即可找出全部命中的模式。
+    新增模式只扩展字典树并标记失效，失败指针在下一次查询时统一重建，
+    因此批量添加只触发一次重建。
+    """
+
+    def __init__(self):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._own: List[List[int]] = [[]]
+        self._out: List[Tuple[int, ...]] = [()]
+        self._dirty = False
+        self._count = 0
+
+    def add(self, pattern: str, value: int):
+        """添加模式，value 为命中时返回的标识"""
+        goto = self._goto
+        node = 0
+        for ch in pattern:
+            nxt = goto[node].get(ch)
+            if nxt is None:
+                nxt = len(goto)
+                goto.append({})
+                self._fail.append(0)
+                self._own.append([])
+                self._out.append(())
+                goto[node][ch] = nxt
+            node = nxt
+        self._own[node].append(value)
+        self._count += 1
+        self._dirty = True
+
+    def _build(self):
+        """按层序重建失败指针和输出集合"""
+        goto, fail, own, out = self._goto, self._fail, self._own, self._out
+        out[0] = tuple(own[0])
+        queue = deque()
+        for child in goto[0].values():
+            fail[child] = 0
+            queue.append(child)
+        while queue:
+            node = queue.popleft()
+            out[node] = tuple(own[node]) + out[fail[node]]
+            for ch, child in goto[node].items():
+                state = fail[node]
+                while state and ch not in goto[state]:
+                    state = fail[state]
+                target = goto[state].get(ch, 0)
+                fail[child] = target if target != child else 0
+                queue.append(child)
+        self._dirty = False
+
+    def iter_matches(self, text: str):
+        """逐个产出命中的标识（按命中位置先后，同一标识可能重复出现）"""
+        if self._dirty:
+            self._build()
+        goto, fail, out = self._goto, self._fail, self._out
+        yield from out[0]
+        node = 0
+        for ch in text:
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            if out[node]:
+                yield from out[node]
+
+    def search_any(self, text: str) -> bool:
+        """是否命中任一模式"""
+        for _ in self.iter_matches(text):
+            return True
+        return False
+
+    def search_all(self, text: str) -> List[int]:
+        """返回全部命中的标识（去重，升序）"""
+        return sorted(set(self.iter_matches(text)))
+
+    def search_first(self, text: str) -> Optional[int]:
+        """返回命中标识中最小的一个"""
+        best = None
+        for value in self.iter_matches(text):
+            if best is None or value < best:
+                best = value
+                if best == 0:
+                    break
+        return best
+
+    def clear(self):
+        """清空自动机"""
+        self._goto = [{}]
+        self._fail = [0]
+        self._own = [[]]
+        self._out = [()]
+        self._dirty = False
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+
+class RuleList(Sequence):
+    """规则列表
+
+    只保存模式、类型和规则 ID，Rule 对象在首次被访问时才创建并缓存。
+    十万级的规则列表绝大多数规则从不命中，这样既省内存，也让编译好的
+    匹配器能以扁平列表的形式快速序列化。
+    """
 
     def __init__(self):
-        self.rules: List[Rule] = []
+        self._patterns: List[str] = []
+        self._types: List[RuleType] = []
+        self._ids: List[Optional[str]] = []
+        self._objects: Dict[int, Rule] = {}
+
+    def append(
+        self,
+        pattern: str,
+        rule_type: RuleType,
+        rule_id: Optional[str] = None,
+        rule: Optional[Rule] = None,
+    ) -> int:
+        """追加规则定义，返回下标；已创建的 Rule 可一并传入"""
+        index = len(self._patterns)
+        self._patterns.append(pattern)
+        self._types.append(rule_type)
+        self._ids.append(rule_id)
+        if rule is not None:
+            self._objects[index] = rule
+        return index
+
+    def pattern(self, index: int) -> str:
+        """规则模式（不创建 Rule 对象）"""
+        return self._patterns[index]
+
+    def rule_type(self, index: int) -> RuleType:
+        """规则类型（不创建 Rule 对象）"""
+        return self._types[index]
+
+    def peek(self, index: int) -> Optional[Rule]:
+        """已创建的 Rule 对象，尚未创建时返回 None"""
+        return self._objects.get(index)
+
+    def rule_id(self, index: int) -> Optional[str]:
+        """规则 ID（不创建 Rule 对象）"""
+        return self._ids[index]
 
-    def add_rule(self, pattern: str, rule_type: RuleType = RuleType.CONTAINS):
-        """添加规则"""
-        rule = Rule(pattern, rule_type)
-        self.rules.append(rule)
+    def created(self) -> List[Rule]:
+        """已经创建过的 Rule 对象"""
+        return list(self._objects.values())
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self._patterns)))]
+        if index < 0:
+            index += len(self._patterns)
+        rule = self._objects.get(index)
+        if rule is None:
+            rule = Rule(self._patterns[index], self._types[index])
+            rule.rule_id = self._ids[index]
+            self._objects[index] = rule
         return rule
 
-    def add_rules(self, patterns: List[str], rule_type: RuleType = RuleType.CONTAINS):
+    def __len__(self):
+        return len(self._patterns)
+
+    def clear(self):
+        """清空规则"""
+        self._patterns.clear()
+        self._types.clear()
+        self._ids.clear()
+        self._objects.clear()
+
+
+class RuleMatcher:
+    """规则匹配器
+
+    EXACT 规则使用字典查找，CONTAINS 规则编译进 Aho-Corasick 自动机。
+    REGEX/WILDCARD 规则若能提取出必需字面量，就把字面量放进同一个自动机
+    作为预筛选，命中后才执行该条正则；其余正则合并成带命名组的分支程序，
+    一次 search() 同时给出是否命中和命中的规则。
+
+    HOST 规则存放在域名后缀树中，只在调用方传入 host 时参与匹配，
+    且先于所有针对完整 URL 的规则检查。
+    """
+
+    def __init__(self):
+        self.rules = RuleList()
+        self._hosts = HostTrie()
+        self._exact: Dict[str, List[int]] = {}
+        self._contains = AhoCorasick()
+        self._verify: set = set()
+        self._regex: List[int] = []
+        self._chunks: List[_RegexChunk] = []
+        self._fallback: List[int] = []
+        self._regex_dirty = False
+        self._rank: List[int] = []
+
+        # 采样计时：每 sample_every 次匹配调用记录一次耗时（纳秒）
+        self.sample_every = TIMING_SAMPLE_EVERY
+        self.timing = LogHistogram()
+        self._calls = 0
+        self._sampling = False
+
+    def add_rule(
+        self,
+        pattern: str,
+        rule_type: RuleType = RuleType.CONTAINS,
+        priority: int = 0,
+        rule_id: Optional[str] = None,
+    ) -> Rule:
+        """添加规则，priority 只影响 match_first 的结果"""
+        return self.rules[self.add(pattern, rule_type, priority, rule_id)]
+
+    def add(
+        self,
+        pattern: str,
+        rule_type: RuleType = RuleType.CONTAINS,
+        priority: int = 0,
+        rule_id: Optional[str] = None,
+    ) -> int:
+        """添加规则并返回下标，不创建 Rule 对象（正则规则除外）"""
+        rule = None
+        if rule_type in (RuleType.REGEX, RuleType.WILDCARD):
+            rule = Rule(pattern, rule_type)
+            rule.rule_id = rule_id
+        elif rule_type == RuleType.HOST:
+            pattern = normalize_host(pattern)
+        index = self.rules.append(pattern, rule_type, rule_id, rule)
+        self._rank.append(priority * _RANK_STRIDE + index)
+
+        if rule_type == RuleType.HOST:
+            self._hosts.add(pattern, index)
+        elif rule_type == RuleType.EXACT:
+            self._exact.setdefault(pattern, []).append(index)
+        elif rule_type == RuleType.CONTAINS:
+            self._contains.add(pattern, index)
+        elif rule.regex is not None:
+            literal = required_literal(rule.regex)
+            if literal:
+                self._contains.add(literal, index)
+                self._verify.add(index)
+            elif _UNCOMBINABLE.search(rule.regex.pattern) or rule.regex.flags & ~re.UNICODE:
+                self._fallback.append(index)
+            else:
+                self._regex.append(index)
+            self._regex_dirty = True
+        return index
+
+    def _build_regex(self):
+        """按优先级重新编译合并正则"""
+        key = self._rank.__getitem__
+        self._regex.sort(key=key)
+        self._chunks, failed = _compile_chunks(self.rules, self._regex)
+        if failed:
+            failed_set = set(failed)
+            self._regex = [i for i in self._regex if i not in failed_set]
+            self._fallback.extend(failed)
+        self._fallback.sort(key=key)
+        self._regex_dirty = False
+
+    def compile(self):
+        """立即完成所有延迟构建（自动机失败指针、合并正则）"""
+        if self._contains._dirty:
+            self._contains._build()
+        if self._regex_dirty:
+            self._build_regex()
+
+    def _check(self, index: int, text: str) -> bool:
+        """单独执行一条规则，采样期间记录其耗时"""
+        rule = self.rules[index]
+        if not self._sampling:
+            return rule.match(text)
+        start = time.perf_counter_ns()
+        matched = rule.match(text)
+        rule.cost_ns += time.perf_counter_ns() - start
+        rule.evals += 1
+        return matched
+
+    def _iter_contains(self, text: str):
+        """产出自动机中真正命中的规则下标（预筛选的正则已验证）"""
+        verify = self._verify
+        checked = set()
+        for i in self._contains.iter_matches(text):
+            if i in verify:
+                if i in checked:
+                    continue
+                checked.add(i)
+                if not self._check(i, text):
+                    continue
+            yield i
+
+    def _timed(self, func, text: str, host: Optional[str]):
+        """执行匹配，按采样间隔记录耗时"""
+        self._calls += 1
+        if self._calls % self.sample_every:
+            return func(text, host)
+        self._sampling = True
+        start = time.perf_counter_ns()
+        try:
+            return func(text, host)
+        finally:
+            self.timing.record(time.perf_counter_ns() - start)
+            self._sampling = False
+
+    def add_rules(
+        self, patterns: List[str], rule_type: RuleType = RuleType.CONTAINS, priority: int = 0
+    ):
         """批量添加规则"""
         for pattern in patterns:
-            self.add_rule(pattern, rule_type)
+            self.add(pattern, rule_type, priority)
 
-    def match(self, text: str) -> bool:
+    def add_specs(self, specs: List[str], priority: int = 0):
+        """批量添加带类型前缀的规则字符串（见 parse_rule_spec）"""
+        for spec in specs:
+            self.add(*parse_rule_spec(spec), priority)
+
+    def match(self, text: str, host: Optional[str] = None) -> bool:
         """检查是否匹配任一规则"""
-        return any(rule.match(text) for rule in self.rules)
+        return self._timed(self._match, text, host)
+
+    def match_all(self, text: str, host: Optional[str] = None) -> List[Rule]:
+        """返回所有匹配的规则（按添加顺序），并计入各规则的命中次数"""
+        return self._timed(self._match_all, text, host)
+
+    def match_first(self, text: str, host: Optional[str] = None) -> Optional[Rule]:
+        """返回优先级最高的匹配规则，没有匹配时返回 None
+
+        priority 越小越优先，同一优先级内先添加的规则优先。返回的规则计入命中次数。
+        """
+        return self._timed(self._match_first, text, host)
+
+    def _match(self, text: str, host: Optional[str]) -> bool:
+        if host and self._hosts:
+            for _ in self._hosts.iter_matches(host):
+                return True
+        if text in self._exact:
+            return True
+        for _ in self._iter_contains(text):
+            return True
+        if self._regex_dirty:
+            self._build_regex()
+        for chunk in self._chunks:
+            if chunk.search(text) is not None:
+                return True
+        return any(self._check(i, text) for i in self._fallback)
+
+    def _match_all(self, text: str, host: Optional[str]) -> List[Rule]:
+        hits = set(self._exact.get(text, ()))
+        if host and self._hosts:
+            hits.update(self._hosts.iter_matches(host))
+        hits.update(self._iter_contains(text))
+        if self._regex_dirty:
+            self._build_regex()
+        rules = self.rules
+        for chunk in self._chunks:
+            # 合并程序先整体判断，未命中的分块整段跳过
+            if chunk.search(text) is not None:
+                hits.update(i for i in chunk.indices if self._check(i, text))
+        hits.update(i for i in self._fallback if self._check(i, text))
+        matched = [rules[i] for i in sorted(hits)]
+        now = time.time()
+        for rule in matched:
+            rule.record_hit(now)
+        return matched
+
+    def _match_first(self, text: str, host: Optional[str]) -> Optional[Rule]:
+        rank = self._rank
+        best = None
+        if host and self._hosts:
+            best = min(self._hosts.iter_matches(host), key=rank.__getitem__, default=None)
+        exact = self._exact.get(text)
+        if exact:
+            i = min(exact, key=rank.__getitem__)
+            if best is None or rank[i] < rank[best]:
+                best = i
+        for i in self._iter_contains(text):
+            if best is None or rank[i] < rank[best]:
+                best = i
+        if self._regex_dirty:
+            self._build_regex()
+        rules = self.rules
+        for chunk in self._chunks:
+            if best is not None and rank[chunk.indices[0]] > rank[best]:
+                break
+            hit = chunk.search(text)
+            if hit is None:
+                continue
+            # 合并程序给出的是最左命中，分块内更优先的规则需要单独确认
+            for i in chunk.indices:
+                if rank[i] >= rank[hit] or (best is not None and rank[i] > rank[best]):
+                    break
+                if self._check(i, text):
+                    hit = i
+                    break
+            if best is None or rank[hit] < rank[best]:
+                best = hit
+        for i in self._fallback:
+            if best is not None and rank[i] > rank[best]:
+                break
+            if self._check(i, text):
+                best = i
+                break
+        if best is None:
+            return None
+        rule = rules[best]
+        rule.record_hit()
+        return rule
+
+    def hit_rules(self) -> List[Rule]:
+        """命中过的规则，按命中次数降序"""
+        hit = [rule for rule in self.rules.created() if rule.hits]
+        hit.sort(key=lambda rule: rule.hits, reverse=True)
+        return hit
+
+    def dead_rules(self) -> List[str]:
+        """从未命中的规则（有 ID 时返回 ID，否则返回模式）"""
+        rules = self.rules
+        dead = []
+        for i in range(len(rules)):
+            rule = rules.peek(i)
+            if rule is None or not rule.hits:
+                dead.append(rules.rule_id(i) or rules.pattern(i))
+        return dead
 
-    def match_all(self, text: str) -> List[Rule]:
-        """返回所有匹配的规则"""
-        return [rule for rule in self.rules if rule.match(text)]
+    def stats(self, top: int = 20) -> Dict:
+        """规则命中和匹配耗时统计"""
+        hit = self.hit_rules()
+        return {
+            "total_rules": len(self.rules),
+            "hit_rules": len(hit),
+            "never_hit": len(self.rules) - len(hit),
+            "top_rules": [rule.stats() for rule in hit[:top]],
+            "match_calls": self._calls,
+            "timing_sample_every": self.sample_every,
+            "match_ns": self.timing.summary(),
+        }
 
     def clear(self):
         """清空所有规则"""
         self.rules.clear()
+        self._hosts.clear()
+        self._exact.clear()
+        self._contains.clear()
+        self._verify.clear()
+        self._regex.clear()
+        self._chunks = []
+        self._fallback.clear()
+        self._regex_dirty = False
+        self._rank.clear()
 
     def __len__(self):
         return len(self.rules)
@@ -0,0 +1,169 @@
+"""编译后的请求分类规则集"""
+
+from typing import Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
+from .cache import LRUCache
+from .rule_sources import read_source
+from .rules import AhoCorasick, Rule, RuleMatcher, RuleType, parse_rule_spec
+
+# 请求判定动作，按优先级从高到低排列
+ACTION_BLOCK = "block"
+ACTION_ALLOW = "allow"
+ACTION_LOG_ONLY = "log_only"
+ACTION_PASS = "pass"
+
+ACTIONS = (ACTION_BLOCK, ACTION_ALLOW, ACTION_LOG_ONLY)
+_PRIORITY = {action: priority for priority, action in enumerate(ACTIONS)}
+
+
+class Verdict(NamedTuple):
+    """请求判定结果"""
+    action: str
+    rule_id: Optional[str] = None
+    stream: bool = False
+
+
+PASS = Verdict(ACTION_PASS)
+PASS_STREAM = Verdict(ACTION_PASS, stream=True)
+
+# flow.metadata 中判定结果的键
+VERDICT_KEY = "warpgateway.verdict"
+
+
+def store_verdict(metadata: Dict, verdict: Verdict):
+    """以普通字典写入 flow.metadata，保证 flow 可以序列化（mitmdump -w）"""
+    metadata[VERDICT_KEY] = verdict._asdict()
+
+
+def flow_verdict(metadata: Dict) -> Optional[Verdict]:
+    """读取 flow.metadata 中的判定结果，没有时返回 None"""
+    value = metadata.get(VERDICT_KEY)
+    if value is None:
+        return None
+    if isinstance(value, dict):
+        return Verdict(**value)
+    # 旧版本保存的 flow 中是序列化后的列表
+    return Verdict(*value)
+
+
+class RuleSet:
+    """请求分类规则集
+
+    block/allow/log_only 规则放在同一个 RuleMatcher 中并以动作作为优先级，
+    一次 match_first() 即可得到优先级最高的命中规则；流式路径单独编译成
+    自动机。判定结果按 (host, 完整 URL) 缓存；查询参数和路径一样参与
+    所有规则的匹配。
+
+    不依赖 mitmproxy，可以直接在脚本或基准测试中使用。
+    """
+
+    def __init__(self, streaming_paths: Iterable[str] = (), cache_size: int = 4096):
+        self.matcher = RuleMatcher()
+        self.streaming_paths = tuple(streaming_paths)
+        self.cache = LRUCache(cache_size)
+        self._stream = AhoCorasick()
+        for i, path in enumerate(self.streaming_paths):
+            self._stream.add(path, i)
+        self._counts: Dict[str, int] = {action: 0 for action in ACTIONS}
+
+    @classmethod
+    def from_config(cls, config) -> "RuleSet":
+        """根据 Config 构建规则集"""
+        ruleset = cls(config.streaming_paths, config.verdict_cache_size)
+        ruleset.add_specs(ACTION_BLOCK, config.block_rules)
+        ruleset.add_specs(ACTION_ALLOW, config.allow_rules)
+        ruleset.add_specs(ACTION_LOG_ONLY, config.log_only_rules)
+        for source in config.rule_sources:
+            specs = read_source(source, config.config_dir)
+            ruleset.add_specs(source.get("action", ACTION_BLOCK), specs)
+        return ruleset
+
+    def add_rule(
+        self, action: str, pattern: str, rule_type: RuleType = RuleType.CONTAINS
+    ) -> Rule:
+        """添加规则"""
+        return self.matcher.rules[self._add(action, pattern, rule_type)]
+
+    def _add(self, action: str, pattern: str, rule_type: RuleType) -> int:
+        index = self.matcher.add(
+            pattern, rule_type, _PRIORITY[action], f"{action}:{self._counts[action]}"
+        )
+        self._counts[action] += 1
+        self.cache.clear()
+        return index
+
+    def add_specs(self, action: str, specs: Iterable[str]):
+        """批量添加带类型前缀的规则字符串"""
+        for spec in specs:
+            self._add(action, *parse_rule_spec(spec))
+
+    def compile(self) -> "RuleSet":
+        """完成所有延迟构建，避免首个请求承担编译开销"""
+        self.matcher.compile()
+        self._stream.search_any("")
+        return self
+
+    def classify(self, url: str, host: Optional[str] = None) -> Verdict:
+        """对请求分类，url 为包含查询参数的完整 URL"""
+        key = (host, url)
+        cached = self.cache.get(key)
+        if cached is None:
+            cached = self._classify(url, host)
+            self.cache.put(key, cached)
+        else:
+            # 缓存命中同样计入规则命中次数
+            rule = cached[1]
+            if rule is not None:
+                rule.record_hit()
+        return cached[0]
+
+    def _classify(self, url: str, host: Optional[str]) -> Tuple[Verdict, Optional[Rule]]:
+        """不经缓存的分类，返回 (判定结果, 命中的规则)"""
+        rule = self.matcher.match_first(url, host)
+        action = rule.rule_id.partition(":")[0] if rule is not None else ACTION_PASS
+        if action == ACTION_BLOCK:
+            return Verdict(ACTION_BLOCK, rule.rule_id), rule
+
+        stream = False
+        if self.streaming_paths:
+            path = url.split("://", 1)[-1]
+            path = path[path.find("/"):] if "/" in path else "/"
+            stream = self._stream.search_any(path)
+
+        if rule is None:
+            return (PASS_STREAM if stream else PASS), None
+        return Verdict(action, rule.rule_id, stream), rule
+
+    def count(self, action: str) -> int:
+        """某一动作下的规则数"""
+        return self._counts[action]
+
+    def cache_stats(self) -> dict:
+        """判定缓存统计"""
+        return self.cache.stats()
+
+    def stats(self, top: int = 20) -> Dict:
+        """规则数量、命中、匹配耗时和缓存统计"""
+        return {
+            "counts": dict(self._counts),
+            **self.matcher.stats(top),
+            "cache": self.cache.stats(),
+        }
+
+    def specs(self) -> Set[str]:
+        """全部规则的 "动作 类型:模式" 形式，用于比较两个规则集的差异"""
+        rules = self.matcher.rules
+        return {
+            f"{rules.rule_id(i).partition(':')[0]} {rules.rule_type(i).value}:{rules.pattern(i)}"
+            for i in range(len(rules))
+        }
+
+    def dead_rules(self) -> List[str]:
+        """从未命中的规则 ID"""
+        return self.matcher.dead_rules()
+
+    def __len__(self):
+        return len(self.matcher)
+
+    def __repr__(self):
+        counts = ", ".join(f"{action}={n}" for action, n in self._counts.items())
+        return f"RuleSet({counts})"
@@ -0,0 +1,123 @@
+"""统计快照的原子写入与恢复"""
+
+import json
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# 快照格式版本，结构不兼容时递增，旧快照在恢复时被忽略
+SNAPSHOT_VERSION = 1
+
+
+def write_snapshot(path: Path, data: Dict):
+    """先写临时文件并 fsync，再改名覆盖，崩溃时旧快照保持完整"""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    payload = json.dumps({"version": SNAPSHOT_VERSION, "saved_at": time.time(), "stats": data}, ensure_ascii=False)
+    tmp = path.with_name(path.name + ".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(payload)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def load_snapshot(path: Path) -> Optional[Dict]:
+    """读取快照中的统计数据，文件不存在、损坏或版本不符时返回 None"""
+    path = Path(path)
+    if not path.exists():
+        return None
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            snapshot = json.load(f)
+    except (OSError, ValueError) as e:
+        logger.warning(f"⚠️ Ignoring unreadable stats snapshot {path}: {e}")
+        return None
+    if not isinstance(snapshot, dict) or snapshot.get("version") != SNAPSHOT_VERSION:
+        logger.warning(f"⚠️ Ignoring stats snapshot {path}: unsupported version")
+        return None
+    return snapshot.get("stats")
+
+
+class StatsSnapshotter:
+    """后台线程定期写出统计快照
+
+    序列化由调用方在事件循环中完成（统计结构只在那里修改，无需加锁），
+    submit() 只登记最新的数据并唤醒写线程；来不及写出的旧数据直接被
+    新数据覆盖。due() 判断是否到了下一次保存的时间。
+    """
+
+    def __init__(self, path: Path, interval: float = 300.0):
+        self.path = Path(path)
+        self.interval = interval
+        self.saved = 0
+        self.failed = 0
+        self.last_saved: Optional[float] = None
+        self._next = time.monotonic() + interval
+        self._pending: Optional[Dict] = None
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def due(self) -> bool:
+        return time.monotonic() >= self._next
+
+    def submit(self, data: Dict):
+        """登记一份待写出的快照"""
+        self._next = time.monotonic() + self.interval
+        with self._lock:
+            self._pending = data
+        self._wake.set()
+
+    def _flush(self):
+        with self._lock:
+            data, self._pending = self._pending, None
+        if data is None:
+            return
+        try:
+            write_snapshot(self.path, data)
+            self.saved += 1
+            self.last_saved = time.time()
+        except Exception as e:
+            self.failed += 1
+            logger.error(f"❌ Failed to save stats snapshot to {self.path}: {e}")
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait()
+            self._wake.clear()
+            self._flush()
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="stats-snapshot", daemon=True)
+        self._thread.start()
+
+    def close(self, data: Optional[Dict] = None):
+        """停止写线程，并在当前线程写出最后一份快照"""
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(5)
+            self._thread = None
+        if data is not None:
+            with self._lock:
+                self._pending = data
+        self._flush()
+
+    def stats(self) -> Dict:
+        return {
+            "path": str(self.path),
+            "interval": self.interval,
+            "saved": self.saved,
+            "failed": self.failed,
+            "last_saved": self.last_saved,
+        }
@@ -0,0 +1,132 @@
+"""Space-Saving 频繁项统计"""
+
+import heapq
+from typing import Dict, Hashable, List, Tuple
+
+
+class SpaceSaving:
+    """容量固定的 Top-K 计数（Space-Saving 算法）
+
+    最多跟踪 capacity 个键。新键在表满时顶替计数最小的键，并继承其计数
+    作为误差上界，所以 count - error <= 真实计数 <= count；出现次数超过
+    总数 1/capacity 的键一定在表中。两个摘要可以合并（Agarwal 等人的
+    可合并摘要），合并后的误差界仍然成立，适合分片统计后汇总。
+
+    找最小计数用惰性最小堆：每个键在堆中恰有一项，计数增加时不更新堆，
+    弹出时发现过期再按当前计数放回，摊还代价为 O(log capacity)。
+    """
+
+    __slots__ = ("capacity", "counts", "errors", "total", "_heap", "_seq")
+
+    def __init__(self, capacity: int = 1000):
+        self.capacity = capacity
+        self.counts: Dict[Hashable, int] = {}
+        self.errors: Dict[Hashable, int] = {}
+        self.total = 0
+        # 堆项为 (计数, 序号, 键)，序号避免比较键本身
+        self._heap: List[Tuple[int, int, Hashable]] = []
+        self._seq = 0
+
+    def _push(self, n: int, key: Hashable):
+        self._seq += 1
+        heapq.heappush(self._heap, (n, self._seq, key))
+
+    def _rebuild(self):
+        self._heap = [(n, i, key) for i, (key, n) in enumerate(self.counts.items())]
+        self._seq = len(self._heap)
+        heapq.heapify(self._heap)
+
+    def _pop_min(self) -> Hashable:
+        """弹出当前计数最小的键"""
+        heap = self._heap
+        counts = self.counts
+        while True:
+            n, _, key = heapq.heappop(heap)
+            current = counts[key]
+            if current == n:
+                return key
+            self._push(current, key)
+
+    def add(self, key: Hashable, count: int = 1):
+        """计数一次出现"""
+        self.total += count
+        counts = self.counts
+        if key in counts:
+            counts[key] += count
+            return
+        if len(counts) < self.capacity:
+            counts[key] = count
+            self.errors[key] = 0
+            self._push(count, key)
+            return
+        # 顶替计数最小的键
+        victim = self._pop_min()
+        floor = counts.pop(victim)
+        del self.errors[victim]
+        counts[key] = floor + count
+        self.errors[key] = floor
+        self._push(floor + count, key)
+
+    def _floor(self) -> int:
+        """表满时未被跟踪的键可能达到的最大计数"""
+        if len(self.counts) < self.capacity:
+            return 0
+        return min(self.counts.values())
+
+    def merge(self, other: "SpaceSaving"):
+        """合并另一个摘要"""
+        floor_self = self._floor()
+        floor_other = other._floor()
+        counts: Dict[Hashable, int] = {}
+        errors: Dict[Hashable, int] = {}
+        for key in self.counts.keys() | other.counts.keys():
+            if key in self.counts:
+                count, error = self.counts[key], self.errors[key]
+            else:
+                count, error = floor_self, floor_self
+            if key in other.counts:
+                count += other.counts[key]
+                error += other.errors[key]
+            else:
+                count += floor_other
+                error += floor_other
+            counts[key] = count
+            errors[key] = error
+        if len(counts) > self.capacity:
+            keep = sorted(counts, key=counts.__getitem__, reverse=True)[: self.capacity]
+            counts = {key: counts[key] for key in keep}
+            errors = {key: errors[key] for key in keep}
+        self.counts = counts
+        self.errors = errors
+        self.total += other.total
+        self._rebuild()
+
+    def top(self, n: int = 10) -> List[Tuple[Hashable, int, int]]:
+        """计数最大的 n 个键：(键, 计数, 误差上界)"""
+        keys = sorted(self.counts, key=self.counts.__getitem__, reverse=True)[:n]
+        return [(key, self.counts[key], self.errors[key]) for key in keys]
+
+    def to_dict(self) -> Dict:
+        """序列化为可 JSON 化的字典（键转为字符串）"""
+        return {
+            "capacity": self.capacity,
+            "total": self.total,
+            "counts": {str(k): [v, self.errors[k]] for k, v in self.counts.items()},
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "SpaceSaving":
+        """从 to_dict() 的结果恢复"""
+        summary = cls(data.get("capacity", 1000))
+        summary.total = data.get("total", 0)
+        for key, (count, error) in data.get("counts", {}).items():
+            summary.counts[key] = count
+            summary.errors[key] = error
+        summary._rebuild()
+        return summary
+
+    def __len__(self):
+        return len(self.counts)
+
+    def __repr__(self):
+        return f"SpaceSaving(capacity={self.capacity}, tracked={len(self.counts)}, total={self.total})"
@@ -0,0 +1,194 @@
+"""上游代理池与健康检查"""
+
+import logging
+import socket
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+logger = logging.getLogger(__name__)
+
+_DEFAULT_PORTS = {"http": 80, "https": 443}
+
+
+def parse_upstream(upstream: str) -> Tuple[str, Tuple[str, int]]:
+    """解析上游代理地址，返回 (scheme, (host, port))，缺省 scheme 为 http"""
+    if "://" not in upstream:
+        upstream = f"http://{upstream}"
+    parts = urlsplit(upstream)
+    if not parts.hostname:
+        raise ValueError(f"Invalid upstream: {upstream}")
+    port = parts.port or _DEFAULT_PORTS.get(parts.scheme)
+    if port is None:
+        raise ValueError(f"Port specification missing: {upstream}")
+    return parts.scheme, (parts.hostname, port)
+
+
+class UpstreamMember:
+    """单个上游代理的健康状态
+
+    延迟用 EWMA 平滑，来源包括主动探测和实际请求建立连接的耗时。
+    一次连接失败即标记为不健康，直到下一次探测或请求成功。
+    """
+
+    __slots__ = (
+        "upstream", "scheme", "address", "alpha", "healthy", "ewma",
+        "failures", "requests", "errors", "last_error", "last_check", "last_failure",
+    )
+
+    def __init__(self, upstream: str, alpha: float = 0.3):
+        self.upstream = upstream
+        self.scheme, self.address = parse_upstream(upstream)
+        self.alpha = alpha
+        self.healthy = True
+        self.ewma: Optional[float] = None
+        self.failures = 0
+        self.requests = 0
+        self.errors = 0
+        self.last_error = ""
+        self.last_check = 0.0
+        self.last_failure = 0.0
+
+    def record_success(self, latency: float):
+        """记录一次成功及其耗时（秒）"""
+        if self.ewma is None:
+            self.ewma = latency
+        else:
+            self.ewma += self.alpha * (latency - self.ewma)
+        if not self.healthy:
+            logger.info(f"💚 Upstream {self.upstream} is healthy again")
+        self.healthy = True
+        self.failures = 0
+        self.last_check = time.time()
+
+    def record_failure(self, error: str):
+        """记录一次失败，立即标记为不健康"""
+        if self.healthy:
+            logger.warning(f"💔 Upstream {self.upstream} marked unhealthy: {error}")
+        self.healthy = False
+        self.failures += 1
+        self.errors += 1
+        self.last_error = error
+        self.last_failure = self.last_check = time.time()
+
+    def copy_state(self, other: "UpstreamMember"):
+        """沿用另一份配置中同一上游的健康状态和延迟"""
+        for name in ("healthy", "ewma", "failures", "requests", "errors", "last_error", "last_check", "last_failure"):
+            setattr(self, name, getattr(other, name))
+
+    def stats(self) -> Dict:
+        """状态快照"""
+        return {
+            "upstream": self.upstream,
+            "healthy": self.healthy,
+            "latency_ms": round(self.ewma * 1000, 2) if self.ewma is not None else None,
+            "requests": self.requests,
+            "errors": self.errors,
+            "consecutive_failures": self.failures,
+            "last_error": self.last_error,
+        }
+
+    def __repr__(self):
+        return f"UpstreamMember({self.upstream}, healthy={self.healthy}, ewma={self.ewma})"
+
+
+class UpstreamPool:
+    """一条路由对应的上游代理池
+
+    select() 选出健康成员中 EWMA 延迟最低的一个；尚未测得延迟的成员
+    视为 0，会被优先尝试。全部成员不健康时退回到最早失败的那个，
+    避免路由彻底不可用。
+    """
+
+    __slots__ = ("members",)
+
+    def __init__(self, members: List[UpstreamMember]):
+        self.members = members
+
+    def select(self) -> Optional[UpstreamMember]:
+        """选择新请求使用的上游"""
+        best = None
+        for member in self.members:
+            if member.healthy and (best is None or (member.ewma or 0.0) < (best.ewma or 0.0)):
+                best = member
+        if best is None and self.members:
+            best = min(self.members, key=lambda m: m.last_failure)
+        return best
+
+    def stats(self) -> List[Dict]:
+        return [member.stats() for member in self.members]
+
+    def __len__(self):
+        return len(self.members)
+
+    def __repr__(self):
+        return f"UpstreamPool({[m.upstream for m in self.members]})"
+
+
+def probe_upstream(member: UpstreamMember, timeout: float = 2.0, target: str = "") -> None:
+    """探测上游代理并更新其状态
+
+    建立 TCP 连接；指定 target（"host:port"）时再发送一次 CONNECT，
+    要求在超时内收到 2xx 响应，这样连得上但已卡死的代理也能被发现。
+    """
+    start = time.perf_counter()
+    try:
+        with socket.create_connection(member.address, timeout=timeout) as sock:
+            if target:
+                sock.sendall(f"CONNECT {target} HTTP/1.1\r\nHost: {target}\r\n\r\n".encode())
+                status = sock.recv(64)
+                if not status.startswith(b"HTTP/") or status[9:10] != b"2":
+                    line = status.split(b"\r\n", 1)[0].decode("latin-1")
+                    raise OSError(f"CONNECT failed: {line or 'connection closed'}")
+    except OSError as e:
+        member.record_failure(str(e) or e.__class__.__name__)
+        return
+    member.record_success(time.perf_counter() - start)
+
+
+class UpstreamHealthChecker:
+    """后台线程定期探测所有上游代理"""
+
+    def __init__(
+        self,
+        members: Callable[[], Iterable[UpstreamMember]],
+        interval: float = 10.0,
+        timeout: float = 2.0,
+        target: str = "",
+    ):
+        self.members = members
+        self.interval = interval
+        self.timeout = timeout
+        self.target = target
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def check(self):
+        """探测一轮"""
+        for member in list(self.members()):
+            probe_upstream(member, self.timeout, self.target)
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.check()
+            except Exception as e:
+                logger.error(f"❌ Upstream health check failed: {e}")
+            self._stop.wait(self.interval)
+
+    def start(self):
+        """启动后台探测"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="upstream-health", daemon=True)
+        self._thread.start()
+        logger.info(f"🩺 Upstream health checks every {self.interval}s")
+
+    def stop(self):
+        """停止后台探测"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(self.timeout + 1)
+            self._thread = None
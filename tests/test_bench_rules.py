@@ -0,0 +1,49 @@
+"""基准对比的退化判定测试"""
+
+import json
+
+import pytest
+
+from benchmarks import bench_rules
+
+
+def result(bench, size, ops_per_sec, p99_ns):
+    return {"bench": bench, "rule_type": "mixed", "size": size, "ops_per_sec": ops_per_sec, "p99_ns": p99_ns}
+
+
+@pytest.fixture
+def baseline(tmp_path):
+    path = tmp_path / "old.json"
+    report = {
+        "meta": {"git_revision": "abc123"},
+        "results": [result("matcher", 10, 1000.0, 500), result("matcher", 1000, 800.0, 900), result("handler", 10, 0, 0)],
+    }
+    path.write_text(json.dumps(report), encoding="utf-8")
+    return str(path)
+
+
+def test_compare_flags_regressions_beyond_threshold(baseline):
+    current = {
+        "results": [
+            result("matcher", 10, 950.0, 540),  # 吞吐量 -5%，p99 +8%
+            result("matcher", 1000, 600.0, 900),  # 吞吐量 -25%
+            result("handler", 10, 10.0, 10),  # 基线为 0，无法比较
+            result("new", 10, 1.0, 1),  # 基线中没有
+        ]
+    }
+    assert bench_rules.compare(current, baseline) == []
+    assert [r["size"] for r in bench_rules.compare(current, baseline, 10)] == [1000]
+    assert [r["size"] for r in bench_rules.compare(current, baseline, 5)] == [10, 1000]
+    assert bench_rules.compare(current, baseline, 30) == []
+
+
+def test_p99_increase_counts_as_regression(baseline):
+    current = {"results": [result("matcher", 10, 1200.0, 700)]}
+    [regression] = bench_rules.compare(current, baseline, 20)
+    assert regression["p99_ratio"] == 1.4
+
+
+def test_max_regression_requires_compare():
+    with pytest.raises(SystemExit) as exc:
+        bench_rules.main(["--max-regression", "10"])
+    assert exc.value.code == 2
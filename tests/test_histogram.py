@@ -0,0 +1,112 @@
+"""对数分桶直方图的精度测试：与排序后精确求得的百分位比较"""
+
+import json
+import random
+
+import pytest
+
+from src.utils.histogram import LogHistogram
+
+
+def exact_percentile(values, p):
+    """与 LogHistogram.percentile 相同的取秩方式"""
+    ordered = sorted(values)
+    target = max(1, int(round(len(ordered) * p / 100.0)))
+    return ordered[target - 1]
+
+
+def random_values(rng, count):
+    """跨越多个数量级的值，含 0 和小于 2**sub_bits 的精确桶"""
+    return [int(rng.lognormvariate(8, 3)) for _ in range(count)] + [0, 1, 15, 16, 17, 2**40 + 12345]
+
+
+@pytest.mark.parametrize("sub_bits", [1, 3, 4, 7])
+def test_bucket_bounds_contain_value(sub_bits):
+    hist = LogHistogram(sub_bits)
+    rng = random.Random(sub_bits)
+    values = sorted({rng.randrange(0, 1 << rng.randint(1, 62)) for _ in range(2000)} | set(range(300)))
+    indexes = [hist._index(v) for v in values]
+    assert indexes == sorted(indexes)
+    for value, index in zip(values, indexes):
+        low, high = hist._bounds(index)
+        assert low <= value <= high
+        if value:
+            assert (high - low) / value <= 1 / 2**sub_bits
+
+
+@pytest.mark.parametrize("sub_bits", [2, 4, 6])
+def test_percentiles_within_relative_error(sub_bits):
+    rng = random.Random(100 + sub_bits)
+    values = random_values(rng, 5000)
+    hist = LogHistogram(sub_bits)
+    for value in values:
+        hist.record(value)
+    bound = 1 / 2**sub_bits
+    for p in (0, 1, 10, 25, 50, 75, 90, 99, 99.9, 100):
+        exact = exact_percentile(values, p)
+        approx = hist.percentile(p)
+        assert abs(approx - exact) <= exact * bound, (p, exact, approx)
+    assert hist.percentile(100) == max(values)
+    assert hist.count == len(values)
+    assert hist.total == sum(values)
+    assert (hist.min, hist.max) == (min(values), max(values))
+
+
+def test_small_values_are_exact():
+    hist = LogHistogram(4)
+    values = list(range(16)) * 3
+    for value in values:
+        hist.record(value)
+    for p in range(0, 101, 5):
+        assert hist.percentile(p) == exact_percentile(values, p)
+
+
+def test_record_with_count_and_negative_values():
+    hist = LogHistogram()
+    hist.record(1000, count=9)
+    hist.record(-5)
+    assert hist.count == 10
+    assert hist.min == 0
+    assert hist.percentile(5) == 0
+    assert hist.percentile(50) == pytest.approx(1000, rel=1 / 16)
+
+
+def test_merge_equals_recording_everything():
+    rng = random.Random(8)
+    parts = [random_values(rng, 500) for _ in range(4)]
+    merged = LogHistogram()
+    whole = LogHistogram()
+    for part in parts:
+        hist = LogHistogram()
+        for value in part:
+            hist.record(value)
+            whole.record(value)
+        merged.merge(hist)
+    merged.merge(LogHistogram())
+    assert merged.to_dict() == whole.to_dict()
+    assert merged.summary() == whole.summary()
+
+
+def test_merge_rejects_different_resolution():
+    with pytest.raises(ValueError):
+        LogHistogram(4).merge(LogHistogram(5))
+
+
+def test_serialization_round_trip():
+    rng = random.Random(9)
+    hist = LogHistogram(5)
+    for value in random_values(rng, 300):
+        hist.record(value)
+    restored = LogHistogram.from_dict(json.loads(json.dumps(hist.to_dict())))
+    assert restored.to_dict() == hist.to_dict()
+    assert restored.summary() == hist.summary()
+
+
+def test_empty_and_cleared():
+    hist = LogHistogram()
+    assert hist.percentile(50) == 0
+    assert hist.summary()["mean"] == 0
+    hist.record(42)
+    hist.clear()
+    assert len(hist) == 0
+    assert hist.summary() == LogHistogram().summary()
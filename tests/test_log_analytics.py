@@ -0,0 +1,73 @@
+"""离线统计的并行合并"""
+
+import json
+import weakref
+from concurrent.futures import Future
+
+from src.utils import log_analytics
+from src.utils.log_analytics import analyze
+
+
+def write_logs(tmp_path, files=10, records=30):
+    paths = []
+    for f in range(files):
+        path = tmp_path / f"requests_2024010{f % 10}_00000{f}.jsonl"
+        with open(path, "w") as out:
+            for n in range(records):
+                out.write(json.dumps({
+                    "url": f"https://h{n % 4}.test/p{n % 3}",
+                    "method": "GET",
+                    "status_code": 403 if n % 7 == 0 else 200,
+                    "timing": {"request_start": 1_700_000_000 + f * 100 + n, "duration_ms": n + 1},
+                }) + "\n")
+        paths.append(path)
+    return paths
+
+
+class InlineExecutor:
+    """同步执行的执行器，记录同时存活的部分结果数"""
+
+    def __init__(self, max_workers=None):
+        self.alive = weakref.WeakSet()
+        self.peak = 0
+        InlineExecutor.last = self
+
+    def submit(self, fn, *args):
+        future = Future()
+        result = fn(*args)
+        self.alive.add(result)
+        self.peak = max(self.peak, len(self.alive))
+        future.set_result(result)
+        return future
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+def normalized(report):
+    """Top-K 中计数相同的条目顺序取决于合并顺序"""
+    for key in ("top_hosts", "top_paths"):
+        report[key] = sorted(report[key], key=lambda item: (-item["count"], item[key[4:-1]]))
+    return report
+
+
+def test_parallel_matches_single_process(tmp_path):
+    files = write_logs(tmp_path)
+    single = normalized(analyze(files, workers=1, chunk_bytes=512).report())
+    parallel = normalized(analyze(files, workers=2, chunk_bytes=512).report())
+    assert parallel == single
+    assert single["total_requests"] == 300
+
+
+def test_partial_results_are_released(tmp_path, monkeypatch):
+    files = write_logs(tmp_path, files=20)
+    units = log_analytics.plan_units(files, 256)
+    assert len(units) > 40
+    monkeypatch.setattr(log_analytics, "ProcessPoolExecutor", InlineExecutor)
+    result = analyze(files, workers=2, chunk_bytes=256)
+    assert result.total_requests == 600
+    # 窗口为 2×workers，加上刚合并完的一批
+    assert InlineExecutor.last.peak <= 2 * 2 * 2 + 1
@@ -0,0 +1,160 @@
+"""二进制日志格式的往返测试：编码后再读取应得到原记录"""
+
+import gzip
+import json
+import random
+
+import pytest
+
+from src.utils.log_format import (
+    MAGIC,
+    BinaryLogEncoder,
+    BinaryLogReader,
+    JsonLinesEncoder,
+    LogFormatError,
+    defines_strings,
+    read_records,
+)
+
+
+def make_record(rng, index):
+    host = rng.choice(["app.warp.dev", "api.example.com", "o1.ingest.sentry.io"])
+    return {
+        "timestamp": f"2024-01-01T00:00:{index % 60:02d}",
+        "flow_id": f"flow-{index}",
+        "method": rng.choice(["GET", "POST"]),
+        "url": f"https://{host}/v{rng.randint(1, 3)}/items?id={index}",
+        "host": host,
+        "status": rng.choice([200, 204, 404, None]),
+        "content_length": rng.randint(0, 1 << 20),
+        "duration": rng.random() * 2,
+        "blocked": rng.random() < 0.2,
+        "negative": -rng.randint(0, 1000),
+        "headers": {"user-agent": "warp/1.0", "accept": rng.choice(["*/*", "application/json"])},
+        "tags": ["a", rng.choice(["b", "c"]), 3],
+    }
+
+
+def encode_all(encoder, records, fresh=True):
+    return encoder.begin(fresh) + b"".join(encoder.encode(r) for r in records)
+
+
+def decode(data):
+    reader = BinaryLogReader()
+    assert data.startswith(MAGIC)
+    return list(reader.feed(data, len(MAGIC))), reader
+
+
+def test_binary_round_trip():
+    rng = random.Random(3)
+    records = [make_record(rng, i) for i in range(200)]
+    decoded, reader = decode(encode_all(BinaryLogEncoder(), records))
+    assert decoded == records
+    assert not reader.truncated
+
+
+def test_repeated_strings_are_interned():
+    encoder = BinaryLogEncoder()
+    encoder.begin(True)
+    record = {"host": "app.warp.dev", "headers": {"accept": "*/*"}}
+    first = encoder.encode(record)
+    second = encoder.encode(record)
+    assert defines_strings(first)
+    assert not defines_strings(second)
+    assert len(second) < len(first)
+
+
+def test_literal_fields_and_long_strings_stay_literal():
+    encoder = BinaryLogEncoder()
+    encoder.begin(True)
+    long_value = "x" * 600
+    encoder.encode({"flow_id": "abc", "body": long_value})
+    assert "abc" not in encoder._refs
+    assert long_value not in encoder._refs
+    assert "flow_id" in encoder._refs
+
+
+def test_full_dictionary_falls_back_to_literals():
+    encoder = BinaryLogEncoder(max_dictionary=4)
+    records = [{f"k{i}": f"v{i}"} for i in range(10)]
+    decoded, _ = decode(encode_all(encoder, records))
+    assert decoded == records
+    assert len(encoder._refs) == 4
+
+
+def test_failed_encode_rolls_back_dictionary():
+    encoder = BinaryLogEncoder()
+    data = encoder.begin(True) + encoder.encode({"host": "a.test"})
+
+    class Broken:
+        def __str__(self):
+            raise RuntimeError("boom")
+
+    with pytest.raises(RuntimeError):
+        encoder.encode({"host": "b.test", "value": Broken()})
+    assert "b.test" not in encoder._refs
+    data += encoder.encode({"host": "b.test"})
+    decoded, _ = decode(data)
+    assert decoded == [{"host": "a.test"}, {"host": "b.test"}]
+
+
+def test_append_with_reset_frame():
+    rng = random.Random(5)
+    first = [make_record(rng, i) for i in range(20)]
+    second = [make_record(rng, i) for i in range(20, 40)]
+    data = encode_all(BinaryLogEncoder(), first)
+    # 新的编码器（如进程重启后）追加到同一文件，字典编号从零开始
+    data += encode_all(BinaryLogEncoder(), second, fresh=False)
+    decoded, _ = decode(data)
+    assert decoded == first + second
+
+
+def test_concatenated_segments():
+    rng = random.Random(9)
+    first = [make_record(rng, i) for i in range(10)]
+    second = [make_record(rng, i) for i in range(10, 20)]
+    encoder = BinaryLogEncoder()
+    data = encode_all(encoder, first) + encode_all(encoder, second)
+    decoded, _ = decode(data)
+    assert decoded == first + second
+
+
+@pytest.mark.parametrize("cut", [1, 2, 5, 17])
+def test_truncated_tail_is_ignored(cut):
+    rng = random.Random(cut)
+    records = [make_record(rng, i) for i in range(5)]
+    data = encode_all(BinaryLogEncoder(), records)
+    decoded, reader = decode(data[:-cut])
+    assert decoded == records[:-1]
+    assert reader.truncated
+
+
+def test_reader_rejects_other_files(tmp_path):
+    path = tmp_path / "requests.wglog"
+    path.write_bytes(b'{"not": "binary"}\n')
+    with pytest.raises(LogFormatError):
+        list(read_records(path))
+
+
+def test_unknown_frame_type_is_an_error():
+    data = MAGIC + b"\x01\x09"
+    with pytest.raises(LogFormatError):
+        decode(data)
+
+
+@pytest.mark.parametrize("compressed", [False, True])
+def test_read_records_by_file_name(tmp_path, compressed):
+    rng = random.Random(13)
+    records = [make_record(rng, i) for i in range(30)]
+    binary = encode_all(BinaryLogEncoder(), records)
+    jsonl = encode_all(JsonLinesEncoder(), records)
+    opener = gzip.open if compressed else open
+    suffix = ".gz" if compressed else ""
+    binary_path = tmp_path / f"requests.wglog{suffix}"
+    jsonl_path = tmp_path / f"requests.jsonl{suffix}"
+    with opener(binary_path, "wb") as f:
+        f.write(binary)
+    with opener(jsonl_path, "wb") as f:
+        f.write(jsonl)
+    assert list(read_records(binary_path)) == records
+    assert list(read_records(jsonl_path)) == json.loads(json.dumps(records))
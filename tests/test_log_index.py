@@ -0,0 +1,172 @@
+"""日志索引查询的差分测试：与逐条 LogQuery.match 的顺序扫描比较"""
+
+import gzip
+import random
+
+import pytest
+
+from src.utils.log_format import BinaryLogEncoder, JsonLinesEncoder
+from src.utils.log_index import (
+    LogQuery,
+    SegmentIndex,
+    SegmentIndexer,
+    build_index,
+    find_segments,
+    index_path,
+    query_logs,
+    query_segment,
+)
+from src.utils.rules import Rule, RuleType
+
+BASE = 1_700_000_000.0
+HOSTS = ["app.warp.dev", "api.warp.dev", "warp.dev", "o1.ingest.sentry.io", "example.com"]
+
+
+def make_records(seed, count=300):
+    rng = random.Random(seed)
+    records = []
+    for i in range(count):
+        host = rng.choice(HOSTS)
+        records.append({
+            "flow_id": f"flow-{i}",
+            "method": rng.choice(["GET", "POST", "PUT"]),
+            "url": f"https://{host}/v1/items?id={i}",
+            "status_code": rng.choice([200, 204, 404, None]),
+            # 大致递增，偶尔乱序
+            "timing": {"request_start": BASE + i * 7 + rng.uniform(-20, 20)},
+        })
+    return records
+
+
+def write_segment(path, records, binary, indexed=None):
+    """像 AsyncLogWriter 一样写分段，只为前 indexed 条记录写出索引"""
+    encoder = BinaryLogEncoder() if binary else JsonLinesEncoder()
+    indexer = SegmentIndexer(binary=binary)
+    if indexed is None:
+        indexed = len(records)
+    with open(path, "wb") as f:
+        f.write(encoder.begin(True))
+        for i, record in enumerate(records):
+            chunk = encoder.encode(record)
+            offset = f.tell()
+            f.write(chunk)
+            if i < indexed:
+                indexer.add(record, offset, chunk)
+    if indexed:
+        indexer.write(path)
+    return path
+
+
+def expected(records, query):
+    return [r for r in records if query.match(r)]
+
+
+QUERIES = [
+    LogQuery(),
+    LogQuery(since=BASE + 300, until=BASE + 900),
+    LogQuery(since=BASE + 1200),
+    LogQuery(until=BASE + 100),
+    LogQuery(hosts=["api.warp.dev"]),
+    LogQuery(hosts=["*.warp.dev", "EXAMPLE.com"]),
+    LogQuery(statuses=[404, "-"]),
+    LogQuery(methods=["post"]),
+    LogQuery(since=BASE + 200, until=BASE + 1500, hosts=["*.sentry.io"], methods=["GET"], statuses=["200"]),
+    LogQuery(hosts=["nothing.test"]),
+    LogQuery(since=BASE + 10**6),
+]
+
+
+@pytest.mark.parametrize("binary", [False, True])
+@pytest.mark.parametrize("query", QUERIES)
+def test_indexed_query_matches_scan(tmp_path, binary, query):
+    records = make_records(1)
+    suffix = BinaryLogEncoder.suffix if binary else JsonLinesEncoder.suffix
+    segment = write_segment(tmp_path / f"requests_20240101_000000{suffix}", records, binary)
+    assert list(query_segment(segment, query)) == expected(records, query)
+
+
+@pytest.mark.parametrize("binary", [False, True])
+@pytest.mark.parametrize("indexed", [0, 1, 150, 299])
+def test_unindexed_tail_is_scanned(tmp_path, binary, indexed):
+    records = make_records(2)
+    suffix = BinaryLogEncoder.suffix if binary else JsonLinesEncoder.suffix
+    segment = write_segment(tmp_path / f"requests_20240101_000000{suffix}", records, binary, indexed)
+    assert index_path(segment).exists() == bool(indexed)
+    for query in QUERIES:
+        assert list(query_segment(segment, query)) == expected(records, query)
+
+
+@pytest.mark.parametrize("binary", [False, True])
+def test_compressed_segment_uses_index(tmp_path, binary):
+    records = make_records(3)
+    suffix = BinaryLogEncoder.suffix if binary else JsonLinesEncoder.suffix
+    segment = write_segment(tmp_path / f"requests_20240101_000000{suffix}", records, binary)
+    compressed = segment.with_name(segment.name + ".gz")
+    with open(segment, "rb") as src, gzip.open(compressed, "wb") as dst:
+        dst.write(src.read())
+    segment.unlink()
+    assert index_path(compressed) == index_path(segment)
+    for query in QUERIES:
+        assert list(query_segment(compressed, query)) == expected(records, query)
+
+
+@pytest.mark.parametrize("binary", [False, True])
+def test_build_index_matches_writer_index(tmp_path, binary):
+    records = make_records(4)
+    suffix = BinaryLogEncoder.suffix if binary else JsonLinesEncoder.suffix
+    segment = write_segment(tmp_path / f"requests_20240101_000000{suffix}", records, binary)
+    written = index_path(segment).read_bytes()
+    assert build_index(segment) == len(records)
+    assert index_path(segment).read_bytes() == written
+
+
+def test_index_directory_and_postings(tmp_path):
+    records = make_records(5, count=50)
+    segment = write_segment(tmp_path / "requests_20240101_000000.jsonl", records, False)
+    index = SegmentIndex(index_path(segment))
+    try:
+        assert index.directory["count"] == 50
+        assert list(index.times) == [r["timing"]["request_start"] for r in records]
+        assert set(index.keys("host")) == {r["url"].split("/")[2] for r in records}
+        assert index.posting("method", ["GET"]) == {i for i, r in enumerate(records) if r["method"] == "GET"}
+        # 时间桶给出的候选必须覆盖时间范围内的全部记录
+        since, until = BASE + 100, BASE + 200
+        inside = {i for i, r in enumerate(records) if since <= r["timing"]["request_start"] < until}
+        assert inside <= set(index.candidates(since, until))
+    finally:
+        index.close()
+
+
+def test_corrupt_index_falls_back_to_scan(tmp_path):
+    records = make_records(6, count=40)
+    segment = write_segment(tmp_path / "requests_20240101_000000.jsonl", records, False)
+    index_path(segment).write_bytes(b"garbage")
+    query = LogQuery(hosts=["warp.dev"])
+    assert list(query_segment(segment, query)) == expected(records, query)
+
+
+def test_query_logs_across_segments(tmp_path):
+    first = make_records(7, count=40)
+    second = make_records(8, count=40)
+    write_segment(tmp_path / "requests_20240101_000000.wglog", first, True)
+    write_segment(tmp_path / "requests_20240101_000000-1.jsonl", second, False, indexed=20)
+    write_segment(tmp_path / "requests_20231231_000000.jsonl", [], False)
+    assert [p.name for p in find_segments(tmp_path)] == [
+        "requests_20231231_000000.jsonl",
+        "requests_20240101_000000.wglog",
+        "requests_20240101_000000-1.jsonl",
+    ]
+    query = LogQuery(methods=["GET"])
+    assert list(query_logs(tmp_path, query)) == expected(first, query) + expected(second, query)
+
+
+@pytest.mark.parametrize("indexed", [0, 300])
+@pytest.mark.parametrize("pattern", ["*.warp.dev", "*.sentry.io", "*.dev"])
+def test_host_wildcard_matches_host_rules(tmp_path, indexed, pattern):
+    records = make_records(9)
+    segment = write_segment(tmp_path / "requests_20240101_000000.jsonl", records, False, indexed)
+    rule = Rule(pattern, RuleType.HOST)
+    hosts = {record["url"].split("/")[2] for record in query_segment(segment, LogQuery(hosts=[pattern]))}
+    # 与 host: 规则一致，*.warp.dev 不含 warp.dev 本身
+    assert hosts == {host for host in HOSTS if rule.match(host)}
+    assert pattern[2:] not in hosts
@@ -0,0 +1,150 @@
+"""AsyncLogWriter 的写线程容错"""
+
+import json
+
+from src.utils.log_format import BinaryLogEncoder, BinaryLogReader, JsonLinesEncoder, read_records
+from src.utils.log_index import LogQuery, SegmentIndexer, find_segments, query_segment
+from src.utils.log_writer import AsyncLogWriter
+
+
+class FailingEncoder(JsonLinesEncoder):
+    """遇到 fail 字段时抛出非 TypeError/ValueError 的异常"""
+
+    def encode(self, record):
+        if record.get("fail"):
+            raise RuntimeError("boom")
+        return super().encode(record)
+
+
+class FailingIndexer:
+    def __init__(self):
+        self.added = 0
+
+    def add(self, record, offset, chunk):
+        self.added += 1
+        raise RuntimeError("index broken")
+
+    def maybe_checkpoint(self, segment):
+        pass
+
+    def finish(self, segment):
+        pass
+
+
+def read_lines(path):
+    return [json.loads(line) for line in path.read_text().splitlines()]
+
+
+def test_encoder_error_does_not_kill_writer(tmp_path):
+    path = tmp_path / "requests.jsonl"
+    writer = AsyncLogWriter(path, encoder=FailingEncoder())
+    writer.write({"n": 0, "fail": True})
+    writer.flush(timeout=5)
+    for n in range(1, 20):
+        writer.write({"n": n})
+    writer.flush(timeout=5)
+    assert writer._thread.is_alive()
+    writer.close()
+    assert [r["n"] for r in read_lines(path)] == list(range(1, 20))
+    assert writer.errors == 1
+
+
+def test_index_error_keeps_record(tmp_path):
+    path = tmp_path / "requests.jsonl"
+    indexer = FailingIndexer()
+    writer = AsyncLogWriter(path, indexer=indexer)
+    for n in range(5):
+        writer.write({"n": n})
+    writer.close()
+    assert [r["n"] for r in read_lines(path)] == list(range(5))
+    assert indexer.added == 5
+    assert writer.stats()["index_errors"] == 5
+    assert writer.errors == 0
+
+
+def test_unexpected_error_in_batch_keeps_thread_running(tmp_path):
+    path = tmp_path / "requests.jsonl"
+    writer = AsyncLogWriter(path)
+    original = writer._write_batch
+    calls = []
+
+    def flaky(batch):
+        calls.append(len(batch))
+        if len(calls) == 1:
+            raise RuntimeError("disk gremlin")
+        return original(batch)
+
+    writer._write_batch = flaky
+    writer.write({"n": 0})
+    writer.flush(timeout=5)
+    writer.write({"n": 1})
+    writer.flush(timeout=5)
+    assert writer._thread.is_alive()
+    writer.close()
+    assert [r["n"] for r in read_lines(path)] == [1]
+    assert writer.errors == 1
+
+
+class BrokenFile:
+    """第一次 write() 抛出 OSError，之后委托给真实文件"""
+
+    def __init__(self, file):
+        self.file = file
+        self.failed = False
+
+    def write(self, data):
+        if not self.failed:
+            self.failed = True
+            raise OSError(28, "No space left on device")
+        return self.file.write(data)
+
+    def __getattr__(self, name):
+        return getattr(self.file, name)
+
+
+def record(n, host):
+    return {"url": f"https://{host}/v{n}", "method": "GET", "status_code": 200, "n": n}
+
+
+def write_with_failure(writer):
+    """写两条、制造一次失败写入、再写两条，返回应当保留下来的记录"""
+    writer.write(record(0, "a.test"))
+    writer.write(record(1, "a.test"))
+    writer.flush(timeout=5)
+    writer._file = BrokenFile(writer._file)
+    # 这条带来新的字典条目，写入失败后字典中却保留着它们
+    writer.write(record(2, "lost.test"))
+    writer.flush(timeout=5)
+    writer.write(record(3, "lost.test"))
+    writer.write(record(4, "a.test"))
+    writer.close()
+    return [record(n, host) for n, host in ((0, "a.test"), (1, "a.test"), (3, "lost.test"), (4, "a.test"))]
+
+
+def test_binary_round_trip_after_failed_write_starts_new_segment(tmp_path):
+    paths = iter(tmp_path / f"requests_{i}.wglog" for i in range(1, 10))
+    writer = AsyncLogWriter(
+        tmp_path / "requests_0.wglog",
+        encoder=BinaryLogEncoder(),
+        next_path=lambda: next(paths),
+        indexer=SegmentIndexer(binary=True),
+    )
+    expected = write_with_failure(writer)
+    assert writer.errors == 1
+
+    segments = find_segments(tmp_path)
+    assert [p.name for p in segments] == ["requests_0.wglog", "requests_1.wglog"]
+    records = [r for segment in segments for r in read_records(segment)]
+    assert records == expected
+    # 两个分段的索引都只指向真正写出的记录
+    found = [r for segment in segments for r in query_segment(segment, LogQuery(hosts=["lost.test"]))]
+    assert found == [expected[2]]
+
+
+def test_binary_round_trip_after_failed_write_resets_dictionary(tmp_path):
+    path = tmp_path / "requests.wglog"
+    writer = AsyncLogWriter(path, encoder=BinaryLogEncoder())
+    expected = write_with_failure(writer)
+    with BinaryLogReader.open(path) as reader:
+        assert list(reader) == expected
+        assert not reader.truncated
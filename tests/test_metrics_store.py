@@ -0,0 +1,195 @@
+"""指标存储的汇总测试：小时、天的行与直接合并分钟数据的结果比较"""
+
+import random
+
+import pytest
+
+from src.utils.metrics_store import (
+    ALL_HOSTS,
+    DAY,
+    HOUR,
+    MINUTE,
+    OTHER,
+    MetricBucket,
+    MetricsSink,
+    MetricsStore,
+)
+
+# UTC 零点
+BASE = 19676 * DAY
+HOSTS = ["app.warp.dev", "api.warp.dev", "o1.ingest.sentry.io"]
+NO_PRUNE = {"minute": 0, "hour": 0, "day": 0}
+
+
+def random_minute(rng):
+    """一分钟的数据：{主机: MetricBucket}，含全部主机的 "*" 行"""
+    buckets = {ALL_HOSTS: MetricBucket()}
+    for host in rng.sample(HOSTS, rng.randint(1, len(HOSTS))):
+        part = MetricBucket()
+        part.requests = rng.randint(1, 50)
+        part.blocked = rng.randint(0, part.requests)
+        part.errors = rng.randint(0, 3)
+        part.bytes = rng.randint(0, 10**6)
+        for _ in range(rng.randint(0, 5)):
+            part.latency.record(rng.randint(100, 10**6))
+        buckets[host] = part
+        buckets[ALL_HOSTS].merge(part)
+    return buckets
+
+
+def expected_rows(batch, resolution):
+    """把分钟数据按 resolution 对齐合并：{(时间桶, 主机): MetricBucket}"""
+    result = {}
+    for minute, buckets in batch:
+        bucket = minute // resolution * resolution
+        for host, part in buckets.items():
+            result.setdefault((bucket, host), MetricBucket()).merge(part)
+    return result
+
+
+def stored_rows(store, resolution):
+    rows = store.conn.execute(
+        "SELECT bucket, host, requests, blocked, errors, bytes, latency FROM metrics WHERE resolution = ?",
+        (resolution,),
+    )
+    return {(bucket, host): MetricBucket.from_row(*values) for bucket, host, *values in rows}
+
+
+def as_tuple(bucket):
+    latency = bucket.latency.to_dict() if bucket.latency.count else None
+    return bucket.requests, bucket.blocked, bucket.errors, bucket.bytes, latency
+
+
+def assert_rows(store, batch, resolution):
+    expected = {key: as_tuple(part) for key, part in expected_rows(batch, resolution).items()}
+    assert {key: as_tuple(part) for key, part in stored_rows(store, resolution).items()} == expected
+
+
+def make_batch(seed, days=3, density=0.05):
+    rng = random.Random(seed)
+    minutes = [BASE + i * MINUTE for i in range(days * DAY // MINUTE) if rng.random() < density]
+    return [(minute, random_minute(rng)) for minute in minutes]
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = MetricsStore(tmp_path / "metrics.db")
+    yield store
+    store.close()
+
+
+def test_rollup_matches_merged_minutes(store):
+    batch = make_batch(1)
+    store.write(batch[: len(batch) // 2])
+    store.write(batch[len(batch) // 2:])
+    now = BASE + 3 * DAY
+    assert store.rollup(now) > 0
+    for resolution in (MINUTE, HOUR, DAY):
+        assert_rows(store, batch, resolution)
+    # 再次汇总没有新数据
+    assert store.rollup(now) == 0
+
+
+def test_unfinished_periods_are_not_rolled_up(store):
+    batch = make_batch(2, days=2)
+    store.write(batch)
+    now = BASE + DAY + 12 * HOUR + 30
+    store.rollup(now)
+    done = [item for item in batch if item[0] < now // HOUR * HOUR]
+    assert_rows(store, done, HOUR)
+    assert_rows(store, [item for item in batch if item[0] < BASE + DAY], DAY)
+    # 时间推进后补上剩余的部分
+    store.rollup(BASE + 2 * DAY)
+    assert_rows(store, batch, HOUR)
+    assert_rows(store, batch, DAY)
+
+
+def test_rewriting_a_minute_merges(store):
+    rng = random.Random(3)
+    first, second = random_minute(rng), random_minute(rng)
+    store.write([(BASE, first)])
+    store.write([(BASE, second)])
+    assert_rows(store, [(BASE, first), (BASE, second)], MINUTE)
+
+
+def test_late_minutes_update_rolled_up_rows(store):
+    batch = make_batch(4, days=2)
+    store.write(batch)
+    store.rollup(BASE + 2 * DAY)
+    rng = random.Random(5)
+    late = [(BASE + 90 * MINUTE, random_minute(rng)), (BASE + DAY + 7 * MINUTE, random_minute(rng))]
+    store.write(late)
+    for resolution in (MINUTE, HOUR, DAY):
+        assert_rows(store, batch + late, resolution)
+    # 迟到数据不会被再次汇总
+    assert store.rollup(BASE + 2 * DAY) == 0
+    assert_rows(store, batch + late, HOUR)
+
+
+def test_prune_keeps_rows_not_yet_rolled_up(store):
+    batch = make_batch(6, days=3)
+    store.write(batch)
+    now = BASE + 3 * DAY
+    store.rollup(BASE + DAY)
+    deleted = store.prune({"minute": 1, "hour": 0, "day": 0}, now=now)
+    # 只有第一天的分钟数据已汇总为小时，可以删除
+    assert deleted == sum(len(buckets) for minute, buckets in batch if minute < BASE + DAY)
+    assert_rows(store, [item for item in batch if item[0] >= BASE + DAY], MINUTE)
+    store.rollup(now)
+    store.prune({"minute": 1, "hour": 0, "day": 0}, now=now)
+    assert_rows(store, [item for item in batch if item[0] >= BASE + 2 * DAY], MINUTE)
+    assert_rows(store, batch, HOUR)
+
+
+def test_queries_agree_with_rows(store):
+    batch = make_batch(7, days=2)
+    store.write(batch)
+    store.rollup(BASE + 2 * DAY)
+    since, until = BASE + 6 * HOUR, BASE + 30 * HOUR
+    inside = [item for item in batch if since <= item[0] < until]
+    series = store.series(since, until, resolution=HOUR)
+    assert [row["time"] for row in series] == sorted({m // HOUR * HOUR for m, _ in inside})
+    assert sum(row["requests"] for row in series) == sum(b[ALL_HOSTS].requests for _, b in inside)
+
+    totals = {}
+    for _, buckets in inside:
+        for host, part in buckets.items():
+            if host != ALL_HOSTS:
+                totals[host] = totals.get(host, 0) + part.bytes
+    top = store.top_hosts(since, until, by="bytes", resolution=MINUTE)
+    assert [(row["host"], row["bytes"]) for row in top] == sorted(totals.items(), key=lambda kv: -kv[1])
+
+    merged = MetricBucket()
+    for _, buckets in inside:
+        merged.merge(buckets[ALL_HOSTS])
+    for resolution in (MINUTE, HOUR):
+        summary = store.summary(since, until, resolution=resolution)
+        assert summary["requests"] == merged.requests
+        assert summary["latency_ms"]["p99"] == merged.latency.percentile(99) / 1000
+    with pytest.raises(ValueError):
+        store.top_hosts(since, until, by="latency")
+
+
+def test_sink_aggregates_minutes(tmp_path):
+    sink = MetricsSink(tmp_path / "metrics.db", max_hosts=2, retention=NO_PRUNE)
+    sink.start()
+    hosts = ["a.test", "b.test", "c.test", "d.test"]
+    for i in range(200):
+        sink.record(hosts[i % 4], blocked=i % 5 == 0, size=10, latency_us=1000 + i, now=BASE + i * 1.5)
+    sink.close()
+    assert sink.failed == 0
+    assert sink.minutes_written == 5
+
+    store = MetricsStore(tmp_path / "metrics.db", readonly=True)
+    try:
+        rows = stored_rows(store, MINUTE)
+        assert {host for _, host in rows} == {ALL_HOSTS, "a.test", "b.test", OTHER}
+        assert sum(part.requests for (_, host), part in rows.items() if host == ALL_HOSTS) == 200
+        assert sum(part.requests for (_, host), part in rows.items() if host != ALL_HOSTS) == 200
+        assert sum(part.blocked for (_, host), part in rows.items() if host == ALL_HOSTS) == 40
+        # 关闭时做过一次汇总
+        hour = stored_rows(store, HOUR)
+        assert hour[(BASE, ALL_HOSTS)].requests == 200
+        assert hour[(BASE, ALL_HOSTS)].latency.count == 200
+    finally:
+        store.close()
@@ -0,0 +1,84 @@
+"""滑动窗口计数器的差分测试：与保存全部事件的朴素实现比较"""
+
+import random
+
+import pytest
+
+from src.utils.rate import WINDOWS, WindowedCounter
+
+
+def naive_window(events, metric, seconds, now):
+    """events 为 (秒, 指标, 数量)，返回最近 seconds 秒的 (总数, 单秒峰值)"""
+    per_second = {}
+    current = int(now)
+    for second, name, n in events:
+        if name == metric and current - seconds < second <= current:
+            per_second[second] = per_second.get(second, 0) + n
+    return sum(per_second.values()), max(per_second.values(), default=0)
+
+
+@pytest.mark.parametrize("horizon", [7, 60, 900])
+def test_random_events_match_naive_window(horizon):
+    rng = random.Random(horizon)
+    counter = WindowedCounter(["requests", "blocked"], horizon=horizon)
+    events = []
+    now = 1_700_000_000.0
+    for _ in range(3000):
+        # 大多在同一秒或相邻几秒，偶尔长时间空闲，超过一整圈
+        now += rng.choice([0, 0, 0.3, 1, 2, 5, horizon + 3])
+        metric = rng.choice(counter.metrics)
+        n = rng.randint(1, 4)
+        counter.add(metric, n, now)
+        events.append((int(now), metric, n))
+        seconds = rng.choice([1, 5, horizon // 2 or 1, horizon, horizon * 2])
+        query_now = now + rng.choice([0, 0, 1, horizon // 3])
+        expected = naive_window(events, metric, min(seconds, horizon), query_now)
+        assert counter.window(metric, seconds, query_now) == expected
+
+
+def test_window_includes_current_second():
+    counter = WindowedCounter(["requests"], horizon=60)
+    counter.add("requests", 3, now=100.9)
+    counter.add("requests", 2, now=100.1)
+    counter.add("requests", 1, now=99.5)
+    assert counter.window("requests", 1, now=100.5) == (5, 5)
+    assert counter.window("requests", 2, now=100.5) == (6, 5)
+    assert counter.window("requests", 60, now=158.0) == (6, 5)
+    assert counter.window("requests", 60, now=159.0) == (5, 5)
+    assert counter.window("requests", 60, now=160.0) == (0, 0)
+
+
+def test_stale_slots_are_not_counted():
+    counter = WindowedCounter(["requests"], horizon=10)
+    counter.add("requests", 4, now=5)
+    # 同一槽位的下一圈，旧的计数被覆盖而不是累加
+    counter.add("requests", 1, now=15)
+    assert counter.window("requests", 10, now=15) == (1, 1)
+    assert counter.window("requests", 10, now=5) == (0, 0)
+
+
+def test_rates_use_window_length_and_elapsed():
+    counter = WindowedCounter(["requests", "blocked"])
+    now = 10_000.0
+    for second in range(120):
+        counter.add("requests", 2, now - second)
+    counter.add("blocked", 30, now)
+    rates = counter.rates(now=now)
+    assert set(rates) == {name for name, _ in WINDOWS}
+    assert rates["1m"]["rate"]["requests"] == pytest.approx(2.0)
+    assert rates["5m"]["rate"]["requests"] == pytest.approx(240 / 300)
+    assert rates["15m"]["peak"]["blocked"] == 30
+    # 刚启动 120 秒时，长窗口按实际时长平均
+    started = counter.rates(now=now, elapsed=120)
+    assert started["5m"]["rate"]["requests"] == pytest.approx(2.0)
+    assert started["1m"]["rate"]["requests"] == pytest.approx(2.0)
+    assert counter.rates(now=now, elapsed=0)["1m"]["rate"]["blocked"] == pytest.approx(30.0)
+
+
+def test_clear():
+    counter = WindowedCounter(["requests"], horizon=60)
+    counter.add("requests", 5, now=50)
+    counter.clear()
+    assert counter.window("requests", 60, now=50) == (0, 0)
+    counter.add("requests", 1, now=50)
+    assert counter.window("requests", 60, now=50) == (1, 1)
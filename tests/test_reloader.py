@@ -0,0 +1,86 @@
+"""配置重载的差异基准与换上失败时的回滚"""
+
+import logging
+
+import pytest
+
+from src.core.config import Config
+from src.core.proxy import ProxyServer
+from src.core.reloader import ConfigReloader
+from src.utils.rule_snapshot import load_ruleset
+
+
+def write_config(path, *block):
+    rules = "".join(f'    - "{rule}"\n' for rule in block)
+    path.write_text(f"rules:\n  block:\n{rules}  snapshot_dir: ''\nreload:\n  watch: false\n")
+
+
+def rule_changes(caplog):
+    return [r.getMessage() for r in caplog.records if r.getMessage().startswith("📝 Rule changes")]
+
+
+@pytest.fixture
+def config_path(tmp_path):
+    path = tmp_path / "config.yaml"
+    write_config(path, "host:a.test")
+    return path
+
+
+def test_diff_baseline_moves_only_when_applied(config_path, caplog):
+    caplog.set_level(logging.INFO)
+    config = Config(str(config_path))
+    ready = []
+    reloader = ConfigReloader(config, load_ruleset(config), ready.append, watch=False)
+
+    write_config(config_path, "host:a.test", "host:b.test")
+    reloader.reload_now()
+    # 没有换上，再次重载仍然相对正在生效的配置报告差异
+    reloader.reload_now()
+    assert rule_changes(caplog) == ["📝 Rule changes: +1 -0"] * 2
+
+    caplog.clear()
+    reloader.applied(ready[-1])
+    reloader.reload_now()
+    assert rule_changes(caplog) == []
+
+
+class FailingUpstream:
+    def __init__(self):
+        self.reloads = []
+
+    def reload(self, config):
+        self.reloads.append(config)
+        if len(self.reloads) == 1:
+            raise RuntimeError("bad upstream")
+
+
+class RecordingWarp:
+    def __init__(self):
+        self.swapped = []
+
+    def swap(self, config, ruleset):
+        self.swapped.append(ruleset)
+
+
+def test_failed_apply_keeps_reloader_baseline(config_path):
+    config = Config(str(config_path))
+    proxy = ProxyServer(config)
+    proxy.upstream_handler = FailingUpstream()
+    proxy.warp_handler = RecordingWarp()
+    ruleset = load_ruleset(config)
+    proxy.reloader = ConfigReloader(config, ruleset, proxy._on_reload_ready, watch=False)
+
+    write_config(config_path, "host:a.test", "host:b.test")
+    proxy.reloader.reload_now()
+    proxy._apply_pending()
+    assert proxy.generation == 0
+    assert proxy.config is config
+    assert proxy.reloader.config is config
+    assert proxy.reloader.ruleset is ruleset
+
+    snapshot = proxy.reloader.reload_now()
+    proxy._apply_pending()
+    assert proxy.generation == snapshot.generation
+    assert proxy.reloader.config is snapshot.config
+    assert proxy.reloader.ruleset is snapshot.ruleset
+    assert proxy.warp_handler.swapped == [snapshot.ruleset]
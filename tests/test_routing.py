@@ -0,0 +1,88 @@
+"""UpstreamRouter 的路由顺序、默认池和缓存"""
+
+import pytest
+
+from src.utils.routing import UpstreamRouter
+from src.utils.upstream_pool import parse_upstream
+
+ROUTES = [
+    {"pattern": "regex:^https://[^/]+/ai/", "upstream": "http://ai-proxy:8001"},
+    {"pattern": "host:*.warp.dev", "upstreams": ["http://p1:3128", "http://p2:3128"]},
+    {"pattern": "host:direct.warp.dev", "upstream": ""},
+    {"pattern": "telemetry", "upstream": "http://p2:3128"},
+]
+
+
+@pytest.fixture
+def router():
+    return UpstreamRouter(ROUTES, default="http://fallback:8080").compile()
+
+
+@pytest.mark.parametrize(
+    "url, expected",
+    [
+        # URL 路由排在 host 路由之前，先配置者优先
+        ("https://app.warp.dev/ai/chat", 0),
+        ("https://app.warp.dev/api", 1),
+        # 被更靠前的 *.warp.dev 覆盖
+        ("https://direct.warp.dev/", 1),
+        ("https://example.com/telemetry", 3),
+        ("https://example.com/", -1),
+        # *.warp.dev 不含 warp.dev 本身
+        ("https://warp.dev/", -1),
+    ],
+)
+def test_first_configured_route_wins(router, url, expected):
+    assert router.route_index(url) == expected
+
+
+def test_default_pool_and_direct_routes():
+    router = UpstreamRouter([{"pattern": "host:direct.test", "upstream": ""}], default="http://fallback:8080")
+    assert router.route("https://direct.test/") == ""
+    assert router.route("https://other.test/") == "http://fallback:8080"
+    assert UpstreamRouter(ROUTES).route("https://example.com/") == ""
+
+
+def test_members_are_shared_between_pools(router):
+    assert sorted(router.members) == ["http://ai-proxy:8001", "http://fallback:8080", "http://p1:3128", "http://p2:3128"]
+    shared = router.members["http://p2:3128"]
+    assert router.pools[1].members[1] is shared
+    assert router.pools[3].members[0] is shared
+
+
+def test_host_results_are_cached_and_invalidated(router):
+    router.route_index("https://app.warp.dev/a")
+    router.route_index("https://app.warp.dev/b")
+    assert router.cache.stats()["hits"] == 1
+    router.add_route("host:app.warp.dev", "http://p9:1")
+    assert len(router.cache) == 0
+    assert router.route_index("https://app.warp.dev/b") == 1
+
+
+def test_explicit_host_argument_is_used(router):
+    assert router.route_index("https://10.0.0.1/api", "app.warp.dev") == 1
+
+
+def test_inherit_keeps_health_of_same_upstream(router):
+    router.members["http://p1:3128"].record_failure("refused")
+    reloaded = UpstreamRouter(ROUTES[1:2]).compile()
+    reloaded.inherit(router)
+    assert not reloaded.members["http://p1:3128"].healthy
+    assert reloaded.members["http://p2:3128"].healthy
+
+
+@pytest.mark.parametrize(
+    "upstream, expected",
+    [
+        ("proxy:3128", ("http", ("proxy", 3128))),
+        ("https://proxy", ("https", ("proxy", 443))),
+        ("http://10.0.0.1", ("http", ("10.0.0.1", 80))),
+    ],
+)
+def test_parse_upstream(upstream, expected):
+    assert parse_upstream(upstream) == expected
+
+
+def test_parse_upstream_rejects_missing_host():
+    with pytest.raises(ValueError):
+        parse_upstream("http://")
@@ -0,0 +1,212 @@
+"""规则匹配的差分测试：与 re.search、逐条 Rule.match 和朴素子串查找比较"""
+
+import random
+import re
+
+import pytest
+
+from src.utils.rules import (
+    AhoCorasick,
+    HostTrie,
+    Rule,
+    RuleMatcher,
+    RuleType,
+    parse_rule_spec,
+    required_literal,
+)
+
+# (正则片段, 能被该片段匹配的一段文本)
+TOKENS = [
+    ("a", "a"),
+    ("pi", "pi"),
+    ("/", "/"),
+    ("\\.", "."),
+    ("\\/", "/"),
+    ("\\x2f", "/"),
+    ("\\x41", "A"),
+    ("\\u0062", "b"),
+    ("\\U00000063", "c"),
+    ("\\N{DIGIT ONE}", "1"),
+    ("\\0", "\0"),
+    ("\\012", "\n"),
+    ("\\101", "A"),
+    ("\\t", "\t"),
+    ("\\d", "7"),
+    ("\\w+", "xyz"),
+    ("[0-9]", "5"),
+    ("(v1)", "v1"),
+    ("a?", ""),
+    ("\\x2f?", "/"),
+    ("\\101*", "AA"),
+    ("b{2}", "bb"),
+    (".", "q"),
+]
+
+
+@pytest.mark.parametrize(
+    "pattern, text",
+    [
+        ("\\x2fapi/v1", "/api/v1"),
+        ("\\u002fapi/v1", "/api/v1"),
+        ("\\U0000002fapi/v1", "/api/v1"),
+        ("\\N{SOLIDUS}api/v1", "/api/v1"),
+        ("\\057api/v1", "/api/v1"),
+        ("\\0api/v1", "\0api/v1"),
+        ("(x)\\1api/v1", "xxapi/v1"),
+        ("api\\x2fv1\\x2fusers", "api/v1/users"),
+        ("([a-z]\\x29)+tracking", "b)tracking"),
+    ],
+)
+def test_escape_operands_are_not_literals(pattern, text):
+    regex = re.compile(pattern)
+    literal = required_literal(regex)
+    if regex.search(text):
+        assert literal in text
+
+
+def test_hex_escape_operand_is_skipped():
+    assert required_literal(re.compile("\\x2fapi/v1")) == "api/v1"
+    assert required_literal(re.compile("\\N{SOLIDUS}api/v1")) == "api/v1"
+
+
+def test_random_escaped_patterns_match_re_search():
+    rng = random.Random(20240601)
+    for _ in range(3000):
+        picks = [rng.choice(TOKENS) for _ in range(rng.randint(1, 8))]
+        pattern = "".join(p for p, _ in picks)
+        text = "".join(t for _, t in picks)
+        text = rng.choice(["", "GET ", "x"]) + text + rng.choice(["", "?q=1"])
+        regex = re.compile(pattern)
+        assert regex.search(text), (pattern, text)
+        literal = required_literal(regex)
+        assert literal in text, (pattern, text, literal)
+
+
+def naive_contains(patterns, text):
+    return sorted({value for value, pattern in enumerate(patterns) if pattern in text})
+
+
+def test_aho_corasick_matches_naive_substring_search():
+    rng = random.Random(7)
+    for _ in range(300):
+        patterns = ["".join(rng.choice("abc") for _ in range(rng.randint(1, 4))) for _ in range(rng.randint(1, 12))]
+        automaton = AhoCorasick()
+        for value, pattern in enumerate(patterns):
+            automaton.add(pattern, value)
+        for _ in range(10):
+            text = "".join(rng.choice("abcd") for _ in range(rng.randint(0, 15)))
+            expected = naive_contains(patterns, text)
+            assert automaton.search_all(text) == expected, (patterns, text)
+            assert automaton.search_any(text) == bool(expected)
+            assert automaton.search_first(text) == (expected[0] if expected else None)
+
+
+def test_aho_corasick_rebuilds_after_late_additions():
+    automaton = AhoCorasick()
+    automaton.add("warp", 0)
+    assert automaton.search_all("app.warp.dev") == [0]
+    automaton.add("p.w", 1)
+    automaton.add("", 2)
+    assert automaton.search_all("app.warp.dev") == [0, 1, 2]
+    assert automaton.search_all("") == [2]
+
+
+# (规则字符串, 优先级)，覆盖自动机、预筛选正则、合并正则和回退正则
+MATCHER_RULES = [
+    ("analytics", 0),
+    ("exact:https://app.warp.dev/", 1),
+    ("regex:/v\\d+/telemetry", 0),
+    ("regex:^https://[a-z]+\\.sentry\\.io/", 0),
+    ("regex:(?i)TRACK", 2),
+    ("regex:(a)\\1b", 2),
+    ("wildcard:*warp.dev/ai/*", 1),
+    ("wildcard:https://?.example.com/*", 2),
+    ("regex:[0-9]{4}", 1),
+    ("warp", 2),
+    ("regex:dev$", 0),
+]
+
+MATCHER_TEXTS = [
+    "https://app.warp.dev/",
+    "https://app.warp.dev/ai/multi-agent",
+    "https://api.example.com/v2/telemetry",
+    "https://o123.sentry.io/api/1234/envelope",
+    "https://x.example.com/Tracking?id=1",
+    "https://foo.test/aab",
+    "https://foo.test/analytics/dev",
+    "https://nothing.test/",
+    "",
+]
+
+
+def build_matcher(rules):
+    matcher = RuleMatcher()
+    for spec, priority in rules:
+        pattern, rule_type = parse_rule_spec(spec)
+        matcher.add(pattern, rule_type, priority, spec)
+    return matcher
+
+
+def naive_matches(rules, text):
+    """按 (优先级, 添加顺序) 排好的命中规则"""
+    hits = []
+    for index, (spec, priority) in enumerate(rules):
+        if Rule(*parse_rule_spec(spec)).match(text):
+            hits.append((priority, index, spec))
+    return sorted(hits)
+
+
+@pytest.mark.parametrize("text", MATCHER_TEXTS)
+def test_rule_matcher_agrees_with_single_rules(text):
+    matcher = build_matcher(MATCHER_RULES)
+    expected = naive_matches(MATCHER_RULES, text)
+    assert matcher.match(text) == bool(expected)
+    in_order = sorted(expected, key=lambda hit: hit[1])
+    assert [rule.rule_id for rule in matcher.match_all(text)] == [spec for _, _, spec in in_order]
+    first = matcher.match_first(text)
+    assert (first.rule_id if first else None) == (expected[0][2] if expected else None)
+
+
+def test_rule_matcher_random_rule_sets():
+    rng = random.Random(11)
+    pool = [spec for spec, _ in MATCHER_RULES]
+    for _ in range(200):
+        rules = [(rng.choice(pool), rng.randint(0, 3)) for _ in range(rng.randint(1, 8))]
+        matcher = build_matcher(rules)
+        for text in MATCHER_TEXTS:
+            expected = naive_matches(rules, text)
+            first = matcher.match_first(text)
+            assert (first.rule_id if first else None) == (expected[0][2] if expected else None)
+            assert len(matcher.match_all(text)) == len(expected)
+
+
+HOST_PATTERNS = ["warp.dev", "*.warp.dev", "api.warp.dev", "*.sentry.io", "*", "Example.COM."]
+HOSTS = ["warp.dev", "app.warp.dev", "a.b.warp.dev", "api.warp.dev", "WARP.DEV.", "sentry.io",
+         "o1.ingest.sentry.io", "example.com", "www.example.com", "notwarp.dev", "dev", ""]
+
+
+@pytest.mark.parametrize("host", HOSTS)
+def test_host_trie_agrees_with_host_rules(host):
+    trie = HostTrie()
+    for value, pattern in enumerate(HOST_PATTERNS):
+        trie.add(pattern, value)
+    expected = [value for value, pattern in enumerate(HOST_PATTERNS) if Rule(pattern, RuleType.HOST).match(host)]
+    assert sorted(trie.iter_matches(host)) == expected
+
+
+def test_host_wildcard_excludes_apex():
+    trie = HostTrie()
+    trie.add("*.warp.dev", 0)
+    assert list(trie.iter_matches("app.warp.dev")) == [0]
+    assert list(trie.iter_matches("warp.dev")) == []
+    assert len(trie) == 1
+    trie.clear()
+    assert list(trie.iter_matches("app.warp.dev")) == []
+
+
+def test_host_rules_only_match_the_host_argument():
+    matcher = build_matcher([("host:*.warp.dev", 0), ("host:tracker.test", 0)])
+    assert matcher.match_first("https://tracker.test/x", "app.warp.dev").rule_id == "host:*.warp.dev"
+    # URL 中出现的主机名不参与 host 规则的匹配
+    assert matcher.match_first("https://app.warp.dev/?r=tracker.test", "example.com") is None
+    assert matcher.match_first("https://app.warp.dev/") is None
@@ -0,0 +1,103 @@
+"""RuleSet 的判定、优先级和判定缓存"""
+
+import io
+
+from mitmproxy import io as flow_io
+from mitmproxy.test import tflow
+
+from src.utils.ruleset import (
+    ACTION_ALLOW,
+    ACTION_BLOCK,
+    ACTION_LOG_ONLY,
+    ACTION_PASS,
+    RuleSet,
+    Verdict,
+    flow_verdict,
+    store_verdict,
+)
+
+
+def build(block=(), allow=(), log_only=(), streaming=(), cache_size=64):
+    ruleset = RuleSet(streaming, cache_size)
+    ruleset.add_specs(ACTION_BLOCK, block)
+    ruleset.add_specs(ACTION_ALLOW, allow)
+    ruleset.add_specs(ACTION_LOG_ONLY, log_only)
+    return ruleset.compile()
+
+
+def test_query_string_takes_part_in_matching():
+    ruleset = build(block=["warp.dev"], allow=["regex:token=\\d+$"], log_only=["debug=1"])
+    assert ruleset.classify("https://foo.com/a?warp.dev", "foo.com").action == ACTION_BLOCK
+    assert ruleset.classify("https://foo.com/a?token=42", "foo.com").action == ACTION_ALLOW
+    assert ruleset.classify("https://foo.com/a?debug=1", "foo.com").action == ACTION_LOG_ONLY
+    assert ruleset.classify("https://foo.com/a", "foo.com").action == ACTION_PASS
+
+
+def test_cache_key_includes_query():
+    ruleset = build(block=["warp.dev"])
+    assert ruleset.classify("https://foo.com/a", "foo.com").action == ACTION_PASS
+    # 同一路径、不同查询参数不能命中上一条的缓存结果
+    assert ruleset.classify("https://foo.com/a?warp.dev", "foo.com").action == ACTION_BLOCK
+    assert ruleset.classify("https://foo.com/a", "foo.com").action == ACTION_PASS
+
+
+def test_stream_detection_sees_query():
+    ruleset = build(streaming=["/ai/multi-agent"])
+    assert ruleset.classify("https://app.warp.dev/x?next=/ai/multi-agent", "app.warp.dev").stream
+    assert not ruleset.classify("https://app.warp.dev/x?next=/ai", "app.warp.dev").stream
+
+
+def test_verdict_survives_flow_serialization():
+    flow = tflow.tflow()
+    store_verdict(flow.metadata, Verdict(ACTION_BLOCK, "block:3", True))
+    buf = io.BytesIO()
+    flow_io.FlowWriter(buf).add(flow)
+    buf.seek(0)
+    (loaded,) = list(flow_io.FlowReader(buf).stream())
+    verdict = flow_verdict(loaded.metadata)
+    assert verdict == Verdict(ACTION_BLOCK, "block:3", True)
+    assert verdict.action == ACTION_BLOCK
+
+
+def test_flow_verdict_reads_list_from_older_dumps():
+    assert flow_verdict({"warpgateway.verdict": ["allow", "allow:0", False]}).rule_id == "allow:0"
+    assert flow_verdict({}) is None
+
+
+def test_action_precedence_block_allow_log_only():
+    ruleset = build(block=["ads"], allow=["ads.allowed", "warp"], log_only=["warp", "debug"])
+    # block 优先于 allow，allow 优先于 log_only，与添加顺序无关
+    assert ruleset.classify("https://ads.allowed.test/", "ads.allowed.test").action == ACTION_BLOCK
+    assert ruleset.classify("https://app.warp.dev/debug", "app.warp.dev").action == ACTION_ALLOW
+    assert ruleset.classify("https://x.test/debug", "x.test").action == ACTION_LOG_ONLY
+
+
+def test_first_rule_within_an_action_wins():
+    ruleset = build(block=["regex:tele.*try", "telemetry", "host:*.warp.dev"])
+    verdict = ruleset.classify("https://app.warp.dev/telemetry", "app.warp.dev")
+    assert verdict.rule_id == "block:0"
+
+
+def test_verdict_cache_hits_and_hit_counting():
+    ruleset = build(block=["ads"], cache_size=2)
+    for _ in range(3):
+        assert ruleset.classify("https://ads.test/", "ads.test").action == ACTION_BLOCK
+    stats = ruleset.cache_stats()
+    assert (stats["hits"], stats["misses"]) == (2, 1)
+    # 缓存命中同样计入规则命中次数
+    assert ruleset.stats()["top_rules"][0]["hits"] == 3
+
+
+def test_verdict_cache_is_bounded_and_keyed_by_host():
+    ruleset = build(block=["host:ads.test"], cache_size=2)
+    assert ruleset.classify("https://x/", "ads.test").action == ACTION_BLOCK
+    assert ruleset.classify("https://x/", "ok.test").action == ACTION_PASS
+    ruleset.classify("https://y/", "ok.test")
+    assert len(ruleset.cache) == 2
+
+
+def test_adding_rules_invalidates_cached_verdicts():
+    ruleset = build()
+    assert ruleset.classify("https://ads.test/", "ads.test").action == ACTION_PASS
+    ruleset.add_specs(ACTION_BLOCK, ["ads"])
+    assert ruleset.classify("https://ads.test/", "ads.test").action == ACTION_BLOCK
@@ -0,0 +1,50 @@
+"""StatsHandler 快照恢复后的运行时长与速率"""
+
+from datetime import datetime, timedelta
+
+from mitmproxy.test import tflow
+
+from src.handlers.stats import StatsHandler
+
+
+def snapshot_from_an_hour_ago(requests=100):
+    old = StatsHandler()
+    old.start_time = datetime.now() - timedelta(hours=1)
+    for _ in range(requests):
+        old.request(tflow.tflow())
+    return old.to_dict()
+
+
+def test_restore_keeps_process_uptime():
+    data = snapshot_from_an_hour_ago()
+    handler = StatsHandler()
+    handler.load_dict(data)
+    stats = handler.get_stats()
+    assert stats["total_requests"] == 100
+    # 停机前的一小时不计入本进程的运行时长和速率
+    assert stats["uptime_seconds"] < 60
+    assert stats["restored_since"] == data["start_time"]
+    assert stats["lifetime_requests_per_second"] == 0
+
+    for _ in range(3):
+        handler.request(tflow.tflow())
+    stats = handler.get_stats()
+    assert stats["total_requests"] == 103
+    assert stats["lifetime_requests_per_second"] == 3 / stats["uptime_seconds"]
+
+
+def test_cumulative_origin_survives_repeated_restores():
+    data = snapshot_from_an_hour_ago()
+    first = StatsHandler()
+    first.load_dict(data)
+    second = StatsHandler()
+    second.load_dict(first.to_dict())
+    assert second.restored_since.timestamp() == data["start_time"]
+
+
+def test_reset_clears_restored_origin():
+    handler = StatsHandler()
+    handler.load_dict(snapshot_from_an_hour_ago())
+    handler.reset()
+    assert handler.get_stats()["restored_since"] is None
+    assert handler.to_dict()["start_time"] == handler.start_time.timestamp()
@@ -0,0 +1,106 @@
+"""Space-Saving 摘要的误差界测试：与精确计数比较"""
+
+import json
+import random
+from collections import Counter
+
+import pytest
+
+from src.utils.topk import SpaceSaving
+
+
+def zipf_stream(rng, length, keys=200):
+    weights = [1 / (rank + 1) for rank in range(keys)]
+    return rng.choices([f"host{i}" for i in range(keys)], weights=weights, k=length)
+
+
+def check_bounds(summary, truth):
+    """被跟踪的键满足 count - error <= 真实计数 <= count，未跟踪的键不超过表中最小计数"""
+    assert len(summary) <= summary.capacity
+    assert summary.total == sum(truth.values())
+    for key, count in summary.counts.items():
+        error = summary.errors[key]
+        assert 0 <= error <= count
+        assert count - error <= truth[key] <= count, (key, count, error, truth[key])
+    floor = summary._floor()
+    for key, n in truth.items():
+        if key not in summary.counts:
+            assert n <= floor, (key, n, floor)
+
+
+@pytest.mark.parametrize("capacity", [1, 5, 20, 300])
+def test_error_bounds(capacity):
+    rng = random.Random(capacity)
+    summary = SpaceSaving(capacity)
+    truth = Counter()
+    for key in zipf_stream(rng, 5000):
+        n = rng.choice([1, 1, 1, 3])
+        summary.add(key, n)
+        truth[key] += n
+    check_bounds(summary, truth)
+    # 出现次数超过 total / capacity 的键一定被跟踪
+    for key, n in truth.items():
+        if n > summary.total / capacity:
+            assert key in summary.counts
+
+
+def test_exact_until_full():
+    summary = SpaceSaving(10)
+    truth = Counter()
+    for key in "abcabcaddefghij":
+        summary.add(key)
+        truth[key] += 1
+    assert summary.counts == dict(truth)
+    assert set(summary.errors.values()) == {0}
+    assert summary.top(1) == [("a", 3, 0)]
+    assert [key for key, _, _ in summary.top(4)][1:] == ["b", "c", "d"]
+
+
+@pytest.mark.parametrize("capacity", [3, 10, 50])
+def test_merge_keeps_error_bounds(capacity):
+    rng = random.Random(1000 + capacity)
+    shards = []
+    truth = Counter()
+    for shard in range(4):
+        summary = SpaceSaving(capacity)
+        # 各分片的键集合不同，合并时会有只出现在一边的键
+        for key in zipf_stream(rng, 2000, keys=100 + 30 * shard):
+            summary.add(key)
+            truth[key] += 1
+        shards.append(summary)
+    merged = SpaceSaving(capacity)
+    for summary in shards:
+        merged.merge(summary)
+    check_bounds(merged, truth)
+    # 合并后继续计数，惰性堆须与新的计数一致
+    for key in zipf_stream(rng, 1000):
+        merged.add(key)
+        truth[key] += 1
+    check_bounds(merged, truth)
+
+
+def test_merge_partial_summaries_is_exact():
+    left, right = SpaceSaving(10), SpaceSaving(10)
+    for key in "aab":
+        left.add(key)
+    for key in "bcc":
+        right.add(key)
+    left.merge(right)
+    assert left.counts == {"a": 2, "b": 2, "c": 2}
+    assert set(left.errors.values()) == {0}
+    assert left.total == 6
+
+
+def test_serialization_round_trip():
+    rng = random.Random(4)
+    summary = SpaceSaving(20)
+    truth = Counter()
+    for key in zipf_stream(rng, 3000):
+        summary.add(key)
+        truth[key] += 1
+    restored = SpaceSaving.from_dict(json.loads(json.dumps(summary.to_dict())))
+    assert restored.to_dict() == summary.to_dict()
+    for key in zipf_stream(rng, 500):
+        restored.add(key)
+        truth[key] += 1
+    check_bounds(restored, truth)
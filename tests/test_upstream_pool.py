@@ -0,0 +1,150 @@
+"""上游代理池的选择、故障切换与健康探测"""
+
+import socket
+import threading
+
+import pytest
+from mitmproxy.flow import Error
+from mitmproxy.test import tflow
+
+from src.core.config import Config
+from src.handlers.upstream import UpstreamHandler
+from src.utils.upstream_pool import UpstreamHealthChecker, UpstreamMember, UpstreamPool, probe_upstream
+
+
+def make_pool(*latencies):
+    members = []
+    for n, latency in enumerate(latencies):
+        member = UpstreamMember(f"http://p{n}:3128")
+        if latency is not None:
+            member.record_success(latency)
+        members.append(member)
+    return UpstreamPool(members)
+
+
+def test_selects_lowest_latency_and_untested_first():
+    pool = make_pool(0.2, 0.05, 0.1)
+    assert pool.select().upstream == "http://p1:3128"
+    # 尚未测得延迟的成员视为 0，优先尝试
+    pool.members.append(UpstreamMember("http://new:3128"))
+    assert pool.select().upstream == "http://new:3128"
+
+
+def test_fails_over_and_recovers():
+    pool = make_pool(0.05, 0.2)
+    fast, slow = pool.members
+    fast.record_failure("refused")
+    assert pool.select() is slow
+    assert (fast.failures, fast.errors, fast.last_error) == (1, 1, "refused")
+    fast.record_success(0.05)
+    assert pool.select() is fast
+    assert fast.failures == 0 and fast.errors == 1
+
+
+def test_all_unhealthy_falls_back_to_oldest_failure():
+    pool = make_pool(0.1, 0.1)
+    first, second = pool.members
+    first.record_failure("down")
+    second.record_failure("down")
+    first.last_failure, second.last_failure = 200.0, 100.0
+    assert pool.select() is second
+    assert UpstreamPool([]).select() is None
+
+
+def test_latency_is_smoothed_with_ewma():
+    member = UpstreamMember("http://p:3128", alpha=0.5)
+    member.record_success(0.1)
+    member.record_success(0.3)
+    assert member.ewma == pytest.approx(0.2)
+    assert member.stats()["latency_ms"] == 200.0
+
+
+def test_copy_state():
+    old = UpstreamMember("http://p:3128")
+    old.record_failure("refused")
+    new = UpstreamMember("http://p:3128")
+    new.copy_state(old)
+    assert not new.healthy and new.errors == 1
+
+
+def serve_once(reply: bytes):
+    """在本地端口上回复一次 CONNECT，返回端口"""
+    server = socket.socket()
+    server.bind(("127.0.0.1", 0))
+    server.listen(1)
+
+    def run():
+        conn, _ = server.accept()
+        with conn:
+            conn.recv(1024)
+            conn.sendall(reply)
+        server.close()
+
+    threading.Thread(target=run, daemon=True).start()
+    return server.getsockname()[1]
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def test_probe_success_and_connect_refusal():
+    port = serve_once(b"HTTP/1.1 200 Connection established\r\n\r\n")
+    member = UpstreamMember(f"http://127.0.0.1:{port}")
+    probe_upstream(member, timeout=2, target="example.com:443")
+    assert member.healthy and member.ewma is not None
+
+    port = serve_once(b"HTTP/1.1 403 Forbidden\r\n\r\n")
+    member = UpstreamMember(f"http://127.0.0.1:{port}")
+    probe_upstream(member, timeout=2, target="example.com:443")
+    assert not member.healthy
+    assert member.last_error == "CONNECT failed: HTTP/1.1 403 Forbidden"
+
+
+def test_health_checker_marks_unreachable_upstream():
+    member = UpstreamMember(f"http://127.0.0.1:{free_port()}")
+    UpstreamHealthChecker(lambda: [member], timeout=1).check()
+    assert not member.healthy and member.errors == 1
+
+
+@pytest.fixture
+def handler(tmp_path, monkeypatch):
+    # 只测被动的健康记录，不启动后台探测
+    monkeypatch.setattr(UpstreamHealthChecker, "start", lambda self: None)
+    path = tmp_path / "config.yaml"
+    path.write_text('proxy:\n  upstream: "http://127.0.0.1:9"\n')
+    handler = UpstreamHandler(Config(str(path)))
+    yield handler
+    handler.stop()
+
+
+def routed_flow(handler):
+    flow = tflow.tflow()
+    handler.request(flow)
+    return flow, handler.config.upstream_router.members["http://127.0.0.1:9"]
+
+
+def test_handler_counts_only_connect_failures(handler):
+    flow, member = routed_flow(handler)
+    # 连接上游或 CONNECT 失败：服务端连接从未建立
+    flow.server_conn.timestamp_start = None
+    flow.error = Error("Connect call failed")
+    handler.error(flow)
+    assert member.errors == 1 and not member.healthy
+
+
+def test_handler_ignores_errors_after_tunnel_is_up(handler):
+    flow, member = routed_flow(handler)
+    flow.server_conn.timestamp_start = flow.request.timestamp_end + 0.01
+    flow.error = Error("Client disconnected.")
+    handler.error(flow)
+    assert member.errors == 0 and member.healthy
+
+
+def test_handler_records_tunnel_setup_latency(handler):
+    flow, member = routed_flow(handler)
+    flow.server_conn.timestamp_start = flow.request.timestamp_end + 0.05
+    handler.response(flow)
+    assert member.ewma == pytest.approx(0.05)